@@ -25,22 +25,37 @@ def main():
   python main.py auto             # 启动自动执行器
   python main.py watcher          # 启动文件监控器
   python main.py all              # 启动所有服务
+  python main.py maintenance      # 立即执行数据库维护（归档迁移、保留策略清理、空间回收）
+  python main.py maintenance --full-vacuum  # 完整 VACUUM 并切换为增量回收（阻塞写入，仅在维护窗口执行）
+  python main.py db backup [目录]   # 在线备份数据库（默认 data/backups/<时间戳>）
+  python main.py db export [文件]   # 导出任务、历史记录和配置为 NDJSON（默认 data/exports/<时间戳>.ndjson）
+  python main.py db import <文件>   # 从 NDJSON 导入
         """
     )
 
     parser.add_argument(
         'service',
-        choices=['web', 'bot', 'notifier', 'auto', 'watcher', 'all'],
-        help='要启动的服务'
+        choices=['web', 'bot', 'notifier', 'auto', 'watcher', 'all', 'maintenance', 'db'],
+        help='要启动的服务，或 db 数据库管理命令'
+    )
+    parser.add_argument(
+        'args',
+        nargs='*',
+        help='db 子命令及参数: backup [目录] | export [文件] | import <文件>'
+    )
+    parser.add_argument(
+        '--full-vacuum',
+        action='store_true',
+        help='maintenance 时对主库和冷库执行完整 VACUUM，旧数据库切换为增量回收模式（执行期间阻塞写入）'
     )
 
     args = parser.parse_args()
 
     if args.service == 'web':
-        from src.web.dashboard import app, logger, Config
+        from src.web.dashboard import create_app, logger, Config
         logger.info("启动 Web 管理界面...")
         logger.info(f"访问地址: http://{Config.WEB_HOST}:{Config.WEB_PORT}")
-        app.run(debug=Config.WEB_DEBUG, host=Config.WEB_HOST, port=Config.WEB_PORT)
+        create_app().run(debug=Config.WEB_DEBUG, host=Config.WEB_HOST, port=Config.WEB_PORT)
 
     elif args.service == 'bot':
         from src.services.bot_listener import main as bot_main
@@ -62,6 +77,61 @@ def main():
         from scripts.start_services import main as start_all
         start_all()
 
+    elif args.service == 'maintenance':
+        from src.core.database import Database
+        from src.services.db_maintenance import DatabaseMaintenance
+        results = DatabaseMaintenance(Database()).run_all()
+        retention = results.get('retention') or {}
+        print(f"归档迁移: {results.get('archive') or 0} 个任务")
+        print(f"过期数据删除: {retention.get('rows', {})}")
+        print(f"数据库回收: {retention.get('db_bytes', 0)} 字节，日志回收: {retention.get('log_bytes', 0)} 字节")
+        if args.full_vacuum:
+            db = Database()
+            for schema in ('main', 'archive'):
+                print(f"完整 VACUUM（{schema}）: 回收 {db.full_vacuum(schema)} 页")
+
+    elif args.service == 'db':
+        run_db_command(parser, args.args)
+
+
+def run_db_command(parser, argv):
+    """数据库管理命令"""
+    if not argv or argv[0] not in ('backup', 'export', 'import'):
+        parser.error('db 子命令必须是 backup、export 或 import')
+
+    from src.core.database import Database
+    from src.core import db_backup
+
+    command, rest = argv[0], argv[1:]
+    db = Database()
+
+    if command == 'backup':
+        paths = db_backup.backup_all(db, rest[0] if rest else None)
+        for path in paths:
+            print(f"已备份: {path}")
+
+    elif command == 'export':
+        # 日志会输出到标准输出，因此导出总是写入文件
+        if rest:
+            path = Path(rest[0])
+        else:
+            from datetime import datetime
+            path = Path('data/exports') / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.ndjson"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fp:
+            counts = db_backup.export_ndjson(db, fp)
+        print(f"已导出到 {path}: {counts}")
+
+    elif command == 'import':
+        if not rest:
+            parser.error('db import 需要指定文件')
+        if rest[0] == '-':
+            counts = db_backup.import_ndjson(db, sys.stdin)
+        else:
+            with open(rest[0], 'r', encoding='utf-8') as fp:
+                counts = db_backup.import_ndjson(db, fp)
+        print(f"已导入: {counts}")
+
 
 if __name__ == '__main__':
     main()
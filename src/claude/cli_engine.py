@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Claude CLI 子进程执行引擎
+
+所有 CLI 子进程由一个后台 asyncio 事件循环统一监管：非阻塞读取输出，
+按截止时间强制超时，超时后结束整个进程组（包括 CLI 启动的子进程）。
+调用方线程只需等待返回的 Future，不再各自阻塞在 readline() 上。
+"""
+import os
+import sys
+import time
+import codecs
+import signal
+import atexit
+import asyncio
+import threading
+import subprocess
+from src.core.logger import setup_logger
+
+logger = setup_logger('cli_engine', 'data/logs/claude_executor.log')
+
+
+class LineReader:
+    """从子进程输出流按行读取文本（分块读取，不受 StreamReader 单行长度上限限制）"""
+
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._buffer = ''
+        self._scanned = 0   # 缓冲区中已确认不含换行符的长度
+        self._eof = False
+
+    async def readline(self):
+        """
+        读取一行（包含换行符）
+
+        流结束时返回最后不以换行符结尾的内容，之后返回空字符串。
+        被取消（如等待超时）时已读取的数据保留在缓冲区中。
+        """
+        while True:
+            index = self._buffer.find('\n', self._scanned)
+            if index >= 0:
+                line, self._buffer = self._buffer[:index + 1], self._buffer[index + 1:]
+                self._scanned = 0
+                return line
+            self._scanned = len(self._buffer)
+            if self._eof:
+                line, self._buffer = self._buffer, ''
+                self._scanned = 0
+                return line
+            chunk = await self.stream.read(self.chunk_size)
+            self._buffer += self._decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                self._eof = True
+
+
+class CliEngine:
+    """基于 asyncio 的 CLI 子进程执行引擎（线程安全）"""
+
+    # 结束进程组后等待进程退出的秒数
+    KILL_WAIT = 5
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._processes = set()     # 正在运行的子进程
+
+    def _ensure_loop(self):
+        """首次使用时启动事件循环线程"""
+        with self._lock:
+            if self._loop is None:
+                if sys.platform == 'win32':
+                    # Proactor 事件循环才支持子进程
+                    self._loop = asyncio.ProactorEventLoop()
+                else:
+                    self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name='cli-engine', daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def submit(self, cmd, stdin_text, cwd, timeout, on_line=None):
+        """
+        提交一个 CLI 执行，立即返回 concurrent.futures.Future
+
+        Args:
+            cmd: 命令及参数列表
+            stdin_text: 写入标准输入的文本
+            cwd: 工作目录
+            timeout: 超时时间（秒），从启动进程开始计算
+            on_line: 每读到一行输出时的回调（在事件循环线程中调用，不能阻塞）
+
+        Returns:
+            Future: 结果为 {"success": bool, "output": str, "error": str, "first_output_ms": int}
+        """
+        return self.run_coroutine(self._run(cmd, stdin_text, cwd, timeout, on_line))
+
+    def run(self, cmd, stdin_text, cwd, timeout, on_line=None):
+        """执行 CLI 并等待结果（参数同 submit）"""
+        return self.submit(cmd, stdin_text, cwd, timeout, on_line).result()
+
+    def run_coroutine(self, coro):
+        """在引擎的事件循环中运行协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    async def spawn(self, cmd, cwd):
+        """
+        启动子进程（在事件循环中调用）
+
+        子进程成为新进程组的组长，便于超时后整组结束；进程退出后需调用 untrack。
+        """
+        process = await self._create_process(cmd, cwd)
+        self._processes.add(process)
+        return process
+
+    def untrack(self, process):
+        """不再跟踪已退出的子进程"""
+        self._processes.discard(process)
+
+    @staticmethod
+    async def _create_process(cmd, cwd):
+        if sys.platform == 'win32':
+            # Windows 上 claude 通常是 .cmd 脚本，需要通过 shell 启动
+            return await asyncio.create_subprocess_shell(
+                subprocess.list2cmdline(cmd),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                cwd=cwd,
+                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
+            )
+        return await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,
+            start_new_session=True
+        )
+
+    async def _run(self, cmd, stdin_text, cwd, timeout, on_line):
+        """执行 CLI 的协程"""
+        started = time.monotonic()
+        remaining = deadline_timer(timeout)
+
+        process = await self.spawn(cmd, cwd)
+        output = []
+        first_output_ms = None
+        # 写入标准输入与读取输出并行，避免双方都等待对方读取管道时卡住
+        writer = asyncio.ensure_future(self._write_stdin(process, stdin_text))
+        try:
+            reader = LineReader(process.stdout)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), remaining())
+                if not line:
+                    break
+                if first_output_ms is None:
+                    first_output_ms = int((time.monotonic() - started) * 1000)
+                self._emit(output, line, on_line)
+
+            await asyncio.wait_for(writer, remaining())
+            return_code = await asyncio.wait_for(process.wait(), remaining())
+            full_output = ''.join(output)
+            return {
+                "success": return_code == 0,
+                "output": full_output if return_code == 0 else None,
+                "error": full_output if return_code != 0 else None,
+                "first_output_ms": first_output_ms
+            }
+
+        except asyncio.TimeoutError:
+            await self.kill(process)
+            error_msg = f"执行超时（{timeout}秒）"
+            logger.error(f"{error_msg}，已结束进程组: {process.pid}")
+            return {"success": False, "output": None, "error": error_msg}
+
+        except asyncio.CancelledError:
+            await self.kill(process)
+            raise
+
+        except Exception as e:
+            await self.kill(process)
+            error_msg = f"读取输出失败: {str(e)}"
+            logger.error(error_msg)
+            return {"success": False, "output": None, "error": error_msg}
+
+        finally:
+            writer.cancel()
+            self.untrack(process)
+
+    @staticmethod
+    async def _write_stdin(process, stdin_text):
+        """写入标准输入并关闭（进程提前退出时忽略管道错误）"""
+        try:
+            if stdin_text:
+                process.stdin.write(stdin_text.encode('utf-8'))
+                await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning(f"子进程未读取完标准输入即退出: {process.pid}")
+
+    @staticmethod
+    def _emit(output, line, on_line):
+        """保存一行输出并调用回调（回调异常不影响读取）"""
+        output.append(line)
+        if on_line:
+            try:
+                on_line(line)
+            except Exception as e:
+                logger.error(f"处理输出行失败: {e}")
+
+    async def kill(self, process):
+        """结束子进程所在的进程组并等待其退出（在事件循环中调用）"""
+        if process.returncode is None:
+            if sys.platform == 'win32':
+                killer = await asyncio.create_subprocess_exec(
+                    'taskkill', '/F', '/T', '/PID', str(process.pid),
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+                await killer.wait()
+            else:
+                _kill_process_group(process.pid)
+        try:
+            await asyncio.wait_for(process.wait(), self.KILL_WAIT)
+        except asyncio.TimeoutError:
+            logger.error(f"子进程结束超时: {process.pid}")
+
+    def close(self):
+        """结束所有正在运行的子进程（进程退出时调用）"""
+        for process in list(self._processes):
+            if process.returncode is None:
+                if sys.platform == 'win32':
+                    subprocess.run(
+                        ['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                    )
+                else:
+                    _kill_process_group(process.pid)
+
+
+def deadline_timer(timeout):
+    """
+    返回计算剩余时间的函数（在事件循环中调用），超过截止时间后调用时抛出 asyncio.TimeoutError
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    def remaining():
+        left = deadline - loop.time()
+        if left <= 0:
+            raise asyncio.TimeoutError()
+        return left
+    return remaining
+
+
+def _kill_process_group(pid):
+    """向进程组发送 SIGKILL（进程组已不存在时忽略）"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """获取进程内共享的 CLI 执行引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = CliEngine()
+        return _engine
+
+
+@atexit.register
+def _close_engine():
+    if _engine is not None:
+        _engine.close()
@@ -2,91 +2,206 @@
 """
 Claude Code 执行器模块
 """
-import subprocess
-import sys
 import os
-from pathlib import Path
+import threading
+from contextlib import contextmanager
 from src.core.logger import setup_logger
+from src.core.task_store import TaskStore
 from src.core.database import Database
 from src.telegram.client import TelegramClient
 from src.managers.history_manager import HistoryManager
+from src.claude.prompt_builder import PromptAssembler
+from src.claude.cli_engine import get_engine
+from src.claude.progress_store import ProgressStore, SharedProgressStore
+from src.claude.warm_pool import get_warm_pool
 
 logger = setup_logger('claude_executor', 'data/logs/claude_executor.log')
 
+# 可用的 MCP 工具：(分类, [(名称, 说明, 相关关键词)])
+MCP_TOOLS = [
+    ("学术研究类", [
+        ("ArxivSearchMCP", "搜索 arXiv 论文", ("arxiv", "论文", "paper", "预印本")),
+        ("MedicalSearchMCP", "搜索医学文献 (PubMed)", ("pubmed", "医学", "medical", "临床", "文献")),
+        ("JournalAbstractAnalyzerMCP", "分析期刊摘要", ("期刊", "摘要", "journal", "abstract")),
+    ]),
+    ("文档处理类", [
+        ("DocumentConverterMCP", "文档格式转换 (PDF/DOCX/Markdown)",
+         ("pdf", "docx", "markdown", "转换", "格式", "convert")),
+        ("DocumentReviewerMCP", "文档审阅和评审", ("审阅", "评审", "审稿", "review", "文档")),
+    ]),
+    ("社交媒体类", [
+        ("BilibiliAnalyzerMCP", "B站视频分析", ("bilibili", "b站", "视频", "video")),
+        ("MoltbookMCP", "Moltbook 社区数据获取", ("moltbook", "社区")),
+    ]),
+]
+
+TELEGRAM_SEND_GUIDE = """## Telegram 文件发送功能
+
+如果任务需要发送文件到 Telegram，请创建一个特殊的标记文件：
+
+**发送文档/PDF/图片等文件：**
+在 OpenClawMail 目录下创建文件 `telegram_send_request.json`，内容格式：
+```json
+{
+  "type": "document",
+  "file_path": "绝对路径",
+  "caption": "可选的说明文字"
+}
+```
+
+支持的类型：
+- `document`: 发送任何文件（PDF、DOCX、ZIP等）
+- `message`: 发送纯文本消息
+
+示例：
+```json
+{
+  "type": "document",
+  "file_path": "C:/workspace/claudecodelabspace/SCI英文论文-active/output/main.pdf",
+  "caption": "这是你要的SCI论文PDF文件"
+}
+```
+
+创建此文件后，系统会自动检测并发送到 Telegram (Chat ID: 751182377)。
+
+"""
+
+# 超出 token 预算时使用的精简版 Telegram 文件发送说明
+TELEGRAM_SEND_GUIDE_COMPACT = """## Telegram 文件发送功能
+
+需要发送文件到 Telegram 时，在 OpenClawMail 目录下创建 `telegram_send_request.json`：
+`{"type": "document" 或 "message", "file_path": "绝对路径", "caption": "可选说明"}`，系统会自动发送。
+
+"""
+
+IMPORTANT_NOTES = """## 重要说明
+
+1. **MCP 工具按需使用**: 只在任务需要时才调用相应的 MCP 工具
+2. **Telegram 文件发送**: 使用上述 JSON 文件方式发送文件到 Telegram
+3. **工作目录**: 当前工作目录为 OpenClawMail 项目目录
+4. **文件操作**: 可以读写文件、执行命令等操作
+
+---
+
+# 用户任务
+
+"""
+
 class ClaudeExecutor:
     """Claude CLI 执行器"""
 
-    # 任务执行进度缓存（内存）
-    _task_progress = {}
+    # 任务执行进度缓存（内存，每个任务只保留最近的输出行，已结束的任务按时间和数量淘汰）
+    _progress = ProgressStore()
 
-    def __init__(self, db: Database, claude_cli_path='claude', workspace_dir=None, timeout=180):
+    # 执行中任务的心跳间隔（秒）
+    HEARTBEAT_INTERVAL = 10
+
+    def __init__(self, db: TaskStore, claude_cli_path='claude', workspace_dir=None, timeout=180,
+                 prompt_token_budget=4000, warm_pool_size=0, warm_pool_max_age=600,
+                 warm_pool_max_tasks=1, warm_pool_health_interval=30):
         """
         初始化 Claude 执行器
 
         Args:
-            db: 数据库实例
+            db: 任务存储（SQLite 或内存实现）
             claude_cli_path: Claude CLI 路径
             workspace_dir: 工作目录
             timeout: 超时时间（秒）
+            prompt_token_budget: 提示词的 token 预算（0 表示不限制）
+            warm_pool_size: 预热的 CLI 进程数（0 表示不启用预热进程池；首次执行任务时才启动，
+                只创建执行器而不执行任务的进程不会启动 CLI 进程）
+            warm_pool_max_age: 预热进程最长存活秒数
+            warm_pool_max_tasks: 每个预热进程最多执行的任务数
+            warm_pool_health_interval: 预热进程健康检查间隔（秒）
         """
         self.db = db
         self.claude_cli_path = claude_cli_path
         self.workspace_dir = workspace_dir or os.getcwd()
         self.timeout = timeout
+        self.prompt_token_budget = prompt_token_budget
         self.telegram = TelegramClient()
-        self.history_manager = HistoryManager()
+        # SQLite 存储时历史上下文与任务使用同一个数据库文件
+        self.history_manager = HistoryManager(db.db_path) if isinstance(db, Database) else HistoryManager()
+        self.engine = get_engine()
+        self.warm_pool = get_warm_pool(
+            self.engine,
+            claude_cli_path,
+            self.workspace_dir,
+            warm_pool_size,
+            max_age=warm_pool_max_age,
+            max_tasks=warm_pool_max_tasks,
+            health_interval=warm_pool_health_interval
+        )
+
+        ClaudeExecutor._use_progress_store(db)
+
+    @classmethod
+    def _use_progress_store(cls, db):
+        """
+        使进度缓存跟随任务存储（进度缓存按类共享，以最近创建的执行器的存储为准）
 
-    def execute_task(self, task_id, workspace_dir=None):
+        SQLite 存储时进度同时写入该数据库，其他进程（如 Web 管理界面）也能查看本进程执行的任务；
+        其他存储时只保存在内存中。
+        """
+        progress = cls._progress
+        if isinstance(db, Database):
+            if not (isinstance(progress, SharedProgressStore) and progress.pool is db.pool):
+                cls._progress = SharedProgressStore(db.db_path)
+        elif isinstance(progress, SharedProgressStore):
+            cls._progress = ProgressStore()
+
+    def execute_task(self, task_id, workspace_dir=None, claimed=False, worker_id='web'):
         """
         执行任务
 
         Args:
             task_id: 任务 ID
             workspace_dir: 工作目录（可选，覆盖默认值）
+            claimed: 任务是否已通过 claim_next_task 领取（已是处理中状态）
+            worker_id: 未领取时用于原子领取任务的执行者标识
 
         Returns:
             dict: 执行结果 {"success": bool, "output": str, "error": str}
         """
         try:
-            # 获取任务
-            task = self.db.get_task(task_id)
-            if not task:
-                return {"success": False, "error": "任务不存在"}
+            # 获取任务（未领取的任务先原子地领取，避免被重复执行）
+            if claimed:
+                task = self.db.get_task(task_id, full_output=False)
+                if not task:
+                    return {"success": False, "error": "任务不存在"}
+            else:
+                task = self.db.claim_task(task_id, worker_id)
+                if not task:
+                    return {"success": False, "error": "任务不存在或正在执行中"}
 
-            # 更新任务状态为处理中
-            self.db.update_status(task_id, '处理中')
             logger.info(f"开始执行任务: {task_id}")
 
             # 初始化进度缓存
-            ClaudeExecutor._task_progress[task_id] = {
-                'status': '处理中',
-                'lines': [],
-                'completed': False
-            }
+            ClaudeExecutor._progress.start(task_id)
 
-            # 执行 Claude CLI
-            result = self._execute_claude_cli(
-                task['message'],
-                workspace_dir or self.workspace_dir,
-                task_id=task_id
-            )
+            # 执行 Claude CLI（执行期间定期刷新心跳，表明任务仍在执行）
+            with self._heartbeat(task_id):
+                result = self._execute_claude_cli(
+                    task['message'],
+                    workspace_dir or self.workspace_dir,
+                    task_id=task_id
+                )
 
             # 更新任务状态
             if result['success']:
-                self.db.update_status(
+                # 等待状态写入落盘后再通知
+                self.db.update_status_async(
                     task_id,
                     '已完成',
                     result=result['output']
-                )
+                ).result()
                 logger.info(f"任务执行成功: {task_id}")
 
                 # 更新进度缓存
-                if task_id in ClaudeExecutor._task_progress:
-                    ClaudeExecutor._task_progress[task_id]['status'] = '已完成'
-                    ClaudeExecutor._task_progress[task_id]['completed'] = True
+                ClaudeExecutor._progress.finish(task_id, '已完成')
 
-                # 添加到历史上下文记录
-                self.history_manager.add_context_record(
+                # 添加到历史上下文记录（由写入队列批量提交，无需等待）
+                self.history_manager.add_context_record_async(
                     task_id,
                     task['message'],
                     result['output']
@@ -95,17 +210,15 @@ class ClaudeExecutor:
                 # 发送成功通知到 Telegram
                 self._send_telegram_notification(task_id, task, result, success=True)
             else:
-                self.db.update_status(
+                self.db.update_status_async(
                     task_id,
                     '失败',
                     error=result['error']
-                )
+                ).result()
                 logger.error(f"任务执行失败: {task_id}, 错误: {result['error']}")
 
                 # 更新进度缓存
-                if task_id in ClaudeExecutor._task_progress:
-                    ClaudeExecutor._task_progress[task_id]['status'] = '失败'
-                    ClaudeExecutor._task_progress[task_id]['completed'] = True
+                ClaudeExecutor._progress.finish(task_id, '失败')
 
                 # 发送失败通知到 Telegram
                 self._send_telegram_notification(task_id, task, result, success=False)
@@ -115,89 +228,104 @@ class ClaudeExecutor:
         except Exception as e:
             error_msg = f"执行任务异常: {str(e)}"
             logger.error(error_msg)
+            ClaudeExecutor._progress.finish(task_id, '失败')
             try:
                 self.db.update_status(task_id, '失败', error=error_msg)
             except:
                 pass
             return {"success": False, "error": error_msg}
 
-    def _build_context_prompt(self, user_message):
+    @contextmanager
+    def _heartbeat(self, task_id):
         """
-        构建包含上下文信息的完整提示
-
-        Args:
-            user_message: 用户的任务消息
+        执行期间每 HEARTBEAT_INTERVAL 秒刷新一次任务心跳（与 CLI 是否有输出无关）
 
-        Returns:
-            str: 包含上下文的完整提示
+        心跳经写入队列批量提交；执行器进程退出后心跳停止，
+        任务会被自动执行器的 release_stale_claims 重新置为待处理。
         """
-        context = """# 工作空间上下文信息
-
-## 可用的 MCP 工具
-
-你可以使用以下 MCP 工具来完成任务（按需使用）：
+        stop = threading.Event()
 
-### 学术研究类
-- **ArxivSearchMCP**: 搜索 arXiv 论文
-- **MedicalSearchMCP**: 搜索医学文献 (PubMed)
-- **JournalAbstractAnalyzerMCP**: 分析期刊摘要
+        def beat():
+            while not stop.wait(self.HEARTBEAT_INTERVAL):
+                self.db.heartbeat(task_id)
 
-### 文档处理类
-- **DocumentConverterMCP**: 文档格式转换 (PDF/DOCX/Markdown)
-- **DocumentReviewerMCP**: 文档审阅和评审
-
-### 社交媒体类
-- **BilibiliAnalyzerMCP**: B站视频分析
-- **MoltbookMCP**: Moltbook 社区数据获取
-
-## Telegram 文件发送功能
-
-如果任务需要发送文件到 Telegram，请创建一个特殊的标记文件：
-
-**发送文档/PDF/图片等文件：**
-在 OpenClawMail 目录下创建文件 `telegram_send_request.json`，内容格式：
-```json
-{
-  "type": "document",
-  "file_path": "绝对路径",
-  "caption": "可选的说明文字"
-}
-```
-
-支持的类型：
-- `document`: 发送任何文件（PDF、DOCX、ZIP等）
-- `message`: 发送纯文本消息
-
-示例：
-```json
-{
-  "type": "document",
-  "file_path": "C:/workspace/claudecodelabspace/SCI英文论文-active/output/main.pdf",
-  "caption": "这是你要的SCI论文PDF文件"
-}
-```
-
-创建此文件后，系统会自动检测并发送到 Telegram (Chat ID: 751182377)。
-
-"""
-        # 添加历史上下文（如果启用）
-        history_context = self.history_manager.build_history_context()
-        if history_context:
-            context += history_context
+        threading.Thread(target=beat, name=f'heartbeat-{task_id}', daemon=True).start()
+        try:
+            yield
+        finally:
+            stop.set()
 
-        context += """## 重要说明
+    def _build_context_prompt(self, user_message, task_id=None):
+        """
+        构建包含上下文信息的完整提示
 
-1. **MCP 工具按需使用**: 只在任务需要时才调用相应的 MCP 工具
-2. **Telegram 文件发送**: 使用上述 JSON 文件方式发送文件到 Telegram
-3. **工作目录**: 当前工作目录为 OpenClawMail 项目目录
-4. **文件操作**: 可以读写文件、执行命令等操作
+        超出 token 预算时依次压缩 MCP 工具说明、删除较早（或相关性较低）的历史记录、
+        精简 Telegram 文件发送说明；工作空间说明和用户任务始终完整保留。
 
----
+        Args:
+            user_message: 用户的任务消息
+            task_id: 任务 ID（用于记录提示词的估算 token 数）
 
-# 用户任务
+        Returns:
+            str: 包含上下文的完整提示
+        """
+        assembler = PromptAssembler(self.prompt_token_budget)
+        assembler.add('header', "# 工作空间上下文信息\n\n")
+        assembler.add(
+            'mcp_tools',
+            self._render_mcp_tools(),
+            self._render_mcp_tools(user_message),
+            self._render_mcp_tools(names_only=True),
+            priority=1
+        )
+        assembler.add('telegram', TELEGRAM_SEND_GUIDE, TELEGRAM_SEND_GUIDE_COMPACT, priority=3)
+
+        # 添加历史上下文（如果启用，按配置选取最近或与当前任务相关的记录）
+        history, intro = self.history_manager.get_context_records(user_message)
+        assembler.add_items(
+            'history',
+            history,
+            lambda records: self.history_manager.format_context(records, intro),
+            priority=2
+        )
+
+        assembler.add('notes', IMPORTANT_NOTES)
+        assembler.add('user_message', user_message)
+
+        prompt, tokens = assembler.build()
+        shrunk = assembler.shrunk_sections()
+        if shrunk:
+            logger.info(f"提示词超出预算 {self.prompt_token_budget}，已压缩: {shrunk}")
+        logger.info(f"提示词估算 token 数: {tokens}")
+        if task_id:
+            self.db.record_prompt_tokens(task_id, tokens)
+        return prompt
+
+    @staticmethod
+    def _render_mcp_tools(user_message=None, names_only=False):
+        """
+        渲染可用的 MCP 工具列表
 
-"""
-        return context + user_message
+        Args:
+            user_message: 提供时只保留与任务相关的工具说明，其余工具只列出名称
+            names_only: 所有工具都只列出名称
+        """
+        message = (user_message or '').lower()
+        text = "## 可用的 MCP 工具\n\n你可以使用以下 MCP 工具来完成任务（按需使用）：\n\n"
+        others = []
+        for category, tools in MCP_TOOLS:
+            lines = []
+            for name, description, keywords in tools:
+                if names_only or (user_message is not None and
+                                  not any(keyword in message for keyword in keywords)):
+                    others.append(name)
+                else:
+                    lines.append(f"- **{name}**: {description}\n")
+            if lines:
+                text += f"### {category}\n" + ''.join(lines) + "\n"
+        if others:
+            text += f"其他工具: {', '.join(others)}\n\n"
+        return text
 
     def _execute_claude_cli(self, message, workspace_dir, task_id=None):
         """
@@ -212,8 +340,12 @@ class ClaudeExecutor:
             dict: {"success": bool, "output": str, "error": str}
         """
         try:
+            # 首次执行任务时启动预热进程池，供后续任务使用
+            if self.warm_pool:
+                self.warm_pool.start()
+
             # 构建包含上下文的完整提示
-            full_prompt = self._build_context_prompt(message)
+            full_prompt = self._build_context_prompt(message, task_id)
 
             # 构建命令
             cmd = [
@@ -226,77 +358,24 @@ class ClaudeExecutor:
             logger.info(f"工作目录: {workspace_dir}")
             logger.info(f"任务内容: {message[:100]}...")
 
-            # 执行命令
-            # 统一使用 UTF-8 编码
-            process = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                cwd=workspace_dir,
-                text=True,
-                encoding='utf-8',
-                errors='replace',
-                shell=(sys.platform == 'win32'),
-                bufsize=1  # 行缓冲，支持实时输出
-            )
-
-            # 发送任务内容（包含上下文）
-            if process.stdin:
-                process.stdin.write(full_prompt)
-                process.stdin.close()
-
-            # 实时读取输出
-            output_lines = []
-            try:
-                import time
-                start_time = time.time()
-
-                while True:
-                    # 检查超时
-                    if time.time() - start_time > self.timeout:
-                        process.kill()
-                        error_msg = f"执行超时（{self.timeout}秒）"
-                        logger.error(error_msg)
-                        return {
-                            "success": False,
-                            "output": None,
-                            "error": error_msg
-                        }
-
-                    # 读取一行输出
-                    line = process.stdout.readline()
-                    if not line:
-                        # 检查进程是否结束
-                        if process.poll() is not None:
-                            break
-                        continue
-
-                    output_lines.append(line)
-                    # 缓存输出行（用于轮询获取）
-                    if task_id and task_id in ClaudeExecutor._task_progress:
-                        ClaudeExecutor._task_progress[task_id]['lines'].append(line.rstrip())
-                        logger.debug(f"缓存输出行 [{task_id}]: {line.rstrip()[:100]}")
-
-                # 获取返回码
-                return_code = process.wait()
-                full_output = ''.join(output_lines)
-
-                return {
-                    "success": return_code == 0,
-                    "output": full_output if return_code == 0 else None,
-                    "error": full_output if return_code != 0 else None
-                }
-
-            except Exception as e:
-                process.kill()
-                error_msg = f"读取输出失败: {str(e)}"
-                logger.error(error_msg)
-                return {
-                    "success": False,
-                    "output": None,
-                    "error": error_msg
-                }
+            def on_line(line):
+                # 缓存输出行（用于轮询获取）
+                if task_id:
+                    ClaudeExecutor._progress.append(task_id, line.rstrip())
+                    logger.debug(f"缓存输出行 [{task_id}]: {line.rstrip()[:100]}")
+
+            # 优先使用预热的进程（只能执行默认工作目录下的任务），没有就绪进程时冷启动
+            if self.warm_pool and os.path.abspath(workspace_dir) == self.warm_pool.cwd:
+                result = self.warm_pool.run(full_prompt, self.timeout, on_line=on_line)
+                if result is not None:
+                    logger.info(f"预热进程执行完成，首次输出耗时: {result.get('first_output_ms')} ms")
+                    return result
+                logger.info("没有就绪的预热进程，冷启动 Claude CLI")
+
+            # 由共享的事件循环执行并监管子进程（超时后结束整个进程组），本线程只等待结果
+            result = self.engine.run(cmd, full_prompt, workspace_dir, self.timeout, on_line=on_line)
+            logger.info(f"冷启动执行完成，首次输出耗时: {result.get('first_output_ms')} ms")
+            return result
 
         except Exception as e:
             error_msg = f"执行 Claude CLI 失败: {str(e)}"
@@ -345,17 +424,35 @@ class ClaudeExecutor:
         return text[:max_length] + "..." if len(text) > max_length else text
 
     @classmethod
-    def get_task_progress(cls, task_id):
+    def get_task_progress(cls, task_id, since=None):
         """
         获取任务执行进度
 
         Args:
             task_id: 任务 ID
+            since: 只返回行号大于 since 的输出行（None 表示返回保留的所有行）
+
+        Returns:
+            dict: 进度信息 {"status": str, "lines": list, "completed": bool,
+                  "total_lines": int, "dropped_lines": int, "next_line": int,
+                  "truncated": bool, "reset": bool}，lines 只包含最近的输出行
+        """
+        return cls._progress.get(task_id, since)
+
+    @classmethod
+    def wait_task_progress(cls, task_id, since, timeout):
+        """
+        等待任务的新输出行或任务结束（用于 Server-Sent Events 推送）
+
+        Args:
+            task_id: 任务 ID
+            since: 已读取到的行号
+            timeout: 最长等待秒数
 
         Returns:
-            dict: 进度信息 {"status": str, "lines": list, "completed": bool}
+            dict: 同 get_task_progress(task_id, since)；任务进度不存在时返回 None
         """
-        return cls._task_progress.get(task_id, None)
+        return cls._progress.wait(task_id, since, timeout)
 
     @classmethod
     def clear_task_progress(cls, task_id):
@@ -365,5 +462,26 @@ class ClaudeExecutor:
         Args:
             task_id: 任务 ID
         """
-        if task_id in cls._task_progress:
-            del cls._task_progress[task_id]
+        cls._progress.clear(task_id)
+
+    @classmethod
+    def get_progress_stats(cls):
+        """
+        获取进度缓存的内存占用统计
+
+        Returns:
+            dict: {"tasks", "running", "lines", "bytes", "max_bytes", "max_lines",
+                   "evicted_tasks", "dropped_lines"}
+        """
+        return cls._progress.stats()
+
+    def get_warm_pool_stats(self):
+        """
+        获取预热进程池统计
+
+        Returns:
+            dict: {"enabled": bool, ...}，启用时包含 WarmPool.stats() 的各项统计
+        """
+        if not self.warm_pool:
+            return {"enabled": False}
+        return {"enabled": True, **self.warm_pool.stats()}
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+任务执行进度存储（内存）
+
+每个任务只保留最近的若干行输出（环形缓冲），所有任务的输出总量有字节上限；
+已结束的任务超过保留时间或超出保留数量时按最近最少访问的顺序淘汰。
+
+输出行按任务内的累计行号（从 1 开始）编号，读取方可以只获取某个行号之后的新行，
+或阻塞等待新行（用于 Server-Sent Events 推送）。
+
+SharedProgressStore 同时把进度写入 SQLite，供其他进程读取。
+"""
+import sys
+import time
+import threading
+from itertools import islice
+from datetime import datetime, timedelta
+from collections import OrderedDict, deque
+from src.core.db_pool import get_pool
+from src.core.write_queue import get_write_queue
+from src.core.migrations import run_migrations
+from src.core.logger import setup_logger
+
+logger = setup_logger('progress_store', 'data/logs/claude_executor.log')
+
+
+class ProgressStore:
+    """有界的任务进度存储（线程安全）"""
+
+    def __init__(self, max_lines=1000, max_bytes=16 * 1024 * 1024, ttl=600, max_finished=100):
+        """
+        Args:
+            max_lines: 每个任务保留的最近输出行数
+            max_bytes: 所有任务输出行占用内存的上限（字节）
+            ttl: 已结束任务的进度保留秒数
+            max_finished: 最多保留的已结束任务数
+        """
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)   # 有新输出、任务结束或进度被清除时通知
+        self._entries = OrderedDict()   # 任务 ID -> 进度，按最近访问排序（最久未访问的在前）
+        self._bytes = 0
+        self._evicted_tasks = 0
+        self._dropped_lines = 0
+
+    def start(self, task_id):
+        """开始记录任务进度（已有的进度被重置）"""
+        with self._lock:
+            self._remove(task_id)
+            self._entries[task_id] = {
+                'status': '处理中',
+                'lines': deque(),
+                'completed': False,
+                'total_lines': 0,       # 累计输出行数（包括已丢弃的行）
+                'bytes': 0,
+                'finished_at': None,
+            }
+            self._evict()
+            self._changed.notify_all()
+
+    def append(self, task_id, line):
+        """追加一行输出（任务未开始记录时忽略）"""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return
+            self._entries.move_to_end(task_id)
+            size = sys.getsizeof(line)
+            entry['lines'].append((line, size))
+            entry['total_lines'] += 1
+            entry['bytes'] += size
+            self._bytes += size
+            if len(entry['lines']) > self.max_lines:
+                self._drop_oldest(entry)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._changed.notify_all()
+
+    def finish(self, task_id, status):
+        """标记任务结束"""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return
+            entry['status'] = status
+            entry['completed'] = True
+            entry['finished_at'] = time.monotonic()
+            self._evict()
+            self._changed.notify_all()
+
+    def get(self, task_id, since=None):
+        """
+        获取任务进度
+
+        Args:
+            task_id: 任务 ID
+            since: 只返回行号大于 since 的输出行（None 表示返回保留的所有行）
+
+        Returns:
+            dict: {"status", "lines", "completed", "total_lines", "dropped_lines", "next_line",
+                   "truncated", "reset"}，不存在时返回 None
+        """
+        with self._lock:
+            self._evict()
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(task_id)
+            return self._snapshot(entry, since)
+
+    def wait(self, task_id, since, timeout):
+        """
+        等待行号 since 之后的新输出行或任务结束
+
+        Args:
+            task_id: 任务 ID
+            since: 已读取到的行号
+            timeout: 最长等待秒数
+
+        Returns:
+            dict: 同 get(task_id, since)；超时时 lines 为空，任务进度不存在时返回 None
+        """
+        def ready():
+            entry = self._entries.get(task_id)
+            return entry is not None and (entry['total_lines'] != since or entry['completed'])
+
+        with self._changed:
+            self._changed.wait_for(ready, timeout)
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(task_id)
+            return self._snapshot(entry, since)
+
+    @staticmethod
+    def _snapshot(entry, since):
+        """
+        生成进度的副本（调用方持有锁）
+
+        since 早于最旧的保留行时从最旧的保留行开始返回（truncated 为 True）；
+        since 大于累计行数说明任务被重新执行、进度已重置，从头返回（reset 为 True）。
+        """
+        total = entry['total_lines']
+        first = total - len(entry['lines'])    # 最旧的保留行之前的行号
+        reset = since is not None and since > total
+        start = first if since is None or reset else max(since, first)
+        lines = [line for line, _ in islice(entry['lines'], start - first, None)]
+        return {
+            'status': entry['status'],
+            'lines': lines,
+            'completed': entry['completed'],
+            'total_lines': total,
+            'dropped_lines': first,
+            'next_line': total,
+            'truncated': since is not None and not reset and since < first,
+            'reset': reset,
+        }
+
+    def clear(self, task_id):
+        """清除任务进度"""
+        with self._lock:
+            self._remove(task_id)
+            self._changed.notify_all()
+
+    def stats(self):
+        """内存占用统计"""
+        with self._lock:
+            self._evict()
+            running = sum(1 for entry in self._entries.values() if not entry['completed'])
+            return {
+                'tasks': len(self._entries),
+                'running': running,
+                'lines': sum(len(entry['lines']) for entry in self._entries.values()),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_lines': self.max_lines,
+                'evicted_tasks': self._evicted_tasks,
+                'dropped_lines': self._dropped_lines,
+            }
+
+    def _remove(self, task_id):
+        """删除任务进度（调用方持有锁）"""
+        entry = self._entries.pop(task_id, None)
+        if entry is not None:
+            self._bytes -= entry['bytes']
+        return entry
+
+    def _drop_oldest(self, entry):
+        """丢弃任务最旧的一行输出（调用方持有锁）"""
+        _, size = entry['lines'].popleft()
+        entry['bytes'] -= size
+        self._bytes -= size
+        self._dropped_lines += 1
+
+    def _evict(self):
+        """
+        淘汰过期和超出限制的进度（调用方持有锁）
+
+        先删除超过保留时间的已结束任务，再按最近最少访问的顺序删除超出数量或字节上限的已结束任务；
+        仍超出字节上限时，从占用最多的执行中任务丢弃最旧的输出行。
+        """
+        now = time.monotonic()
+        finished = [
+            task_id for task_id, entry in self._entries.items() if entry['completed']
+        ]
+        for task_id in finished:
+            if now - self._entries[task_id]['finished_at'] >= self.ttl:
+                self._remove(task_id)
+                self._evicted_tasks += 1
+        finished = [task_id for task_id in finished if task_id in self._entries]
+
+        excess = len(finished) - self.max_finished
+        for task_id in finished:
+            if excess <= 0 and self._bytes <= self.max_bytes:
+                break
+            self._remove(task_id)
+            self._evicted_tasks += 1
+            excess -= 1
+
+        while self._bytes > self.max_bytes and self._entries:
+            largest = max(self._entries.values(), key=lambda entry: entry['bytes'])
+            if not largest['lines']:
+                break
+            # 批量丢弃，避免每行都重新查找占用最多的任务
+            for _ in range(max(len(largest['lines']) // 10, 1)):
+                self._drop_oldest(largest)
+                if self._bytes <= self.max_bytes:
+                    break
+
+
+class SharedProgressStore(ProgressStore):
+    """
+    跨进程共享的任务进度存储
+
+    本进程执行的任务仍保存在内存中（读取和等待新行不访问数据库），输出行同时经写入队列
+    批量写入 SQLite（WAL 模式）的 task_progress_lines 表；其他进程执行的任务按行号从数据库增量读取，
+    例如 Web 管理界面可以查看自动执行器进程中正在执行的任务。
+    """
+
+    # 等待其他进程的任务输出新行时，查询数据库的间隔（秒）
+    POLL_INTERVAL = 0.5
+
+    # 未结束但超过该秒数没有更新的任务进度（执行进程异常退出）在清理时删除
+    STALE_SECONDS = 86400
+
+    def __init__(self, db_path="data/tasks.db", **kwargs):
+        """
+        Args:
+            db_path: 数据库路径
+            kwargs: 内存部分的限制，同 ProgressStore；数据库中每个任务同样只保留最近 max_lines 行，
+                    已结束的任务保留 ttl 秒
+        """
+        super().__init__(**kwargs)
+        self.pool = get_pool(db_path)
+        self.writer = get_write_queue(db_path)
+        run_migrations(self.pool)
+        self._spool_lock = threading.Lock()
+        self._spool = {}            # 任务 ID -> 等待写入的 [(行号, 行)]，存在即表示已提交写操作
+        self._line_numbers = {}     # 执行中任务 ID -> 已分配的行号
+
+    def start(self, task_id):
+        """开始记录任务进度（已有的进度被重置）"""
+        super().start(task_id)
+        with self._spool_lock:
+            self._spool.pop(task_id, None)
+            self._line_numbers[task_id] = 0
+        self.writer.submit(self._write_start, task_id)
+
+    def append(self, task_id, line):
+        """追加一行输出；同一任务连续的多行合并为一次写操作"""
+        super().append(task_id, line)
+        with self._spool_lock:
+            if task_id not in self._line_numbers:
+                return
+            self._line_numbers[task_id] += 1
+            pending = self._spool.get(task_id)
+            schedule = pending is None
+            if schedule:
+                pending = self._spool[task_id] = []
+            pending.append((self._line_numbers[task_id], line))
+        if schedule:
+            self.writer.submit(self._write_lines, task_id)
+
+    def finish(self, task_id, status):
+        """标记任务结束"""
+        super().finish(task_id, status)
+        with self._spool_lock:
+            if self._line_numbers.pop(task_id, None) is None:
+                return
+        self.writer.submit(self._write_finish, task_id, status)
+
+    def clear(self, task_id):
+        """清除任务进度（包括数据库中的进度）"""
+        super().clear(task_id)
+        self.writer.submit(self._write_clear, task_id)
+
+    def get(self, task_id, since=None):
+        """获取任务进度（本进程没有时从数据库读取），参数和返回值同 ProgressStore.get"""
+        progress = super().get(task_id, since)
+        if progress is None:
+            progress = self._load(task_id, since)
+        return progress
+
+    def wait(self, task_id, since, timeout):
+        """
+        等待新输出行或任务结束，参数和返回值同 ProgressStore.wait
+
+        本进程的任务由条件变量唤醒；其他进程的任务每隔 POLL_INTERVAL 秒查询一次数据库。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            with self._lock:
+                local = task_id in self._entries
+            if local:
+                return super().wait(task_id, since, max(remaining, 0))
+
+            progress = self._load(task_id, since)
+            if remaining <= 0 or (
+                progress is not None and (progress['total_lines'] != since or progress['completed'])
+            ):
+                return progress
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+
+    def stats(self):
+        """内存占用统计，另含数据库中的任务数和等待写入的行数"""
+        stats = super().stats()
+        with self._spool_lock:
+            stats['spool_lines'] = sum(len(pending) for pending in self._spool.values())
+        try:
+            with self.pool.connection() as conn:
+                stats['shared_tasks'] = conn.execute('SELECT COUNT(*) FROM task_progress').fetchone()[0]
+        except Exception as e:
+            logger.error(f"统计共享任务进度失败: {e}")
+        return stats
+
+    def _load(self, task_id, since):
+        """从数据库读取任务进度（一条语句读取，状态和输出行来自同一快照）"""
+        try:
+            with self.pool.connection() as conn:
+                rows = self._query_lines(conn, task_id, since or 0)
+                if rows and since is not None and since > rows[0]['total_lines']:
+                    rows = self._query_lines(conn, task_id, 0)
+        except Exception as e:
+            logger.error(f"读取共享任务进度失败: {task_id}, {e}")
+            return None
+        if not rows:
+            return None
+
+        head = rows[0]
+        total = head['total_lines']
+        first = max(total - self.max_lines, 0)      # 最旧的保留行之前的行号
+        reset = since is not None and since > total
+        return {
+            'status': head['status'],
+            'lines': [row['line'] for row in rows if row['line_no'] is not None],
+            'completed': bool(head['completed']),
+            'total_lines': total,
+            'dropped_lines': first,
+            'next_line': total,
+            'truncated': since is not None and not reset and since < first,
+            'reset': reset,
+        }
+
+    @staticmethod
+    def _query_lines(conn, task_id, since):
+        """按主键范围读取行号大于 since 的输出行（没有新行时返回只含状态的一行）"""
+        return conn.execute('''
+            SELECT p.status, p.completed, p.total_lines, l.line_no, l.line
+            FROM task_progress p
+            LEFT JOIN task_progress_lines l
+                ON l.task_id = p.task_id AND l.line_no > ? AND l.line_no <= p.total_lines
+            WHERE p.task_id = ?
+            ORDER BY l.line_no
+        ''', (since, task_id)).fetchall()
+
+    def _write_start(self, task_id):
+        """写入任务进度的初始状态（在写线程中执行）"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO task_progress (task_id, status, completed, total_lines, updated_at)
+                VALUES (?, '处理中', 0, 0, ?)
+            ''', (task_id, datetime.now().isoformat()))
+            conn.execute('DELETE FROM task_progress_lines WHERE task_id = ?', (task_id,))
+
+    def _write_lines(self, task_id):
+        """写入等待中的输出行，并删除超出保留行数的旧行（在写线程中执行）"""
+        with self._spool_lock:
+            pending = self._spool.pop(task_id, None)
+        if not pending:
+            return
+        total = pending[-1][0]
+        with self.pool.connection() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO task_progress_lines (task_id, line_no, line) VALUES (?, ?, ?)',
+                [(task_id, line_no, line) for line_no, line in pending]
+            )
+            conn.execute(
+                'UPDATE task_progress SET total_lines = ?, updated_at = ? WHERE task_id = ?',
+                (total, datetime.now().isoformat(), task_id)
+            )
+            conn.execute(
+                'DELETE FROM task_progress_lines WHERE task_id = ? AND line_no <= ?',
+                (task_id, total - self.max_lines)
+            )
+
+    def _write_finish(self, task_id, status):
+        """写入任务结束状态，并清理过期的任务进度（在写线程中执行）"""
+        self._write_lines(task_id)
+        now = datetime.now()
+        with self.pool.connection() as conn:
+            conn.execute(
+                'UPDATE task_progress SET status = ?, completed = 1, updated_at = ? WHERE task_id = ?',
+                (status, now.isoformat(), task_id)
+            )
+            expired = [(row[0],) for row in conn.execute('''
+                SELECT task_id FROM task_progress
+                WHERE (completed = 1 AND updated_at < ?) OR updated_at < ?
+            ''', (
+                (now - timedelta(seconds=self.ttl)).isoformat(),
+                (now - timedelta(seconds=self.STALE_SECONDS)).isoformat()
+            ))]
+            if expired:
+                conn.executemany('DELETE FROM task_progress_lines WHERE task_id = ?', expired)
+                conn.executemany('DELETE FROM task_progress WHERE task_id = ?', expired)
+
+    def _write_clear(self, task_id):
+        """删除任务进度（在写线程中执行）"""
+        with self.pool.connection() as conn:
+            conn.execute('DELETE FROM task_progress_lines WHERE task_id = ?', (task_id,))
+            conn.execute('DELETE FROM task_progress WHERE task_id = ?', (task_id,))
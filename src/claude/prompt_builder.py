@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+提示词组装模块 - 在 token 预算内拼接 Claude CLI 的提示词
+
+各部分按优先级压缩：先压缩低优先级部分（如 MCP 工具说明、较早的历史记录），
+直到估算的 token 数不超过预算。
+"""
+import re
+from src.core.logger import setup_logger
+
+logger = setup_logger('prompt_builder', 'data/logs/claude_executor.log')
+
+# CJK 字符（中日韩统一表意文字、假名、谚文、全角标点）
+_CJK_PATTERN = re.compile(r'[　-〿぀-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯]')
+
+
+def estimate_tokens(text):
+    """
+    快速估算文本的 token 数（本地计算，不调用分词器）
+
+    CJK 字符大约每个字一个 token，其余字符大约每 4 个一个 token。
+
+    Examples:
+        >>> estimate_tokens("整理论文 summary")
+        6
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class PromptSection:
+    """提示词的一个部分，variants 按从完整到最精简排列"""
+
+    def __init__(self, name, variants, priority=None):
+        self.name = name
+        self.variants = variants
+        self.priority = priority    # None 表示必需部分，不压缩
+        self.level = 0              # 当前使用的 variant 下标
+        self._tokens = {}
+
+    @property
+    def text(self):
+        return self.variants[self.level]
+
+    @property
+    def tokens(self):
+        if self.level not in self._tokens:
+            self._tokens[self.level] = estimate_tokens(self.text)
+        return self._tokens[self.level]
+
+    def can_shrink(self):
+        return self.priority is not None and self.level < len(self.variants) - 1
+
+
+class PromptAssembler:
+    """按 token 预算组装提示词"""
+
+    def __init__(self, budget):
+        """
+        Args:
+            budget: token 预算（0 或 None 表示不限制）
+        """
+        self.budget = budget
+        self.sections = []
+
+    def add(self, name, *variants, priority=None):
+        """
+        添加一个部分
+
+        Args:
+            name: 部分名称
+            variants: 从完整到最精简的文本，空字符串表示可以整体删除
+            priority: 优先级，数值越小越先被压缩；None 表示必需部分
+        """
+        self.sections.append(PromptSection(name, list(variants) or [''], priority))
+        return self
+
+    def add_items(self, name, items, render, priority):
+        """
+        添加由多条记录组成的部分，超出预算时从末尾开始逐条删除
+
+        Args:
+            name: 部分名称
+            items: 记录列表（越靠后越先被删除）
+            render: 把记录列表渲染为文本的函数
+            priority: 优先级
+        """
+        variants = [render(items[:count]) for count in range(len(items), -1, -1)]
+        return self.add(name, *variants, priority=priority)
+
+    def build(self):
+        """
+        组装提示词
+
+        Returns:
+            tuple: (提示词, 估算的 token 数)
+        """
+        total = sum(section.tokens for section in self.sections)
+        while self.budget and total > self.budget:
+            candidates = [section for section in self.sections if section.can_shrink()]
+            if not candidates:
+                logger.warning(f"提示词必需部分已超出 token 预算: {total} > {self.budget}")
+                break
+            # 同优先级时先压缩靠后的部分
+            section = min(reversed(candidates), key=lambda s: s.priority)
+            total -= section.tokens
+            section.level += 1
+            total += section.tokens
+
+        text = ''.join(section.text for section in self.sections)
+        return text, estimate_tokens(text)
+
+    def shrunk_sections(self):
+        """被压缩过的部分 {名称: 压缩级别}"""
+        return {section.name: section.level for section in self.sections if section.level}
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+Claude CLI 预热进程池
+
+预先启动若干以流式输入模式（--input-format stream-json）运行的 CLI 进程，
+进程完成启动（加载运行时、读取配置、连接 MCP 服务器）后空闲等待；新任务到来时
+把提示词作为一条用户消息写入空闲进程的标准输入，省去每个任务的启动耗时。
+
+进程执行完 max_tasks 个任务、存活超过 max_age 秒或 Claude 配置文件（如 cc-switch
+切换配置后的 settings.json）被修改后不再使用，由后台维护协程补充新进程。
+没有就绪的进程时返回 None，由调用方按原方式冷启动 CLI。
+
+进程池的状态只在 CLI 执行引擎的事件循环线程中修改。
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from pathlib import Path
+from src.core.logger import setup_logger
+from src.claude.cli_engine import CliEngine, LineReader, deadline_timer
+
+logger = setup_logger('warm_pool', 'data/logs/claude_executor.log')
+
+# 预热进程启动参数（追加在 CLI 基础命令之后）
+STREAM_ARGS = ['--input-format', 'stream-json', '--output-format', 'stream-json', '--verbose']
+
+
+def claude_config_files(workspace_dir):
+    """修改后需要重启预热进程的 Claude 配置文件"""
+    return [
+        Path.home() / ".claude" / "settings.json",
+        Path.home() / ".claude.json",
+        Path(workspace_dir) / ".mcp.json",
+        Path(workspace_dir) / ".claude" / "settings.json",
+    ]
+
+
+def format_user_message(prompt):
+    """把提示词编码为流式输入的一条用户消息（一行 JSON）"""
+    message = {
+        "type": "user",
+        "message": {"role": "user", "content": [{"type": "text", "text": prompt}]}
+    }
+    return json.dumps(message, ensure_ascii=False) + '\n'
+
+
+def parse_event(line):
+    """
+    解析流式输出的一行事件
+
+    Returns:
+        tuple: (用于显示进度的文本行列表, result 事件或 None)；
+               非 JSON 的行（如 CLI 的警告信息）原样作为进度行
+    """
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return ([line] if line.strip() else []), None
+    if not isinstance(event, dict):
+        return [], None
+
+    if event.get('type') == 'result':
+        return [], event
+    if event.get('type') != 'assistant':
+        return [], None
+
+    lines = []
+    for block in (event.get('message') or {}).get('content') or []:
+        if block.get('type') == 'text' and block.get('text'):
+            lines.extend(block['text'].splitlines(keepends=True))
+            if not lines[-1].endswith('\n'):
+                lines[-1] += '\n'
+        elif block.get('type') == 'tool_use':
+            lines.append(f"[调用工具] {block.get('name', '')}\n")
+    return lines, None
+
+
+class _Worker:
+    """一个预热的 CLI 进程"""
+
+    def __init__(self, process):
+        self.process = process
+        self.reader = LineReader(process.stdout)
+        self.spawned_at = time.time()
+        self.tasks = 0
+
+
+class WarmPool:
+    """预热的 Claude CLI 进程池（线程安全，任务在 CLI 执行引擎的事件循环中执行）"""
+
+    def __init__(self, engine, cmd, cwd, size, max_age=600, max_tasks=1, health_interval=30,
+                 watch_files=None):
+        """
+        Args:
+            engine: CLI 执行引擎
+            cmd: 启动预热进程的完整命令
+            cwd: 工作目录（预热进程只能执行该目录下的任务）
+            size: 保持空闲的进程数
+            max_age: 进程最长存活秒数，超过后不再分配任务
+            max_tasks: 每个进程最多执行的任务数（大于 1 时后续任务与之前的任务处于同一会话）
+            health_interval: 健康检查和补充进程的间隔（秒）
+            watch_files: 修改后需要重启进程的配置文件
+        """
+        self.engine = engine
+        self.cmd = list(cmd)
+        self.cwd = cwd
+        self.size = size
+        self.max_age = max_age
+        self.max_tasks = max(max_tasks, 1)
+        self.health_interval = health_interval
+        self.watch_files = list(watch_files if watch_files is not None else claude_config_files(cwd))
+
+        self._idle = deque()
+        self._spawning = 0
+        self._background = set()    # 正在启动或退出进程的后台任务
+        self._wakeup = None
+        self._backoff_until = 0     # 启动失败后暂停补充进程，直到该时间（time.monotonic）
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        self.served = 0             # 由预热进程执行的任务数
+        self.fallbacks = 0          # 没有就绪进程、需要冷启动的次数
+        self.spawned = 0
+        self.retired = 0
+        self.failures = 0           # 启动失败或空闲时意外退出的进程数
+        self._first_output_total = 0
+        self._first_output_count = 0
+
+    def start(self):
+        """启动后台维护协程（重复调用无影响）"""
+        with self._start_lock:
+            if not self._started:
+                self._started = True
+                self.engine.run_coroutine(self._maintain())
+                logger.info(f"预热进程池已启动: {self.size} 个进程, 工作目录 {self.cwd}")
+
+    def run(self, prompt, timeout, on_line=None):
+        """
+        使用预热进程执行任务并等待结果
+
+        Args:
+            prompt: 提示词
+            timeout: 超时时间（秒），从分配进程开始计算
+            on_line: 每个进度行的回调（在事件循环线程中调用，不能阻塞）
+
+        Returns:
+            dict: {"success": bool, "output": str, "error": str, "first_output_ms": int}；
+                  没有就绪的预热进程时返回 None
+        """
+        self.start()
+        return self.engine.run_coroutine(self._run(prompt, timeout, on_line)).result()
+
+    def stats(self):
+        """
+        进程池统计
+
+        Returns:
+            dict: {"size", "idle", "spawning", "served", "fallbacks", "spawned",
+                   "retired", "failures", "avg_first_output_ms"}
+        """
+        count = self._first_output_count
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "spawning": self._spawning,
+            "served": self.served,
+            "fallbacks": self.fallbacks,
+            "spawned": self.spawned,
+            "retired": self.retired,
+            "failures": self.failures,
+            "avg_first_output_ms": round(self._first_output_total / count) if count else None,
+        }
+
+    def recycle(self):
+        """结束所有空闲进程并重新预热（如切换 Claude 配置后调用）"""
+        if self._started:
+            self.engine.run_coroutine(self._recycle()).result()
+
+    async def _recycle(self):
+        while self._idle:
+            self._retire(self._idle.popleft())
+        self._backoff_until = 0
+        self._wakeup.set()
+
+    async def _maintain(self):
+        """定期检查空闲进程的健康状态并补充到 size 个"""
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                self._check_health()
+                if time.monotonic() >= self._backoff_until:
+                    while len(self._idle) + self._spawning < self.size:
+                        self._spawning += 1
+                        self._in_background(self._spawn_worker())
+            except Exception as e:
+                logger.error(f"维护预热进程池失败: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.health_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _check_health(self):
+        """移除不能再使用的空闲进程"""
+        for worker in list(self._idle):
+            reason = self._unhealthy_reason(worker)
+            if reason:
+                self._idle.remove(worker)
+                logger.info(f"预热进程 {worker.process.pid} 不再使用: {reason}")
+                if worker.process.returncode is not None and not worker.tasks:
+                    self._spawn_failed()
+                self._retire(worker)
+
+    def _unhealthy_reason(self, worker):
+        """返回进程不能再使用的原因，可以使用时返回 None"""
+        if worker.process.returncode is not None:
+            return f"进程已退出（退出码 {worker.process.returncode}）"
+        if self.max_age and time.time() - worker.spawned_at > self.max_age:
+            return "超过最长存活时间"
+        for path in self.watch_files:
+            try:
+                if path.stat().st_mtime > worker.spawned_at:
+                    return f"配置文件已修改: {path}"
+            except OSError:
+                continue
+        return None
+
+    async def _spawn_worker(self):
+        try:
+            process = await self.engine.spawn(self.cmd, self.cwd)
+        except Exception as e:
+            logger.error(f"启动预热进程失败: {e}")
+            self._spawn_failed()
+            return
+        finally:
+            self._spawning -= 1
+        self.spawned += 1
+        self._idle.append(_Worker(process))
+        logger.debug(f"预热进程已启动: {process.pid}")
+
+    def _spawn_failed(self):
+        self.failures += 1
+        self._backoff_until = time.monotonic() + self.health_interval
+
+    def _acquire(self):
+        """取出一个可用的空闲进程（先启动的先使用）"""
+        while self._idle:
+            worker = self._idle.popleft()
+            reason = self._unhealthy_reason(worker)
+            if not reason:
+                return worker
+            logger.info(f"预热进程 {worker.process.pid} 不再使用: {reason}")
+            self._retire(worker)
+        return None
+
+    async def _run(self, prompt, timeout, on_line):
+        """在预热进程中执行任务的协程"""
+        worker = self._acquire()
+        if self._wakeup:
+            # 立即补充被取走的进程
+            self._wakeup.set()
+        if worker is None:
+            self.fallbacks += 1
+            return None
+
+        process = worker.process
+        worker.tasks += 1
+        self.served += 1
+        started = time.monotonic()
+        remaining = deadline_timer(timeout)
+        output = []
+        first_output_ms = None
+        reusable = False
+        try:
+            process.stdin.write(format_user_message(prompt).encode('utf-8'))
+            await asyncio.wait_for(process.stdin.drain(), remaining())
+            if worker.tasks >= self.max_tasks:
+                # 不再分配任务：关闭标准输入，CLI 输出结果后自行退出
+                process.stdin.close()
+
+            while True:
+                line = await asyncio.wait_for(worker.reader.readline(), remaining())
+                if not line:
+                    error = ''.join(output) or f"预热进程意外退出: {process.pid}"
+                    return {"success": False, "output": None, "error": error,
+                            "first_output_ms": first_output_ms}
+                lines, result = parse_event(line)
+                for text in lines:
+                    if first_output_ms is None:
+                        first_output_ms = int((time.monotonic() - started) * 1000)
+                        self._first_output_total += first_output_ms
+                        self._first_output_count += 1
+                    CliEngine._emit(output, text, on_line)
+                if result is not None:
+                    break
+
+            text = result.get('result')
+            if text is None:
+                text = ''.join(output)
+            if result.get('is_error') or result.get('subtype', 'success') != 'success':
+                return {"success": False, "output": None,
+                        "error": text or f"执行失败: {result.get('subtype')}",
+                        "first_output_ms": first_output_ms}
+            reusable = True
+            return {"success": True, "output": text, "error": None,
+                    "first_output_ms": first_output_ms}
+
+        except asyncio.TimeoutError:
+            error_msg = f"执行超时（{timeout}秒）"
+            logger.error(f"{error_msg}，已结束预热进程组: {process.pid}")
+            return {"success": False, "output": None, "error": error_msg,
+                    "first_output_ms": first_output_ms}
+
+        except Exception as e:
+            error_msg = f"读取预热进程输出失败: {str(e)}"
+            logger.error(error_msg)
+            return {"success": False, "output": None, "error": error_msg,
+                    "first_output_ms": first_output_ms}
+
+        finally:
+            # 取走进程时已补充了新进程，空闲进程足够时不再放回
+            if (reusable and worker.tasks < self.max_tasks and process.returncode is None
+                    and len(self._idle) + self._spawning < self.size):
+                self._idle.append(worker)
+            else:
+                self._retire(worker, graceful=reusable)
+
+    def _retire(self, worker, graceful=False):
+        """
+        在后台结束进程
+
+        Args:
+            graceful: 进程处于空闲状态，关闭标准输入后先等待其自行退出
+        """
+        self.retired += 1
+        self._in_background(self._stop(worker.process, graceful))
+
+    async def _stop(self, process, graceful):
+        try:
+            if graceful:
+                if not process.stdin.is_closing():
+                    process.stdin.close()
+                try:
+                    await asyncio.wait_for(process.wait(), self.engine.KILL_WAIT)
+                except asyncio.TimeoutError:
+                    pass
+            await self.engine.kill(process)
+        finally:
+            self.engine.untrack(process)
+
+    def _in_background(self, coro):
+        """运行后台任务并保留引用，避免任务被回收"""
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_warm_pool(engine, cli_path, workspace_dir, size, **kwargs):
+    """
+    获取进程内共享的预热进程池（同一 CLI 路径和工作目录只创建一个）
+
+    Args:
+        engine: CLI 执行引擎
+        cli_path: Claude CLI 路径
+        workspace_dir: 工作目录
+        size: 保持空闲的进程数
+        kwargs: 其他 WarmPool 参数
+
+    Returns:
+        WarmPool: size 为 0 时返回 None
+    """
+    if size <= 0:
+        return None
+    workspace_dir = os.path.abspath(workspace_dir)
+    key = (cli_path, workspace_dir)
+    with _pools_lock:
+        if key not in _pools:
+            cmd = [cli_path, '--print', '--dangerously-skip-permissions'] + STREAM_ARGS
+            _pools[key] = WarmPool(engine, cmd, workspace_dir, size, **kwargs)
+        return _pools[key]
@@ -31,6 +31,13 @@ class Config:
     CLAUDE_CLI_PATH = os.getenv('CLAUDE_CLI_PATH', 'claude')
     CLAUDE_WORKSPACE_DIR = os.getenv('CLAUDE_WORKSPACE_DIR', os.getcwd())
     CLAUDE_TIMEOUT = int(os.getenv('CLAUDE_TIMEOUT', '180'))
+    # 提示词的 token 预算（0 表示不限制）
+    PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '4000'))
+    # 预热的 Claude CLI 进程数（0 表示不启用）、进程最长存活秒数、每个进程执行的任务数、健康检查间隔（秒）
+    CLAUDE_WARM_POOL_SIZE = int(os.getenv('CLAUDE_WARM_POOL_SIZE', '0'))
+    CLAUDE_WARM_POOL_MAX_AGE = int(os.getenv('CLAUDE_WARM_POOL_MAX_AGE', '600'))
+    CLAUDE_WARM_POOL_MAX_TASKS = int(os.getenv('CLAUDE_WARM_POOL_MAX_TASKS', '1'))
+    CLAUDE_WARM_POOL_HEALTH_INTERVAL = int(os.getenv('CLAUDE_WARM_POOL_HEALTH_INTERVAL', '30'))
 
     @classmethod
     def validate(cls):
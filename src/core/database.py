@@ -2,120 +2,614 @@
 """
 数据库模型 - 使用 SQLite
 """
-import sqlite3
+import re
+import json
+import time
+import base64
 from datetime import datetime
 from pathlib import Path
 from contextlib import contextmanager
 from src.core.logger import setup_logger
+from src.core.db_pool import get_pool
+from src.core.write_queue import get_write_queue
+from src.core.ids import new_task_id
+from src.core.migrations import (
+    run_migrations, rebuild_task_counters, store_output, decode_output, create_search_index,
+    index_tasks, rebuild_search_index, INLINE_OUTPUT_LIMIT, OUTPUT_PREVIEW_CHARS
+)
+from src.core.task_store import TaskStore
 
 logger = setup_logger('database', 'data/logs/database.log')
 
-class Database:
-    def __init__(self, db_path="data/tasks.db"):
+class Database(TaskStore):
+    """基于 SQLite 的任务存储"""
+
+    # 超过该字节数的 result/error 压缩后存入 task_outputs 表，tasks 表只保留预览
+    INLINE_OUTPUT_LIMIT = INLINE_OUTPUT_LIMIT
+    OUTPUT_PREVIEW_CHARS = OUTPUT_PREVIEW_CHARS
+
+    def __init__(self, db_path="data/tasks.db", archive_path=None):
         self.db_path = db_path
+        self.archive_path = archive_path or str(Path(db_path).with_name('archive.db'))
+        self.pool = get_pool(db_path)
+        self.pool.attach('archive', self.archive_path)
+        self.writer = get_write_queue(db_path)
         Path(db_path).parent.mkdir(parents=True, exist_ok=True)
         self.init_db()
+        self.init_archive()
 
     @contextmanager
     def get_connection(self):
         """获取数据库连接（上下文管理器）"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
         try:
-            yield conn
-            conn.commit()
+            with self.pool.connection() as conn:
+                yield conn
         except Exception as e:
-            conn.rollback()
             logger.error(f"数据库操作失败: {e}")
             raise
-        finally:
-            conn.close()
 
     def init_db(self):
-        """初始化数据库表"""
+        """初始化数据库表（执行未完成的结构迁移）"""
+        run_migrations(self.pool)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tasks_fts'")
+            self.search_enabled = cursor.fetchone() is not None
+        logger.info("数据库初始化完成")
+
+    def init_archive(self):
+        """初始化冷库 archive.db，保持其 tasks 表结构与主库一致"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            cursor.execute('PRAGMA archive.auto_vacuum = INCREMENTAL')
+            cursor.execute('PRAGMA archive.journal_mode=WAL')
 
+            cursor.execute('CREATE TABLE IF NOT EXISTS archive.tasks AS SELECT * FROM main.tasks WHERE 0')
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id TEXT PRIMARY KEY,
-                    user_id TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    priority TEXT DEFAULT 'normal',
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL,
-                    started_at TEXT,
-                    completed_at TEXT,
-                    result TEXT,
-                    error TEXT
+                CREATE TABLE IF NOT EXISTS archive.task_outputs (
+                    hash TEXT PRIMARY KEY,
+                    codec TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at TEXT NOT NULL
                 )
             ''')
 
-            # 创建索引
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_status
-                ON tasks(status)
-            ''')
+            # 主库新增的列同步到冷库
+            cursor.execute('PRAGMA main.table_info(tasks)')
+            self.task_columns = [row['name'] for row in cursor.fetchall()]
+            cursor.execute('PRAGMA archive.table_info(tasks)')
+            archive_columns = {row['name'] for row in cursor.fetchall()}
+            for column in self.task_columns:
+                if column not in archive_columns:
+                    cursor.execute(f'ALTER TABLE archive.tasks ADD COLUMN {column}')
+
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_archive_tasks_id ON tasks(id)')
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_created_at
-                ON tasks(created_at DESC)
+                CREATE INDEX IF NOT EXISTS archive.idx_archive_tasks_created
+                ON tasks(created_at DESC, id DESC)
             ''')
+            # 清理冷库中无引用的输出时按引用查找
+            for field in ('result', 'error'):
+                cursor.execute(f'''
+                    CREATE INDEX IF NOT EXISTS archive.idx_archive_tasks_{field}_ref
+                    ON tasks({field}_ref) WHERE {field}_ref IS NOT NULL
+                ''')
+
+            # 冷库的全文检索索引，已归档任务同样可以检索
+            cursor.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'tasks_fts'")
+            existed = cursor.fetchone() is not None
+            self.archive_search_enabled = create_search_index(cursor, 'archive')
+            if self.archive_search_enabled and not existed:
+                rebuild_search_index(cursor, 'archive')
+
+    def _store_output(self, cursor, text):
+        """
+        保存任务输出
 
-            logger.info("数据库初始化完成")
+        Returns:
+            tuple: (写入 tasks 表的内容, 外部存储引用, 原始字节数)
+        """
+        return store_output(cursor, text)
+
+    def _index_tasks(self, cursor, task_ids, schema='main'):
+        """把任务的完整消息和输出写入全文检索索引（当前 SQLite 不支持全文检索时跳过）"""
+        if self.search_enabled if schema == 'main' else self.archive_search_enabled:
+            index_tasks(cursor, task_ids, schema)
+
+    def _load_output(self, cursor, ref, schema='main'):
+        """读取并解压外部存储的任务输出"""
+        cursor.execute(f'SELECT codec, data FROM {schema}.task_outputs WHERE hash = ?', (ref,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return decode_output(row['codec'], row['data'])
+
+    def move_archived_tasks(self, chunk_size=500, max_chunks=None, pause=0.05):
+        """
+        将已归档任务分批移动到冷库
+
+        每批先复制到冷库并提交，再从主库删除并提交；中途中断时重复执行即可，
+        不会丢失数据。
+
+        Args:
+            chunk_size: 每批移动的任务数
+            max_chunks: 最多处理的批数（None 表示直到移完）
+            pause: 批次之间的休眠秒数，给其他写入者让出锁
+
+        Returns:
+            int: 移动的任务数
+        """
+        columns = ', '.join(self.task_columns)
+        moved = 0
+        chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT id FROM main.tasks WHERE status = ? LIMIT ?',
+                    (self.ARCHIVED_STATUS, chunk_size)
+                )
+                task_ids = [row['id'] for row in cursor.fetchall()]
+                if not task_ids:
+                    break
+
+                placeholders = ', '.join('?' for _ in task_ids)
+                # 先复制输出，写入冷库全文检索索引时需要读取完整输出；
+                # 中断后重复执行时先删除已复制的任务（REPLACE 不会触发删除触发器，索引会不一致）
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO archive.task_outputs
+                    SELECT * FROM main.task_outputs WHERE hash IN (
+                        SELECT result_ref FROM main.tasks WHERE id IN ({placeholders})
+                        UNION
+                        SELECT error_ref FROM main.tasks WHERE id IN ({placeholders})
+                    )
+                ''', task_ids + task_ids)
+                cursor.execute(f'DELETE FROM archive.tasks WHERE id IN ({placeholders})', task_ids)
+                cursor.execute(f'''
+                    INSERT INTO archive.tasks ({columns})
+                    SELECT {columns} FROM main.tasks WHERE id IN ({placeholders})
+                ''', task_ids)
+                self._index_tasks(cursor, task_ids, 'archive')
+
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT result_ref FROM main.tasks WHERE id IN ({placeholders}) AND result_ref IS NOT NULL
+                    UNION
+                    SELECT error_ref FROM main.tasks WHERE id IN ({placeholders}) AND error_ref IS NOT NULL
+                ''', task_ids + task_ids)
+                refs = [row[0] for row in cursor.fetchall()]
+
+                cursor.execute(f'DELETE FROM main.tasks WHERE id IN ({placeholders})', task_ids)
+                deleted = cursor.rowcount
+                # 删除触发器会减少计数，而任务仍存在于冷库，补回计数
+                cursor.execute(
+                    'UPDATE task_counters SET count = count + ? WHERE status = ?',
+                    (deleted, self.ARCHIVED_STATUS)
+                )
+
+                for ref in refs:
+                    cursor.execute('''
+                        DELETE FROM main.task_outputs WHERE hash = ?
+                        AND NOT EXISTS (SELECT 1 FROM main.tasks WHERE result_ref = ?)
+                        AND NOT EXISTS (SELECT 1 FROM main.tasks WHERE error_ref = ?)
+                    ''', (ref, ref, ref))
+
+            moved += deleted
+            chunks += 1
+            time.sleep(pause)
+
+        if moved:
+            logger.info(f"已将 {moved} 个归档任务移动到冷库")
+        return moved
+
+    def purge_tasks(self, status, before, chunk_size=500, max_chunks=None, pause=0.05):
+        """
+        分批删除指定状态且早于指定时间完成的任务（主库和冷库）
+
+        每批一个短事务，批次之间休眠，不会长时间阻塞其他写入者。
+        无引用的外部输出一并删除。
+
+        Args:
+            status: 任务状态
+            before: ISO 时间字符串，完成时间（未完成则为创建时间）早于该时间的任务会被删除
+            chunk_size: 每批删除的任务数
+            max_chunks: 每个库最多处理的批数（None 表示直到删完）
+            pause: 批次之间的休眠秒数
+
+        Returns:
+            int: 删除的任务数
+        """
+        purged = 0
+        for schema in ('main', 'archive'):
+            chunks = 0
+            while max_chunks is None or chunks < max_chunks:
+                with self.get_connection() as conn:
+                    cursor = conn.cursor()
+                    # completed_at 不早于 created_at，先用 created_at 走索引缩小范围
+                    cursor.execute(f'''
+                        SELECT rowid, result_ref, error_ref FROM {schema}.tasks
+                        WHERE status = ? AND created_at < ? AND COALESCE(completed_at, created_at) < ?
+                        LIMIT ?
+                    ''', (status, before, before, chunk_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+
+                    rowids = [row[0] for row in rows]
+                    refs = {ref for row in rows for ref in (row['result_ref'], row['error_ref']) if ref}
+                    placeholders = ', '.join('?' for _ in rowids)
+                    cursor.execute(f'DELETE FROM {schema}.tasks WHERE rowid IN ({placeholders})', rowids)
+                    deleted = cursor.rowcount
+                    if schema == 'archive':
+                        # 冷库没有计数触发器，手动减少计数
+                        cursor.execute(
+                            'UPDATE task_counters SET count = MAX(count - ?, 0) WHERE status = ?',
+                            (deleted, status)
+                        )
+
+                    for ref in refs:
+                        cursor.execute(f'''
+                            DELETE FROM {schema}.task_outputs WHERE hash = ?
+                            AND NOT EXISTS (SELECT 1 FROM {schema}.tasks WHERE result_ref = ?)
+                            AND NOT EXISTS (SELECT 1 FROM {schema}.tasks WHERE error_ref = ?)
+                        ''', (ref, ref, ref))
+
+                purged += deleted
+                chunks += 1
+                time.sleep(pause)
+
+        if purged:
+            logger.info(f"已删除 {purged} 个过期任务（状态: {status}，早于 {before}）")
+        return purged
+
+    def database_size(self):
+        """主库和冷库已使用的字节数（不含空闲页）"""
+        size = 0
+        with self.get_connection() as conn:
+            for schema in ('main', 'archive'):
+                page_size = conn.execute(f'PRAGMA {schema}.page_size').fetchone()[0]
+                page_count = conn.execute(f'PRAGMA {schema}.page_count').fetchone()[0]
+                freelist = conn.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+                size += (page_count - freelist) * page_size
+        return size
+
+    def optimize(self):
+        """执行 PRAGMA optimize 更新查询规划统计信息"""
+        with self.get_connection() as conn:
+            conn.execute('PRAGMA optimize')
+        logger.info("数据库 optimize 完成")
+
+    def vacuum(self, max_pages=2000, schema='main'):
+        """
+        增量回收空闲页（每次最多 max_pages 页，只短时间持有写锁）
+
+        auto_vacuum 不是 INCREMENTAL 的旧数据库不做处理，需要先执行一次
+        full_vacuum（python main.py maintenance --full-vacuum）切换为增量模式。
+
+        Args:
+            schema: main（主库）或 archive（冷库）
+
+        Returns:
+            int: 回收的页数
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            auto_vacuum = cursor.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0]
+            freelist = cursor.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+            if not freelist:
+                return 0
+            if auto_vacuum != 2:
+                logger.warning(
+                    f"数据库（{schema}）未启用增量 VACUUM，{freelist} 个空闲页未回收，"
+                    f"请在维护窗口执行 python main.py maintenance --full-vacuum"
+                )
+                return 0
+            # sqlite3 模块对无结果的语句只 step 一次，executescript 才会执行到完成
+            conn.executescript(f'PRAGMA {schema}.incremental_vacuum({int(max_pages)});')
+            reclaimed = freelist - cursor.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+
+        logger.info(f"数据库空间回收完成（{schema}）: {reclaimed} 页")
+        return reclaimed
+
+    def full_vacuum(self, schema='main'):
+        """
+        完整 VACUUM 并把 auto_vacuum 切换为 INCREMENTAL
+
+        会重写整个数据库文件并在执行期间阻塞所有写入，只应由运维人员在维护窗口手动执行。
+
+        Args:
+            schema: main（主库）或 archive（冷库）
+
+        Returns:
+            int: 回收的页数
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            freelist = cursor.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+            cursor.execute(f'PRAGMA {schema}.auto_vacuum = INCREMENTAL')
+        # VACUUM 不能在事务中执行
+        with self.get_connection() as conn:
+            conn.execute(f'VACUUM {schema}')
+        if schema == 'archive' and self.archive_search_enabled:
+            # 冷库 tasks 表没有整数主键，VACUUM 可能改变 rowid，需要重建按 rowid 关联的索引
+            with self.get_connection() as conn:
+                rebuild_search_index(conn.cursor(), 'archive')
+        logger.info(f"数据库完整 VACUUM 完成（{schema}）: {freelist} 页")
+        return freelist
+
+    def rebuild_task_counters(self):
+        """重建任务状态计数（计数表与实际数据不一致时使用）"""
+        with self.get_connection() as conn:
+            rebuild_task_counters(conn.cursor())
 
     def create_task(self, user_id, message, priority='normal'):
         """创建任务"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        task_id = f"task_{timestamp}"
+        task_id = new_task_id()
         now = datetime.now().isoformat()
 
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO tasks (id, user_id, message, status, priority, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (task_id, user_id, message, '待处理', priority, now, now))
+                    INSERT INTO tasks (id, user_id, message, status, priority, priority_rank, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (task_id, user_id, message, '待处理', priority, self._priority_rank(priority), now, now))
+                self._index_tasks(cursor, [task_id])
                 logger.info(f"任务创建成功: {task_id}")
                 return task_id
         except Exception as e:
             logger.error(f"创建任务失败: {e}")
             raise
 
-    def get_task(self, task_id):
-        """获取单个任务"""
+    def create_tasks_batch(self, tasks, user_id='batch_import'):
+        """
+        批量创建任务（单个事务 + executemany）
+
+        Args:
+            tasks: 任务列表，每项为 {"message": str, "priority": str, "user_id": str}
+                   或直接为任务消息字符串
+            user_id: 未指定 user_id 时使用的默认值
+
+        Returns:
+            list: 按输入顺序生成的任务 ID
+        """
+        now = datetime.now().isoformat()
+
+        rows = []
+        task_ids = []
+        for i, item in enumerate(tasks):
+            if isinstance(item, str):
+                item = {'message': item}
+            if not isinstance(item, dict) or not item.get('message'):
+                raise ValueError(f"第 {i + 1} 个任务缺少必需参数: message")
+
+            task_id = new_task_id()
+            priority = item.get('priority', 'normal')
+            rows.append((
+                task_id, item.get('user_id', user_id), item['message'], '待处理',
+                priority, self._priority_rank(priority), now, now
+            ))
+            task_ids.append(task_id)
+
+        if not rows:
+            return []
+
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
-                row = cursor.fetchone()
-                return dict(row) if row else None
+                cursor.executemany('''
+                    INSERT INTO tasks (id, user_id, message, status, priority, priority_rank, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                self._index_tasks(cursor, task_ids)
+                logger.info(f"批量创建任务成功: {len(task_ids)} 个")
+                return task_ids
+        except Exception as e:
+            logger.error(f"批量创建任务失败: {e}")
+            raise
+
+    def get_task(self, task_id, full_output=True):
+        """
+        获取单个任务
+
+        Args:
+            task_id: 任务 ID
+            full_output: 是否读取并解压完整的 result/error（否则只返回预览）
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                # 先查主库，找不到再查冷库
+                for schema in ('main', 'archive'):
+                    cursor.execute(f'SELECT * FROM {schema}.tasks WHERE id = ?', (task_id,))
+                    row = cursor.fetchone()
+                    if row:
+                        break
+                else:
+                    return None
+                task = dict(row)
+                if full_output:
+                    for field in ('result', 'error'):
+                        if task.get(f'{field}_ref'):
+                            task[field] = self._load_output(cursor, task[f'{field}_ref'], schema)
+                return task
         except Exception as e:
             logger.error(f"获取任务失败: {e}")
             return None
 
-    def list_tasks(self, status=None, limit=100, offset=0):
-        """列出任务"""
+    def list_tasks(self, status=None, limit=100, offset=0, after=None, include_archive=None):
+        """
+        列出任务
+
+        传入 after 游标时使用键集分页（忽略 offset），任意深度的翻页代价相同。
+
+        Args:
+            include_archive: 是否合并冷库中的任务；默认在查询全部或已归档任务时合并
+        """
+        if include_archive is None:
+            include_archive = status in (None, '', self.ARCHIVED_STATUS)
+
+        conditions = []
+        params = []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if after:
+            conditions.append('(created_at, id) < (?, ?)')
+            params.extend(self.decode_cursor(after))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        order = ' ORDER BY created_at DESC, id DESC'
+
+        if include_archive:
+            # 两个分支各自按索引取前 N 条，再合并排序
+            columns = ', '.join(self.task_columns)
+            branch_limit = limit if after else limit + offset
+            sql = (
+                f'SELECT * FROM (SELECT {columns} FROM main.tasks{where}{order} LIMIT ?)'
+                f' UNION ALL '
+                f'SELECT * FROM (SELECT {columns} FROM archive.tasks{where}{order} LIMIT ?)'
+            )
+            params = params + [branch_limit] + params + [branch_limit]
+        else:
+            sql = f'SELECT * FROM main.tasks{where}'
+
+        sql += f'{order} LIMIT ?'
+        params.append(limit)
+        if not after:
+            sql += ' OFFSET ?'
+            params.append(offset)
+
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                if status:
-                    cursor.execute(
-                        'SELECT * FROM tasks WHERE status = ? ORDER BY created_at DESC LIMIT ? OFFSET ?',
-                        (status, limit, offset)
-                    )
-                else:
-                    cursor.execute(
-                        'SELECT * FROM tasks ORDER BY created_at DESC LIMIT ? OFFSET ?',
-                        (limit, offset)
-                    )
+                cursor.execute(sql, params)
                 rows = cursor.fetchall()
                 return [dict(row) for row in rows]
         except Exception as e:
             logger.error(f"列出任务失败: {e}")
             return []
 
+    def search_tasks(self, query, status=None, limit=20, cursor=None):
+        """
+        全文检索任务消息和结果（主库和冷库，返回高亮片段）
+
+        使用 FTS5 trigram 索引检索完整的消息和结果（包括外部存储的大输出），按 BM25 排序；
+        主库和冷库的 BM25 分数分别计算，合并后按分数排序。trigram 无法索引的两个字符的关键词
+        检索 bigrams 列：中日韩文字按双字词匹配，其他文字按单词匹配。
+
+        Args:
+            query: 搜索关键词（空格分隔，全部匹配，每个关键词至少 2 个字符）
+            status: 按状态过滤（可选）
+            limit: 每页数量
+            cursor: 上一页返回的 next_cursor
+
+        Returns:
+            dict: {"tasks": list, "next_cursor": str | None}
+        """
+        terms = query.split()
+        if not terms:
+            raise ValueError("搜索关键词不能为空")
+        short = [term for term in terms if len(term) < 2]
+        if short:
+            raise ValueError(f"搜索关键词至少需要 2 个字符: {' '.join(short)}")
+        offset = 0
+        if cursor:
+            try:
+                padded = cursor + '=' * (-len(cursor) % 4)
+                offset = int(json.loads(base64.urlsafe_b64decode(padded).decode('utf-8'))['offset'])
+            except Exception:
+                raise ValueError("无效的分页游标")
+        if not self.search_enabled:
+            logger.warning("当前 SQLite 不支持 FTS5 trigram，无法全文检索")
+            return {"tasks": [], "next_cursor": None}
+
+        try:
+            with self.get_connection() as conn:
+                tasks = self._search_index(conn.cursor(), terms, status, limit + 1, offset)
+        except Exception as e:
+            logger.error(f"搜索任务失败: {e}")
+            return {"tasks": [], "next_cursor": None}
+
+        next_cursor = None
+        if len(tasks) > limit:
+            tasks = tasks[:limit]
+            raw = json.dumps({'offset': offset + limit})
+            next_cursor = base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+        return {"tasks": tasks, "next_cursor": next_cursor}
+
+    def _search_sources(self):
+        """参与检索的库：(库名, tasks 表与索引关联的列)"""
+        sources = [('main', 'seq')]
+        if self.archive_search_enabled:
+            sources.append(('archive', 'rowid'))
+        return sources
+
+    @staticmethod
+    def _match_query(terms):
+        """
+        FTS5 查询：不少于 3 个字符的关键词检索消息和结果，两个字符的关键词检索 bigrams 列
+        （首尾加空格，只匹配完整的双字词）
+        """
+        phrases = []
+        for term in terms:
+            escaped = term.replace('"', '""')
+            if len(term) >= 3:
+                phrases.append(f'{{message result}} : "{escaped}"')
+            else:
+                phrases.append(f'bigrams : " {escaped.lower()} "')
+        return ' AND '.join(phrases)
+
+    def _search_index(self, cursor, terms, status, limit, offset):
+        """使用全文检索索引检索"""
+        # snippet() 只标记本列命中的关键词，有双字词时由 _highlight 截取片段
+        has_bigrams = any(len(term) < 3 for term in terms)
+        if has_bigrams:
+            columns = 'tasks_fts.message AS message_text, tasks_fts.result AS result_text'
+        else:
+            columns = ("snippet(tasks_fts, 0, '<mark>', '</mark>', '…', 32) AS message_snippet, "
+                       "snippet(tasks_fts, 1, '<mark>', '</mark>', '…', 32) AS result_snippet")
+        parts = []
+        params = []
+        for schema, key in self._search_sources():
+            sql = f'''
+                SELECT t.id, t.user_id, t.status, t.priority, t.created_at, t.updated_at, t.completed_at,
+                       {columns}, bm25(tasks_fts) AS score
+                FROM {schema}.tasks_fts
+                JOIN {schema}.tasks t ON t.{key} = tasks_fts.rowid
+                WHERE tasks_fts MATCH ?
+            '''
+            params.append(self._match_query(terms))
+            if status:
+                sql += ' AND t.status = ?'
+                params.append(status)
+            parts.append(sql)
+        cursor.execute(
+            f"SELECT * FROM ({' UNION ALL '.join(parts)}) ORDER BY score LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        )
+        tasks = []
+        for row in cursor.fetchall():
+            task = dict(row)
+            if has_bigrams:
+                task['message_snippet'] = self._highlight(task.pop('message_text'), terms)
+                task['result_snippet'] = self._highlight(task.pop('result_text'), terms)
+            tasks.append(task)
+        return tasks
+
+    @staticmethod
+    def _highlight(text, terms, width=32):
+        """截取第一个关键词附近的片段并标记所有关键词（格式与 FTS5 snippet() 一致）"""
+        if not text:
+            return ''
+        pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+        found = pattern.search(text)
+        start = max((found.start() if found else 0) - width, 0)
+        end = min((found.end() if found else 0) + width, len(text))
+        fragment = pattern.sub(lambda m: f'<mark>{m.group(0)}</mark>', text[start:end])
+        return ('…' if start > 0 else '') + fragment + ('…' if end < len(text) else '')
+
     def update_status(self, task_id, status, result=None, error=None):
         """更新任务状态"""
         try:
@@ -134,47 +628,202 @@ class Database:
                     params.append(now)
 
                 if result:
-                    updates.append('result = ?')
-                    params.append(result)
+                    preview, ref, size = self._store_output(cursor, result)
+                    updates.append('result = ?, result_ref = ?, result_size = ?')
+                    params.extend([preview, ref, size])
                 if error:
-                    updates.append('error = ?')
-                    params.append(error)
+                    preview, ref, size = self._store_output(cursor, error)
+                    updates.append('error = ?, error_ref = ?, error_size = ?')
+                    params.extend([preview, ref, size])
 
                 params.append(task_id)
                 sql = f"UPDATE tasks SET {', '.join(updates)} WHERE id = ?"
                 cursor.execute(sql, params)
+                if result:
+                    self._index_tasks(cursor, [task_id])
                 logger.info(f"任务状态更新: {task_id} -> {status}")
         except Exception as e:
             logger.error(f"更新任务状态失败: {e}")
             raise
 
+    def update_status_async(self, task_id, status, result=None, error=None):
+        """通过写入队列批量提交任务状态更新，返回 Future"""
+        return self.writer.submit(self.update_status, task_id, status, result, error)
+
+    def heartbeat(self, task_id):
+        """刷新执行中任务的 updated_at（经写入队列批量提交，不阻塞调用方）"""
+        self.writer.submit(self._touch_task, task_id)
+
+    def _touch_task(self, task_id):
+        """更新执行中任务的 updated_at"""
+        with self.get_connection() as conn:
+            conn.execute(
+                "UPDATE tasks SET updated_at = ? WHERE id = ? AND status = '处理中'",
+                (datetime.now().isoformat(), task_id)
+            )
+
+    def record_prompt_tokens(self, task_id, tokens):
+        """记录任务提示词的估算 token 数（经写入队列批量提交，不阻塞调用方）"""
+        self.writer.submit(self._set_prompt_tokens, task_id, tokens)
+
+    def _set_prompt_tokens(self, task_id, tokens):
+        """更新任务的 prompt_tokens"""
+        with self.get_connection() as conn:
+            conn.execute('UPDATE tasks SET prompt_tokens = ? WHERE id = ?', (tokens, task_id))
+
+    def claim_next_task(self, worker_id, priority_order=None):
+        """
+        原子地领取下一个待处理任务并标记为处理中
+
+        单条 UPDATE ... RETURNING 完成选择和状态切换，多个执行器并发领取时
+        同一任务只会被一个执行器拿到。
+
+        Args:
+            worker_id: 领取者标识
+            priority_order: 自定义优先级顺序（如 ["high", "normal", "low"]），默认使用 priority_rank
+
+        Returns:
+            dict: 领取到的任务，没有待处理任务时返回 None
+        """
+        order_by = 'priority_rank, created_at'
+        params = []
+        if priority_order and list(priority_order) != list(self.PRIORITY_RANKS):
+            cases = ' '.join('WHEN ? THEN ?' for _ in priority_order)
+            order_by = f'CASE priority {cases} ELSE {len(priority_order)} END, created_at'
+            for i, priority in enumerate(priority_order):
+                params.extend([priority, i])
+
+        now = datetime.now().isoformat()
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    UPDATE tasks
+                    SET status = '处理中', claimed_by = ?, started_at = ?, updated_at = ?
+                    WHERE id = (
+                        SELECT id FROM tasks
+                        WHERE status = '待处理'
+                        ORDER BY {order_by}
+                        LIMIT 1
+                    )
+                    RETURNING *
+                ''', [worker_id, now, now] + params)
+                row = cursor.fetchone()
+                if row:
+                    logger.info(f"任务已被领取: {row['id']} -> {worker_id}")
+                return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"领取任务失败: {e}")
+            return None
+
+    def claim_task(self, task_id, worker_id):
+        """
+        原子地领取指定任务（任务不在处理中时才能领取）
+
+        Returns:
+            dict: 领取到的任务，任务不存在或正在执行时返回 None
+        """
+        now = datetime.now().isoformat()
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE tasks
+                    SET status = '处理中', claimed_by = ?, started_at = ?, updated_at = ?
+                    WHERE id = ? AND status != '处理中'
+                    RETURNING *
+                ''', (worker_id, now, now, task_id))
+                row = cursor.fetchone()
+                if row:
+                    logger.info(f"任务已被领取: {task_id} -> {worker_id}")
+                return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"领取任务失败: {e}")
+            return None
+
+    def release_stale_claims(self, stale_before, is_worker_alive=None):
+        """
+        把执行者已不在运行的处理中任务重置为待处理（如执行器进程崩溃或重启后遗留的任务）
+
+        Args:
+            stale_before: 心跳（updated_at）早于该时间（ISO 字符串）的任务视为执行者已退出
+            is_worker_alive: 判断领取者是否仍在运行的函数，返回 False 的领取者的任务立即释放
+
+        Returns:
+            list: 被释放的任务 ID
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, claimed_by, updated_at FROM tasks WHERE status = '处理中'")
+                task_ids = [
+                    row['id'] for row in cursor.fetchall()
+                    if row['updated_at'] < stale_before
+                    or (is_worker_alive and not is_worker_alive(row['claimed_by']))
+                ]
+                if not task_ids:
+                    return []
+                placeholders = ','.join('?' * len(task_ids))
+                cursor.execute(f'''
+                    UPDATE tasks
+                    SET status = '待处理', claimed_by = NULL, started_at = NULL, updated_at = ?
+                    WHERE status = '处理中' AND id IN ({placeholders})
+                    RETURNING id
+                ''', [datetime.now().isoformat()] + task_ids)
+                released = [row['id'] for row in cursor.fetchall()]
+            if released:
+                logger.warning(f"已将 {len(released)} 个执行者已退出的任务重置为待处理: {released}")
+            return released
+        except Exception as e:
+            logger.error(f"释放过期任务领取失败: {e}")
+            return []
+
     def get_stats(self):
         """获取统计信息"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                stats = {}
-                for status in ['待处理', '处理中', '已完成', '失败', '已归档']:
-                    cursor.execute('SELECT COUNT(*) FROM tasks WHERE status = ?', (status,))
-                    stats[status] = cursor.fetchone()[0]
+                stats = {status: 0 for status in self.TASK_STATUSES}
+                cursor.execute('SELECT status, count FROM task_counters')
+                for row in cursor.fetchall():
+                    if row['status'] in stats:
+                        stats[row['status']] = row['count']
                 return stats
         except Exception as e:
             logger.error(f"获取统计信息失败: {e}")
             return {}
 
-    def can_edit_task(self, task_id):
-        """检查任务是否可编辑（只有待处理状态的任务可编辑）"""
-        task = self.get_task(task_id)
-        if not task:
-            return False
-        return task['status'] == '待处理'
+    def events_since(self, event_id=0, limit=500):
+        """
+        获取指定事件之后的任务事件（按 event_id 升序）
 
-    def can_delete_task(self, task_id):
-        """检查任务是否可删除（只有待处理状态的任务可删除）"""
-        task = self.get_task(task_id)
-        if not task:
-            return False
-        return task['status'] == '待处理'
+        Args:
+            event_id: 上次读到的最后一个事件 ID
+            limit: 最多返回的事件数
+
+        Returns:
+            list: 事件列表
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT event_id, task_id, event_type, old_status, new_status, worker_id, created_at
+                    FROM task_events
+                    WHERE event_id > ?
+                    ORDER BY event_id
+                    LIMIT ?
+                ''', (event_id, limit))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"获取任务事件失败: {e}")
+            raise
+
+    def latest_event_id(self):
+        """获取最新的任务事件 ID（没有事件时为 0）"""
+        with self.get_connection() as conn:
+            row = conn.execute('SELECT MAX(event_id) FROM task_events').fetchone()
+            return row[0] or 0
 
     def update_task(self, task_id, message=None, priority=None):
         """更新任务内容和优先级（仅允许在待处理状态下编辑）"""
@@ -196,10 +845,14 @@ class Database:
                 if priority is not None:
                     updates.append('priority = ?')
                     params.append(priority)
+                    updates.append('priority_rank = ?')
+                    params.append(self._priority_rank(priority))
 
                 params.append(task_id)
                 sql = f"UPDATE tasks SET {', '.join(updates)} WHERE id = ?"
                 cursor.execute(sql, params)
+                if message is not None:
+                    self._index_tasks(cursor, [task_id])
                 logger.info(f"任务更新成功: {task_id}")
                 return True
         except Exception as e:
@@ -222,13 +875,6 @@ class Database:
             logger.error(f"删除任务失败: {e}")
             raise
 
-    def can_archive_task(self, task_id):
-        """检查任务是否可归档（只有已完成或失败的任务可归档）"""
-        task = self.get_task(task_id)
-        if not task:
-            return False
-        return task['status'] in ['已完成', '失败']
-
     def archive_task(self, task_id):
         """归档任务（仅允许归档已完成或失败的任务）"""
         try:
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+数据库备份与导入导出
+
+- 在线备份：使用 SQLite 备份 API 分步复制页面，每步只短暂持有锁，不影响任务执行
+- 导出/导入：以 NDJSON（每行一个 JSON 对象）流式处理任务、历史记录和配置，内存占用恒定
+"""
+import os
+import json
+import time
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from src.core.logger import setup_logger
+
+logger = setup_logger('db_backup', 'data/logs/database.log')
+
+# 导出格式版本
+EXPORT_VERSION = 1
+
+# 随任务一起导出的表（记录类型 -> 表名）
+EXPORT_TABLES = {
+    'history_config': 'history_config',
+    'history_record': 'history_context_records',
+    'telegram_config': 'telegram_config',
+}
+
+# 任务表中由存储层维护的列，导出时不包含，导入时重新计算
+INTERNAL_TASK_COLUMNS = {'seq', 'priority_rank', 'result_ref', 'result_size', 'error_ref', 'error_size'}
+
+# 配置表中由存储层维护的列，导入时保留目标库的值
+CONFIG_INTERNAL_COLUMNS = {'generation'}
+
+
+def backup_database(src_path, dest_path, pages=1024, pause=0.005):
+    """
+    在线备份单个数据库文件
+
+    备份期间在源库上保持一个读事务：WAL 模式下写入者不受影响，
+    备份得到的是开始时刻的一致快照，也不会因为其他进程写入而从头重新复制。
+
+    Args:
+        src_path: 源数据库路径
+        dest_path: 备份文件路径
+        pages: 每步复制的页数
+        pause: 每步之间的休眠秒数，降低对磁盘 I/O 的占用
+
+    Returns:
+        int: 复制的页数
+    """
+    dest_path = Path(dest_path)
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest_path.with_name(dest_path.name + '.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    src = sqlite3.connect(src_path, isolation_level=None, timeout=5)
+    dst = sqlite3.connect(str(tmp_path))
+    state = {'total': 0, 'logged': 0}
+
+    def progress(status, remaining, total):
+        state['total'] = total
+        done = total - remaining
+        # 每完成约 10% 记录一次进度
+        if total and done * 10 // total > state['logged']:
+            state['logged'] = done * 10 // total
+            logger.info(f"备份 {src_path}: {done}/{total} 页")
+        if pause:
+            time.sleep(pause)
+
+    try:
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        src.backup(dst, pages=pages, progress=progress)
+        src.execute('COMMIT')
+    finally:
+        dst.close()
+        src.close()
+
+    os.replace(tmp_path, dest_path)
+    logger.info(f"备份完成: {src_path} -> {dest_path}（{state['total']} 页）")
+    return state['total']
+
+
+def backup_all(db, dest_dir=None, **kwargs):
+    """
+    备份主库和冷库
+
+    Args:
+        db: Database 实例
+        dest_dir: 备份目录，默认 data/backups/<时间戳>
+
+    Returns:
+        list: 备份文件路径
+    """
+    if dest_dir is None:
+        dest_dir = Path(db.db_path).parent / 'backups' / datetime.now().strftime('%Y%m%d-%H%M%S')
+    dest_dir = Path(dest_dir)
+
+    paths = []
+    for path in (db.db_path, db.archive_path):
+        if Path(path).exists():
+            dest = dest_dir / Path(path).name
+            backup_database(path, dest, **kwargs)
+            paths.append(str(dest))
+    return paths
+
+
+def _open_snapshot(db):
+    """打开只读连接并开启读事务，导出期间看到的是同一个快照"""
+    uri = Path(db.db_path).resolve().as_uri() + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if Path(db.archive_path).exists():
+        archive_uri = Path(db.archive_path).resolve().as_uri() + '?mode=ro'
+        conn.execute('ATTACH DATABASE ? AS archive', (archive_uri,))
+    conn.execute('BEGIN')
+    return conn
+
+
+def iter_export(db):
+    """
+    逐条生成导出记录（生成器，按游标逐行读取，不会一次性加载整张表）
+
+    Yields:
+        dict: {"type": 记录类型, "data": 记录内容}
+    """
+    conn = _open_snapshot(db)
+    try:
+        yield {'type': 'meta', 'data': {'version': EXPORT_VERSION, 'exported_at': datetime.now().isoformat()}}
+
+        schemas = ['main']
+        if conn.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'").fetchone():
+            schemas.append('archive')
+
+        output_cursor = conn.cursor()
+        for schema in schemas:
+            for row in conn.execute(f'SELECT * FROM {schema}.tasks ORDER BY seq'):
+                task = {key: row[key] for key in row.keys() if key not in INTERNAL_TASK_COLUMNS}
+                for field in ('result', 'error'):
+                    ref = row[f'{field}_ref'] if f'{field}_ref' in row.keys() else None
+                    if ref:
+                        task[field] = db._load_output(output_cursor, ref, schema)
+                yield {'type': 'task', 'data': task}
+
+        for record_type, table in EXPORT_TABLES.items():
+            for row in conn.execute(f'SELECT * FROM {table} ORDER BY id'):
+                yield {'type': record_type, 'data': dict(row)}
+    finally:
+        conn.close()
+
+
+def export_ndjson(db, fp):
+    """
+    导出为 NDJSON
+
+    Args:
+        db: Database 实例
+        fp: 以文本模式打开的输出文件
+
+    Returns:
+        dict: 各类型记录数
+    """
+    counts = {}
+    for record in iter_export(db):
+        fp.write(json.dumps(record, ensure_ascii=False) + '\n')
+        counts[record['type']] = counts.get(record['type'], 0) + 1
+    counts.pop('meta', None)
+    logger.info(f"导出完成: {counts}")
+    return counts
+
+
+def _table_columns(cursor, table):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [row['name'] for row in cursor.fetchall()]
+
+
+def _import_task(db, cursor, task, columns):
+    """导入单个任务（主库或冷库中已存在相同 ID 时跳过）"""
+    for schema in ('main', 'archive'):
+        cursor.execute(f'SELECT 1 FROM {schema}.tasks WHERE id = ?', (task['id'],))
+        if cursor.fetchone():
+            return False
+
+    values = {key: value for key, value in task.items() if key in columns and key not in INTERNAL_TASK_COLUMNS}
+    values['priority_rank'] = db._priority_rank(values.get('priority'))
+    for field in ('result', 'error'):
+        if values.get(field):
+            values[field], values[f'{field}_ref'], values[f'{field}_size'] = db._store_output(cursor, values[field])
+
+    names = ', '.join(values)
+    placeholders = ', '.join('?' for _ in values)
+    cursor.execute(f'INSERT INTO tasks ({names}) VALUES ({placeholders})', list(values.values()))
+    db._index_tasks(cursor, [task['id']])
+    return True
+
+
+def _import_history_record(cursor, record, columns):
+    """导入历史记录（相同任务和时间的记录已存在时跳过）"""
+    cursor.execute(
+        'SELECT 1 FROM history_context_records WHERE task_id = ? AND created_at = ?',
+        (record.get('task_id'), record.get('created_at'))
+    )
+    if cursor.fetchone():
+        return False
+    values = {key: value for key, value in record.items() if key in columns and key != 'id'}
+    names = ', '.join(values)
+    placeholders = ', '.join('?' for _ in values)
+    cursor.execute(f'INSERT INTO history_context_records ({names}) VALUES ({placeholders})', list(values.values()))
+    return True
+
+
+def _import_config(cursor, table, record, columns):
+    """
+    导入配置（按 id 覆盖）
+
+    历史配置的版本号不导入，覆盖后加一：运行中的进程据此发现配置变化并清空历史上下文缓存，
+    导入后无需重启。
+    """
+    values = {key: value for key, value in record.items() if key in columns and key not in CONFIG_INTERNAL_COLUMNS}
+    names = ', '.join(values)
+    placeholders = ', '.join('?' for _ in values)
+    updates = ', '.join(f'{name} = excluded.{name}' for name in values if name != 'id') or 'id = id'
+    cursor.execute(
+        f'INSERT INTO {table} ({names}) VALUES ({placeholders}) ON CONFLICT(id) DO UPDATE SET {updates}',
+        list(values.values())
+    )
+    if table == 'history_config':
+        cursor.execute('UPDATE history_config SET generation = generation + 1 WHERE id = ?', (values.get('id', 1),))
+    return True
+
+
+def import_ndjson(db, lines, batch_size=500):
+    """
+    从 NDJSON 导入（逐行读取，每 batch_size 条记录一个事务）
+
+    Args:
+        db: Database 实例
+        lines: 可迭代的文本行（如打开的文件）
+        batch_size: 每个事务导入的记录数
+
+    Returns:
+        dict: 各类型实际导入的记录数
+    """
+    imported = {}
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        columns = {table: _table_columns(cursor, table) for table in ['tasks', *EXPORT_TABLES.values()]}
+
+    batch = []
+
+    def flush():
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            for record_type, data in batch:
+                if record_type == 'task':
+                    added = _import_task(db, cursor, data, columns['tasks'])
+                elif record_type == 'history_record':
+                    added = _import_history_record(cursor, data, columns['history_context_records'])
+                else:
+                    table = EXPORT_TABLES[record_type]
+                    added = _import_config(cursor, table, data, columns[table])
+                if added:
+                    imported[record_type] = imported.get(record_type, 0) + 1
+        batch.clear()
+
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"第 {line_no} 行不是有效的 JSON: {e}")
+
+        record_type = record.get('type')
+        if record_type == 'meta':
+            version = record.get('data', {}).get('version')
+            if version != EXPORT_VERSION:
+                raise ValueError(f"不支持的导出格式版本: {version}")
+            continue
+        if record_type != 'task' and record_type not in EXPORT_TABLES:
+            raise ValueError(f"第 {line_no} 行记录类型未知: {record_type}")
+        if record_type == 'task' and not (record.get('data') or {}).get('id'):
+            raise ValueError(f"第 {line_no} 行任务缺少 id")
+
+        batch.append((record_type, record['data']))
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    logger.info(f"导入完成: {imported}")
+    return imported
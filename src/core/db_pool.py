@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite 连接池 - 每个线程复用一个 WAL 模式的长连接
+"""
+import sqlite3
+import weakref
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from src.core.logger import setup_logger
+
+logger = setup_logger('db_pool', 'data/logs/database.log')
+
+
+class _ThreadConnection:
+    """
+    线程持有的连接
+
+    只由 threading.local 强引用：线程结束后线程局部变量被回收，连接随之关闭，
+    避免每个请求一个线程的 Web 服务器不断累积连接和 WAL/SHM 文件句柄。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.depth = 0              # connection() 的嵌套深度
+        self.attached = set()       # 已 ATTACH 的数据库
+        self.close = weakref.finalize(self, _close_connection, conn)
+
+
+def _close_connection(conn):
+    try:
+        conn.close()
+    except Exception as e:
+        logger.error(f"关闭数据库连接失败: {e}")
+
+
+class ConnectionPool:
+    """按线程缓存连接的 SQLite 连接池"""
+
+    # 连接级 PRAGMA（每个新连接都需要设置）
+    PRAGMAS = {
+        'busy_timeout': 5000,       # 被锁时最多等待 5 秒，而不是直接报 database is locked
+        'synchronous': 'NORMAL',    # WAL 模式下 NORMAL 已足够安全，且避免每次提交都 fsync
+        'mmap_size': 268435456,     # 256MB 内存映射读
+        'cache_size': -65536,       # 64MB 页缓存（负数单位为 KB）
+        'temp_store': 'MEMORY',
+    }
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._holders = weakref.WeakSet()   # 各线程的连接（弱引用，不阻止线程结束后回收）
+        self._attachments = {}
+        self._wal_ready = False
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+    def _connect(self):
+        """创建新连接并应用 PRAGMA"""
+        # 线程结束后连接可能在其他线程中被关闭，只有所属线程会使用连接
+        conn = sqlite3.connect(self.db_path, timeout=self.PRAGMAS['busy_timeout'] / 1000,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+
+        with self._lock:
+            if not self._wal_ready:
+                # auto_vacuum 只能在新数据库写入第一页之前设置，必须先于 journal_mode
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                # journal_mode 是持久化在数据库文件里的，只需设置一次
+                mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+                if mode.lower() != 'wal':
+                    logger.warning(f"无法启用 WAL 模式，当前模式: {mode}")
+                self._wal_ready = True
+
+        for name, value in self.PRAGMAS.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        return conn
+
+    def _get_thread_connection(self):
+        """获取当前线程的连接（不存在则创建）"""
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            holder = _ThreadConnection(self._connect())
+            self._local.holder = holder
+            with self._lock:
+                self._holders.add(holder)
+        return holder
+
+    def attach(self, schema, path):
+        """登记需要 ATTACH 的数据库，各线程的连接在下次使用时自动附加"""
+        with self._lock:
+            self._attachments[schema] = str(path)
+
+    def _apply_attachments(self, holder):
+        """为当前线程的连接附加尚未附加的数据库（必须在事务外执行）"""
+        with self._lock:
+            pending = [(schema, path) for schema, path in self._attachments.items()
+                       if schema not in holder.attached]
+        for schema, path in pending:
+            holder.conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+            holder.attached.add(schema)
+
+    @contextmanager
+    def connection(self):
+        """
+        获取当前线程的连接（上下文管理器）
+
+        嵌套使用时共享同一个事务，只在最外层提交或回滚。
+        """
+        holder = self._get_thread_connection()
+        conn = holder.conn
+        if holder.depth == 0:
+            self._apply_attachments(holder)
+        holder.depth += 1
+        try:
+            yield conn
+            if holder.depth == 1:
+                conn.commit()
+        except Exception:
+            if holder.depth == 1:
+                conn.rollback()
+            raise
+        finally:
+            holder.depth -= 1
+
+    def open_connections(self):
+        """当前未关闭的连接数"""
+        with self._lock:
+            return sum(1 for holder in self._holders if holder.close.alive)
+
+    def close_all(self):
+        """关闭连接池中的所有连接"""
+        with self._lock:
+            holders = list(self._holders)
+            self._holders.clear()
+        for holder in holders:
+            holder.close()
+        self._local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path="data/tasks.db"):
+    """获取指定数据库文件的共享连接池（进程内单例）"""
+    key = str(Path(db_path).resolve())
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(db_path)
+            _pools[key] = pool
+        return pool
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+任务 ID 生成 - ULID 风格，可按时间排序且无需访问数据库
+"""
+import os
+import time
+import threading
+
+# Crockford Base32 字母表（不含 I、L、O、U）
+_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+
+
+def _encode(value, length):
+    """将整数编码为定长 Crockford Base32 字符串"""
+    chars = []
+    for _ in range(length):
+        chars.append(_ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def new_ulid():
+    """
+    生成单调递增的 ULID（48 位毫秒时间戳 + 80 位随机数）
+
+    同一毫秒内生成的 ID 在上一个随机部分的基础上加一，保证进程内严格递增；
+    不同进程之间依靠 80 位随机数避免冲突。
+    """
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = int(time.time() * 1000)
+        if now_ms <= _last_ms:
+            # 同一毫秒（或时钟回拨）：沿用上一个时间戳，随机部分递增
+            now_ms = _last_ms
+            random_part = (_last_random + 1) & ((1 << 80) - 1)
+        else:
+            random_part = int.from_bytes(os.urandom(10), 'big')
+        _last_ms = now_ms
+        _last_random = random_part
+    return _encode(now_ms, 10) + _encode(random_part, 16)
+
+
+def new_task_id():
+    """生成新的任务 ID，如 task_01JA2B3C4D5E6F7G8H9J0KMNPQR"""
+    return f"task_{new_ulid()}"
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+内存任务存储 - 与 SQLite 存储语义一致，用于单元测试和基准测试
+"""
+import threading
+from datetime import datetime
+from src.core.ids import new_task_id
+from src.core.task_store import TaskStore
+
+
+class MemoryTaskStore(TaskStore):
+    """基于内存的任务存储（线程安全，不持久化）"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tasks = {}
+        self._events = []
+
+    def _new_task(self, task_id, user_id, message, priority, now):
+        """构造与 tasks 表字段一致的任务字典"""
+        return {
+            'id': task_id,
+            'user_id': user_id,
+            'message': message,
+            'status': '待处理',
+            'priority': priority,
+            'priority_rank': self._priority_rank(priority),
+            'created_at': now,
+            'updated_at': now,
+            'started_at': None,
+            'completed_at': None,
+            'result': None,
+            'error': None,
+            'claimed_by': None,
+            'prompt_tokens': None,
+        }
+
+    def _record_event(self, task_id, event_type, old_status=None, new_status=None, worker_id=None):
+        """追加任务事件（调用方持有锁）"""
+        self._events.append({
+            'event_id': len(self._events) + 1,
+            'task_id': task_id,
+            'event_type': event_type,
+            'old_status': old_status,
+            'new_status': new_status,
+            'worker_id': worker_id,
+            'created_at': datetime.now().isoformat(),
+        })
+
+    def create_task(self, user_id, message, priority='normal'):
+        """创建任务"""
+        task_id = new_task_id()
+        with self._lock:
+            self._tasks[task_id] = self._new_task(task_id, user_id, message, priority, datetime.now().isoformat())
+            self._record_event(task_id, 'created', new_status='待处理')
+        return task_id
+
+    def create_tasks_batch(self, tasks, user_id='batch_import'):
+        """批量创建任务（全部校验通过后才写入）"""
+        now = datetime.now().isoformat()
+        new_tasks = []
+        for i, item in enumerate(tasks):
+            if isinstance(item, str):
+                item = {'message': item}
+            if not isinstance(item, dict) or not item.get('message'):
+                raise ValueError(f"第 {i + 1} 个任务缺少必需参数: message")
+            task_id = new_task_id()
+            new_tasks.append(self._new_task(
+                task_id, item.get('user_id', user_id), item['message'], item.get('priority', 'normal'), now
+            ))
+
+        with self._lock:
+            for task in new_tasks:
+                self._tasks[task['id']] = task
+                self._record_event(task['id'], 'created', new_status='待处理')
+        return [task['id'] for task in new_tasks]
+
+    def get_task(self, task_id, full_output=True):
+        """获取单个任务"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task) if task else None
+
+    def list_tasks(self, status=None, limit=100, offset=0, after=None, include_archive=None):
+        """列出任务（按 created_at、id 倒序）"""
+        bound = self.decode_cursor(after) if after else None
+        with self._lock:
+            tasks = [
+                t for t in self._tasks.values()
+                if (not status or t['status'] == status)
+                and (bound is None or (t['created_at'], t['id']) < bound)
+            ]
+        tasks.sort(key=lambda t: (t['created_at'], t['id']), reverse=True)
+        start = 0 if after else offset
+        return [dict(t) for t in tasks[start:start + limit]]
+
+    def update_status(self, task_id, status, result=None, error=None):
+        """更新任务状态"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task:
+                return
+            if task['status'] != status:
+                self._record_event(task_id, 'status', task['status'], status, task['claimed_by'])
+            task['status'] = status
+            task['updated_at'] = now
+            if status == '处理中':
+                task['started_at'] = now
+            elif status in ['已完成', '失败', '已归档']:
+                task['completed_at'] = now
+            if result:
+                task['result'] = result
+            if error:
+                task['error'] = error
+
+    def heartbeat(self, task_id):
+        """刷新执行中任务的 updated_at"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task and task['status'] == '处理中':
+                task['updated_at'] = datetime.now().isoformat()
+
+    def record_prompt_tokens(self, task_id, tokens):
+        """记录任务提示词的估算 token 数"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task:
+                task['prompt_tokens'] = tokens
+
+    def update_task(self, task_id, message=None, priority=None):
+        """更新任务内容和优先级（仅允许在待处理状态下编辑）"""
+        with self._lock:
+            if not self.can_edit_task(task_id):
+                raise ValueError("任务状态不允许编辑")
+            task = self._tasks[task_id]
+            if (message is not None and message != task['message']) or \
+                    (priority is not None and priority != task['priority']):
+                self._record_event(task_id, 'updated', task['status'], task['status'])
+            task['updated_at'] = datetime.now().isoformat()
+            if message is not None:
+                task['message'] = message
+            if priority is not None:
+                task['priority'] = priority
+                task['priority_rank'] = self._priority_rank(priority)
+            return True
+
+    def delete_task(self, task_id):
+        """删除任务（仅允许删除待处理状态的任务）"""
+        with self._lock:
+            if not self.can_delete_task(task_id):
+                raise ValueError("任务状态不允许删除")
+            self._record_event(task_id, 'deleted', self._tasks[task_id]['status'])
+            del self._tasks[task_id]
+            return True
+
+    def _claim(self, task, worker_id):
+        """标记任务为处理中并返回副本（调用方持有锁）"""
+        now = datetime.now().isoformat()
+        self._record_event(task['id'], 'status', task['status'], '处理中', worker_id)
+        task.update(status='处理中', claimed_by=worker_id, started_at=now, updated_at=now)
+        return dict(task)
+
+    def claim_next_task(self, worker_id, priority_order=None):
+        """原子地领取下一个待处理任务"""
+        if priority_order:
+            ranks = {p: i for i, p in enumerate(priority_order)}
+            rank_of = lambda t: ranks.get(t['priority'], len(priority_order))
+        else:
+            rank_of = lambda t: t['priority_rank']
+
+        with self._lock:
+            pending = [t for t in self._tasks.values() if t['status'] == '待处理']
+            if not pending:
+                return None
+            task = min(pending, key=lambda t: (rank_of(t), t['created_at']))
+            return self._claim(task, worker_id)
+
+    def claim_task(self, task_id, worker_id):
+        """原子地领取指定任务"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task or task['status'] == '处理中':
+                return None
+            return self._claim(task, worker_id)
+
+    def release_stale_claims(self, stale_before, is_worker_alive=None):
+        """把执行者已不在运行的处理中任务重置为待处理"""
+        released = []
+        now = datetime.now().isoformat()
+        with self._lock:
+            for task in self._tasks.values():
+                if task['status'] != '处理中':
+                    continue
+                if task['updated_at'] < stale_before or (
+                        is_worker_alive and not is_worker_alive(task['claimed_by'])):
+                    self._record_event(task['id'], 'status', '处理中', '待处理')
+                    task.update(status='待处理', claimed_by=None, started_at=None, updated_at=now)
+                    released.append(task['id'])
+        return released
+
+    def get_stats(self):
+        """获取统计信息"""
+        stats = {status: 0 for status in self.TASK_STATUSES}
+        with self._lock:
+            for task in self._tasks.values():
+                if task['status'] in stats:
+                    stats[task['status']] += 1
+        return stats
+
+    def events_since(self, event_id=0, limit=500):
+        """获取指定事件之后的任务事件（按 event_id 升序）"""
+        with self._lock:
+            return [dict(e) for e in self._events[event_id:event_id + limit]]
+
+    def latest_event_id(self):
+        """获取最新的任务事件 ID（没有事件时为 0）"""
+        with self._lock:
+            return len(self._events)
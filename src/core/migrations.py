@@ -0,0 +1,909 @@
+# -*- coding: utf-8 -*-
+"""
+数据库结构版本管理 - 按版本号顺序执行的迁移
+
+每个迁移包含一个结构变更函数（在排他锁内执行，应尽量短小）和一个可选的
+数据回填函数（在锁外分批执行，每批一个事务，中断后下次启动从断点继续）。
+已执行的版本记录在 schema_version 表中。
+"""
+import re
+import time
+import zlib
+import hashlib
+import threading
+from datetime import datetime
+from src.core.logger import setup_logger
+
+logger = setup_logger('migrations', 'data/logs/database.log')
+
+# 迁移列表：(版本号, 名称, 结构变更函数, 数据回填函数)
+MIGRATIONS = []
+
+# 超过该字节数的 result/error 压缩后存入 task_outputs 表，tasks 表只保留预览
+INLINE_OUTPUT_LIMIT = 4096
+OUTPUT_PREVIEW_CHARS = 500
+
+# 回填大输出时每批最多处理的任务数（单个输出可能有数 MB）
+OUTPUT_BACKFILL_ROWS = 50
+
+# 全文检索索引每次写入的任务数
+SEARCH_INDEX_BATCH = 500
+
+# 双字词索引切分：中日韩文字的连续片段 / 其他文字的单词
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_BIGRAM_RUNS = re.compile(f'([{_CJK_CHARS}]+)|([^\\W{_CJK_CHARS}]+)')
+
+# 每个进程对同一个数据库只检查一次
+_migrated = set()
+_migrated_lock = threading.Lock()
+
+
+def migration(version, name, backfill=None):
+    """注册迁移的装饰器"""
+    def decorator(func):
+        MIGRATIONS.append((version, name, func, backfill))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def _table_columns(cursor, table):
+    """获取表的列名集合"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    return {row['name'] for row in cursor.fetchall()}
+
+
+def _object_exists(cursor, object_type, name, schema='main'):
+    """检查 sqlite_master 中是否存在指定对象"""
+    cursor.execute(f'SELECT 1 FROM {schema}.sqlite_master WHERE type = ? AND name = ?', (object_type, name))
+    return cursor.fetchone() is not None
+
+
+def store_output(cursor, text, schema='main'):
+    """
+    保存任务输出，超过 INLINE_OUTPUT_LIMIT 字节时压缩存入 task_outputs 表（按内容哈希去重）
+
+    Returns:
+        tuple: (写入 tasks 表的内容, 外部存储引用, 原始字节数)
+    """
+    raw = text.encode('utf-8')
+    if len(raw) <= INLINE_OUTPUT_LIMIT:
+        return text, None, len(raw)
+
+    ref = hashlib.sha256(raw).hexdigest()
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO {schema}.task_outputs (hash, codec, size, data, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (ref, 'zlib', len(raw), zlib.compress(raw, 6), datetime.now().isoformat()))
+    return text[:OUTPUT_PREVIEW_CHARS], ref, len(raw)
+
+
+def decode_output(codec, data):
+    """解压 task_outputs 中保存的输出"""
+    if data is None:
+        return None
+    if codec != 'zlib':
+        raise ValueError(f"不支持的输出编码: {codec}")
+    return zlib.decompress(data).decode('utf-8')
+
+
+def _archive_ready(cursor):
+    """冷库已附加且已创建 tasks 表"""
+    cursor.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'")
+    if not cursor.fetchone():
+        return False
+    return _object_exists(cursor, 'table', 'tasks', 'archive')
+
+
+def search_bigrams(*texts):
+    """
+    生成全文检索 bigrams 列的内容，供 trigram 无法索引的两个字符的关键词检索
+
+    中日韩文字按相邻两个字切分，其他文字取长度为 2 的单词（按单词匹配），去重后以空格
+    分隔，首尾也加空格：检索 " 中文 " 只会匹配完整的双字词，仍然走 trigram 索引。
+    """
+    grams = {}
+    for text in texts:
+        for cjk, word in _BIGRAM_RUNS.findall(text or ''):
+            if cjk:
+                for i in range(len(cjk) - 1):
+                    grams[cjk[i:i + 2]] = None
+            elif len(word) == 2:
+                grams[word.lower()] = None
+    return f" {' '.join(grams)} " if grams else ''
+
+
+def create_search_index(cursor, schema='main'):
+    """
+    创建任务全文检索索引（FTS5 trigram，支持中文子串检索）
+
+    索引保存自己的内容：消息、完整输出（外部存储的大输出解压后写入）和双字词，
+    由应用调用 index_tasks() 写入。触发器只用纯 SQL：插入和修改任务时同步消息和
+    tasks 表中的输出预览，删除任务时删除索引行。不依赖连接上注册的函数，
+    其他工具（sqlite3 命令行、数据库浏览器等）修改 tasks 表不会失败。
+
+    Args:
+        schema: main（主库）或 archive（冷库，tasks 表没有整数主键，按 rowid 关联）
+
+    Returns:
+        bool: 索引是否可用（当前 SQLite 不支持 FTS5 trigram 时为 False）
+    """
+    key = 'seq' if schema == 'main' else 'rowid'
+    try:
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.tasks_fts USING fts5(
+                message, result, bigrams, tokenize='trigram'
+            )
+        ''')
+    except Exception as e:
+        logger.warning(f"当前 SQLite 不支持 FTS5 trigram，全文检索不可用: {e}")
+        return False
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {schema}.trg_tasks_fts_insert
+        AFTER INSERT ON tasks
+        BEGIN
+            INSERT INTO tasks_fts (rowid, message, result) VALUES (NEW.{key}, NEW.message, NEW.result);
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {schema}.trg_tasks_fts_delete
+        AFTER DELETE ON tasks
+        BEGIN
+            DELETE FROM tasks_fts WHERE rowid = OLD.{key};
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {schema}.trg_tasks_fts_update
+        AFTER UPDATE OF message, result ON tasks
+        BEGIN
+            UPDATE tasks_fts SET message = NEW.message, result = NEW.result WHERE rowid = NEW.{key};
+        END
+    ''')
+    return True
+
+
+def drop_search_index(cursor, schema='main'):
+    """删除全文检索索引及其触发器（包括旧版本的外部内容视图）"""
+    for trigger in ('trg_tasks_fts_insert', 'trg_tasks_fts_delete', 'trg_tasks_fts_update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {schema}.{trigger}')
+    cursor.execute(f'DROP VIEW IF EXISTS {schema}.tasks_fts_content')
+    cursor.execute(f'DROP TABLE IF EXISTS {schema}.tasks_fts')
+
+
+def index_tasks(cursor, task_ids, schema='main'):
+    """
+    把任务的消息、完整输出和双字词写入全文检索索引
+
+    写入或修改任务消息、输出后调用（触发器只能同步 tasks 表中的输出预览）。
+    """
+    key = 'seq' if schema == 'main' else 'rowid'
+    task_ids = list(task_ids)
+    for start in range(0, len(task_ids), SEARCH_INDEX_BATCH):
+        chunk = task_ids[start:start + SEARCH_INDEX_BATCH]
+        placeholders = ', '.join('?' for _ in chunk)
+        cursor.execute(f'''
+            SELECT t.{key} AS row_key, t.message, t.result, o.codec, o.data
+            FROM {schema}.tasks t
+            LEFT JOIN {schema}.task_outputs o ON o.hash = t.result_ref
+            WHERE t.id IN ({placeholders})
+        ''', chunk)
+        rows = []
+        for row in cursor.fetchall():
+            result = row['result'] if row['data'] is None else decode_output(row['codec'], row['data'])
+            rows.append((row['row_key'], row['message'], result, search_bigrams(row['message'], result)))
+        cursor.executemany(f'''
+            INSERT OR REPLACE INTO {schema}.tasks_fts (rowid, message, result, bigrams)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+
+
+def rebuild_search_index(cursor, schema='main'):
+    """清空并重新写入全文检索索引（冷库 VACUUM 后 rowid 可能变化时使用）"""
+    cursor.execute(f'DELETE FROM {schema}.tasks_fts')
+    cursor.execute(f'SELECT id FROM {schema}.tasks')
+    index_tasks(cursor, [row[0] for row in cursor.fetchall()], schema)
+    logger.info(f"全文检索索引已重建（{schema}）")
+
+
+# ---------------------------------------------------------------------------
+# 数据回填
+# ---------------------------------------------------------------------------
+
+def _backfill_priority_rank(cursor, state, chunk_size):
+    """按 seq 区间分批回填 priority_rank"""
+    last_seq = int(state or 0)
+    cursor.execute(
+        'SELECT seq FROM tasks WHERE seq > ? ORDER BY seq LIMIT 1 OFFSET ?',
+        (last_seq, chunk_size - 1)
+    )
+    row = cursor.fetchone()
+    upper = row['seq'] if row else None
+
+    sql = '''
+        UPDATE tasks SET priority_rank = CASE priority
+            WHEN 'high' THEN 0 WHEN 'low' THEN 2 ELSE 1 END
+        WHERE seq > ?
+    '''
+    if upper is None:
+        cursor.execute(sql, (last_seq,))
+        return None
+    cursor.execute(sql + ' AND seq <= ?', (last_seq, upper))
+    return str(upper)
+
+
+def _backfill_task_outputs(cursor, state, chunk_size):
+    """
+    把升级前内联存储在 tasks 表中的大输出移到 task_outputs（先主库，后冷库）
+
+    按行号区间分批扫描，每批最多迁移 OUTPUT_BACKFILL_ROWS 个任务。
+    状态格式为 "库名:已处理到的行号"。
+    """
+    schema, last = (state or 'main:0').split(':')
+    last = int(last)
+    if schema == 'archive' and not _archive_ready(cursor):
+        return None
+    key = 'seq' if schema == 'main' else 'rowid'
+
+    cursor.execute(
+        f'SELECT {key} FROM {schema}.tasks WHERE {key} > ? ORDER BY {key} LIMIT 1 OFFSET ?',
+        (last, chunk_size - 1)
+    )
+    row = cursor.fetchone()
+    upper = row[0] if row else None
+
+    condition = f'{key} > ?' if upper is None else f'{key} > ? AND {key} <= ?'
+    params = [last] if upper is None else [last, upper]
+    cursor.execute(f'''
+        SELECT {key} AS row_key, id, result, result_ref, error, error_ref FROM {schema}.tasks
+        WHERE {condition}
+          AND ((result_ref IS NULL AND length(CAST(result AS BLOB)) > ?)
+               OR (error_ref IS NULL AND length(CAST(error AS BLOB)) > ?))
+        ORDER BY {key}
+        LIMIT ?
+    ''', params + [INLINE_OUTPUT_LIMIT, INLINE_OUTPUT_LIMIT, OUTPUT_BACKFILL_ROWS])
+    rows = cursor.fetchall()
+
+    for row in rows:
+        updates = []
+        values = []
+        for field in ('result', 'error'):
+            if row[field] and row[f'{field}_ref'] is None:
+                preview, ref, size = store_output(cursor, row[field], schema)
+                updates.append(f'{field} = ?, {field}_ref = ?, {field}_size = ?')
+                values.extend([preview, ref, size])
+        values.append(row['row_key'])
+        cursor.execute(f"UPDATE {schema}.tasks SET {', '.join(updates)} WHERE {key} = ?", values)
+    # 触发器只会把输出预览写入全文检索索引，重新写入完整输出
+    if rows and _object_exists(cursor, 'table', 'tasks_fts', schema):
+        index_tasks(cursor, [row['id'] for row in rows], schema)
+
+    if len(rows) == OUTPUT_BACKFILL_ROWS:
+        return f"{schema}:{rows[-1]['row_key']}"
+    if upper is not None:
+        return f"{schema}:{upper}"
+    return 'archive:0' if schema == 'main' else None
+
+
+def _backfill_search_index(cursor, state, chunk_size):
+    """
+    把已有任务写入全文检索索引（先主库，后冷库）
+
+    按行号分批写入，状态格式为 "库名:已处理到的行号"。
+    """
+    schema, last = (state or 'main:0').split(':')
+    last = int(last)
+    if schema == 'archive' and not _archive_ready(cursor):
+        return None
+    if _object_exists(cursor, 'table', 'tasks_fts', schema):
+        key = 'seq' if schema == 'main' else 'rowid'
+        cursor.execute(
+            f'SELECT {key} AS row_key, id FROM {schema}.tasks WHERE {key} > ? ORDER BY {key} LIMIT ?',
+            (last, chunk_size)
+        )
+        rows = cursor.fetchall()
+        if rows:
+            index_tasks(cursor, [row['id'] for row in rows], schema)
+            return f"{schema}:{rows[-1]['row_key']}"
+    return 'archive:0' if schema == 'main' else None
+
+
+# ---------------------------------------------------------------------------
+# 迁移
+# ---------------------------------------------------------------------------
+
+@migration(1, 'create_tasks')
+def _create_tasks(cursor):
+    """创建 tasks 表；旧版以 TEXT id 为主键的表重建为整数主键 + 唯一 id 列"""
+    # seq 是整数主键（rowid 别名），id 为对外公开的任务 ID
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            seq INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            user_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL,
+            priority TEXT DEFAULT 'normal',
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            started_at TEXT,
+            completed_at TEXT,
+            result TEXT,
+            error TEXT
+        )
+    ''')
+
+    cursor.execute('PRAGMA table_info(tasks)')
+    columns = cursor.fetchall()
+    if any(col['name'] == 'seq' for col in columns):
+        return
+
+    logger.info("迁移 tasks 表为整数主键...")
+    definitions = ['seq INTEGER PRIMARY KEY', 'id TEXT NOT NULL UNIQUE']
+    names = []
+    for col in columns:
+        names.append(col['name'])
+        if col['name'] == 'id':
+            continue
+        definition = f"{col['name']} {col['type']}"
+        if col['notnull']:
+            definition += ' NOT NULL'
+        if col['dflt_value'] is not None:
+            definition += f" DEFAULT {col['dflt_value']}"
+        definitions.append(definition)
+
+    column_list = ', '.join(names)
+    cursor.execute(f"CREATE TABLE tasks_migrating ({', '.join(definitions)})")
+    cursor.execute(f'''
+        INSERT INTO tasks_migrating ({column_list})
+        SELECT {column_list} FROM tasks ORDER BY created_at, id
+    ''')
+    # 删除旧表会一并删除其索引和触发器，后续迁移会重新创建并重建计数与全文索引
+    cursor.execute('DROP TABLE tasks')
+    cursor.execute('ALTER TABLE tasks_migrating RENAME TO tasks')
+    cursor.execute('DROP TABLE IF EXISTS tasks_fts')
+    logger.info("tasks 表迁移完成")
+
+
+@migration(2, 'task_indexes')
+def _create_task_indexes(cursor):
+    """复合索引覆盖按状态过滤 + 时间倒序的键集分页"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tasks_status_created
+        ON tasks(status, created_at DESC, id DESC)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tasks_created
+        ON tasks(created_at DESC, id DESC)
+    ''')
+    # 旧的单列索引已被上面的复合索引覆盖
+    cursor.execute('DROP INDEX IF EXISTS idx_status')
+    cursor.execute('DROP INDEX IF EXISTS idx_created_at')
+
+
+@migration(3, 'task_claim_columns', backfill=_backfill_priority_rank)
+def _add_claim_columns(cursor):
+    """任务领取所需的 priority_rank / claimed_by 列和覆盖索引"""
+    columns = _table_columns(cursor, 'tasks')
+    if 'priority_rank' not in columns:
+        cursor.execute('ALTER TABLE tasks ADD COLUMN priority_rank INTEGER NOT NULL DEFAULT 1')
+    if 'claimed_by' not in columns:
+        cursor.execute('ALTER TABLE tasks ADD COLUMN claimed_by TEXT')
+
+    # 覆盖索引：按状态过滤后直接按 (priority_rank, created_at) 顺序取出 id
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tasks_claim
+        ON tasks(status, priority_rank, created_at, id)
+    ''')
+
+
+@migration(4, 'task_output_storage')
+def _create_output_storage(cursor):
+    """任务输出的外部存储（内容寻址 + zlib 压缩）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_outputs (
+            hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+    columns = _table_columns(cursor, 'tasks')
+    for column, column_type in [('result_ref', 'TEXT'), ('result_size', 'INTEGER'),
+                                ('error_ref', 'TEXT'), ('error_size', 'INTEGER')]:
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE tasks ADD COLUMN {column} {column_type}')
+
+    # 移动归档任务后判断输出是否仍被主库引用
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tasks_result_ref
+        ON tasks(result_ref) WHERE result_ref IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tasks_error_ref
+        ON tasks(error_ref) WHERE error_ref IS NOT NULL
+    ''')
+
+
+@migration(5, 'task_search_index')
+def _create_search_index(cursor):
+    """任务全文检索索引（FTS5 trigram，支持中文子串检索）"""
+    needs_rebuild = not _object_exists(cursor, 'table', 'tasks_fts')
+
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+                message, result,
+                content='tasks', content_rowid='seq',
+                tokenize='trigram'
+            )
+        ''')
+    except Exception as e:
+        logger.warning(f"当前 SQLite 不支持 FTS5 trigram，全文检索不可用: {e}")
+        return
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_insert
+        AFTER INSERT ON tasks
+        BEGIN
+            INSERT INTO tasks_fts (rowid, message, result)
+            VALUES (NEW.seq, NEW.message, NEW.result);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_delete
+        AFTER DELETE ON tasks
+        BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, message, result)
+            VALUES ('delete', OLD.seq, OLD.message, OLD.result);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_update
+        AFTER UPDATE OF message, result ON tasks
+        BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, message, result)
+            VALUES ('delete', OLD.seq, OLD.message, OLD.result);
+            INSERT INTO tasks_fts (rowid, message, result)
+            VALUES (NEW.seq, NEW.message, NEW.result);
+        END
+    ''')
+
+    if needs_rebuild:
+        cursor.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+        logger.info("全文检索索引已重建")
+
+
+def rebuild_task_counters(cursor):
+    """通过一次 GROUP BY 扫描重建任务状态计数（包含冷库中的任务）"""
+    cursor.execute('DELETE FROM task_counters')
+    cursor.execute('''
+        INSERT INTO task_counters (status, count)
+        SELECT status, COUNT(*) FROM main.tasks GROUP BY status
+    ''')
+    cursor.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'")
+    archive_attached = cursor.fetchone() is not None
+    if archive_attached:
+        cursor.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'tasks'")
+        if cursor.fetchone():
+            cursor.execute('''
+                INSERT INTO task_counters (status, count)
+                SELECT status, COUNT(*) FROM archive.tasks WHERE true GROUP BY status
+                ON CONFLICT(status) DO UPDATE SET count = count + excluded.count
+            ''')
+    logger.info("任务状态计数已重建")
+
+
+@migration(6, 'task_counters')
+def _create_task_counters(cursor):
+    """由触发器维护的任务状态计数表"""
+    needs_rebuild = not _object_exists(cursor, 'trigger', 'trg_task_counters_insert')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_counters (
+            status TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_task_counters_insert
+        AFTER INSERT ON tasks
+        BEGIN
+            INSERT INTO task_counters (status, count) VALUES (NEW.status, 1)
+            ON CONFLICT(status) DO UPDATE SET count = count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_task_counters_delete
+        AFTER DELETE ON tasks
+        BEGIN
+            UPDATE task_counters SET count = count - 1 WHERE status = OLD.status;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_task_counters_update
+        AFTER UPDATE OF status ON tasks
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE task_counters SET count = count - 1 WHERE status = OLD.status;
+            INSERT INTO task_counters (status, count) VALUES (NEW.status, 1)
+            ON CONFLICT(status) DO UPDATE SET count = count + 1;
+        END
+    ''')
+
+    # 触发器是新建的（旧数据库升级），用一次全表扫描补齐计数
+    if needs_rebuild:
+        rebuild_task_counters(cursor)
+
+
+@migration(7, 'history_tables')
+def _create_history_tables(cursor):
+    """历史上下文配置表和记录表"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_config (
+            id INTEGER PRIMARY KEY,
+            enabled INTEGER DEFAULT 0,
+            max_history_count INTEGER DEFAULT 5,
+            updated_at TEXT
+        )
+    ''')
+
+    # 历史上下文记录表（存储压缩后的上下文）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_context_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_history_created_at
+        ON history_context_records(created_at DESC)
+    ''')
+
+    # 如果配置表为空，插入默认配置
+    cursor.execute('SELECT COUNT(*) FROM history_config')
+    if cursor.fetchone()[0] == 0:
+        cursor.execute('''
+            INSERT INTO history_config (enabled, max_history_count, updated_at)
+            VALUES (0, 5, ?)
+        ''', (datetime.now().isoformat(),))
+
+
+@migration(8, 'telegram_config_table')
+def _create_telegram_config_table(cursor):
+    """Telegram 配置表"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS telegram_config (
+            id INTEGER PRIMARY KEY,
+            enabled INTEGER DEFAULT 0,
+            bot_token TEXT,
+            chat_id TEXT,
+            updated_at TEXT
+        )
+    ''')
+
+    # 插入默认配置
+    cursor.execute('SELECT COUNT(*) FROM telegram_config')
+    if cursor.fetchone()[0] == 0:
+        cursor.execute('''
+            INSERT INTO telegram_config (enabled, updated_at)
+            VALUES (0, ?)
+        ''', (datetime.now().isoformat(),))
+
+
+@migration(9, 'task_events')
+def _create_task_events(cursor):
+    """只追加的任务事件表，由触发器记录每次状态变化"""
+    # AUTOINCREMENT 保证 event_id 单调递增且删除旧事件后不会复用
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            old_status TEXT,
+            new_status TEXT,
+            worker_id TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_task_events_task
+        ON task_events(task_id, event_id)
+    ''')
+
+    now = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_task_events_insert
+        AFTER INSERT ON tasks
+        BEGIN
+            INSERT INTO task_events (task_id, event_type, new_status, created_at)
+            VALUES (NEW.id, 'created', NEW.status, {now});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_task_events_status
+        AFTER UPDATE OF status ON tasks
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO task_events (task_id, event_type, old_status, new_status, worker_id, created_at)
+            VALUES (NEW.id, 'status', OLD.status, NEW.status, NEW.claimed_by, {now});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_task_events_update
+        AFTER UPDATE OF message, priority ON tasks
+        WHEN OLD.message IS NOT NEW.message OR OLD.priority IS NOT NEW.priority
+        BEGIN
+            INSERT INTO task_events (task_id, event_type, old_status, new_status, created_at)
+            VALUES (NEW.id, 'updated', OLD.status, NEW.status, {now});
+        END
+    ''')
+    # 已归档任务移入冷库时的删除不算状态变化，不记录
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_task_events_delete
+        AFTER DELETE ON tasks
+        WHEN OLD.status IS NOT '已归档'
+        BEGIN
+            INSERT INTO task_events (task_id, event_type, old_status, created_at)
+            VALUES (OLD.id, 'deleted', OLD.status, {now});
+        END
+    ''')
+
+
+@migration(10, 'history_generation')
+def _add_history_generation(cursor):
+    """历史上下文的版本号：记录或配置变化时由触发器加一，供各进程判断缓存是否失效"""
+    if 'generation' not in _table_columns(cursor, 'history_config'):
+        cursor.execute('ALTER TABLE history_config ADD COLUMN generation INTEGER NOT NULL DEFAULT 0')
+
+    bump = 'UPDATE history_config SET generation = generation + 1 WHERE id = 1;'
+    for event in ('INSERT', 'DELETE', 'UPDATE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_history_records_{event.lower()}
+            AFTER {event} ON history_context_records
+            BEGIN
+                {bump}
+            END
+        ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_history_config_update
+        AFTER UPDATE OF enabled, max_history_count ON history_config
+        BEGIN
+            {bump}
+        END
+    ''')
+
+
+@migration(11, 'history_ring_buffer')
+def _create_history_ring_buffer(cursor):
+    """历史记录固定容量：插入后由触发器按主键删除超出容量的旧记录"""
+    # id 为 AUTOINCREMENT，单调递增，低于水位线 NEW.id - 容量 的记录即为最旧的记录
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_history_records_trim
+        AFTER INSERT ON history_context_records
+        BEGIN
+            DELETE FROM history_context_records
+            WHERE id <= NEW.id - (SELECT max_history_count FROM history_config WHERE id = 1);
+        END
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_history_task_id
+        ON history_context_records(task_id)
+    ''')
+
+
+@migration(12, 'history_retrieval_mode')
+def _add_history_retrieval_mode(cursor):
+    """历史记录选取方式（recent / relevant / hybrid）和独立于注入条数的保留容量"""
+    columns = _table_columns(cursor, 'history_config')
+    if 'mode' not in columns:
+        cursor.execute("ALTER TABLE history_config ADD COLUMN mode TEXT NOT NULL DEFAULT 'recent'")
+    if 'capacity' not in columns:
+        cursor.execute('ALTER TABLE history_config ADD COLUMN capacity INTEGER NOT NULL DEFAULT 200')
+
+    # 按相关性选取时需要保留比注入条数更多的记录，容量取两者中较大的值
+    cursor.execute('DROP TRIGGER IF EXISTS trg_history_records_trim')
+    cursor.execute('''
+        CREATE TRIGGER trg_history_records_trim
+        AFTER INSERT ON history_context_records
+        BEGIN
+            DELETE FROM history_context_records
+            WHERE id <= NEW.id - (
+                SELECT MAX(capacity, max_history_count) FROM history_config WHERE id = 1
+            );
+        END
+    ''')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_history_config_update')
+    cursor.execute('''
+        CREATE TRIGGER trg_history_config_update
+        AFTER UPDATE OF enabled, max_history_count, mode, capacity ON history_config
+        BEGIN
+            UPDATE history_config SET generation = generation + 1 WHERE id = 1;
+        END
+    ''')
+
+
+@migration(13, 'task_prompt_tokens')
+def _add_task_prompt_tokens(cursor):
+    """记录每个任务最终提示词的估算 token 数"""
+    if 'prompt_tokens' not in _table_columns(cursor, 'tasks'):
+        cursor.execute('ALTER TABLE tasks ADD COLUMN prompt_tokens INTEGER')
+
+
+
+@migration(14, 'history_record_revision')
+def _add_history_record_revision(cursor):
+    """历史记录的修订号：摘要在后台更新时记为更新后的版本号，供检索索引增量重建"""
+    if 'revision' not in _table_columns(cursor, 'history_context_records'):
+        cursor.execute('ALTER TABLE history_context_records ADD COLUMN revision INTEGER NOT NULL DEFAULT 0')
+
+
+
+@migration(15, 'task_progress')
+def _create_task_progress(cursor):
+    """任务执行进度（各进程共享）：每个任务一行状态，输出行按 (task_id, line_no) 聚簇存储"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_progress (
+            task_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            total_lines INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_progress_lines (
+            task_id TEXT NOT NULL,
+            line_no INTEGER NOT NULL,
+            line TEXT NOT NULL,
+            PRIMARY KEY (task_id, line_no)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_task_progress_updated
+        ON task_progress(updated_at)
+    ''')
+
+
+@migration(16, 'compact_task_outputs', backfill=_backfill_task_outputs)
+def _compact_task_outputs(cursor):
+    """升级前写入的大输出由数据回填移到 task_outputs，无结构变更"""
+
+
+@migration(17, 'task_search_full_output')
+def _index_full_outputs(cursor):
+    """全文检索索引改为索引外部存储的完整输出（原索引只包含 tasks 表中的预览）"""
+    # 索引结构和内容由迁移 18 重建
+
+
+@migration(18, 'task_search_app_index', backfill=_backfill_search_index)
+def _index_from_application(cursor):
+    """
+    全文检索索引改为由应用写入完整输出和双字词，触发器只用纯 SQL
+
+    迁移 17 的视图和触发器调用应用注册的 task_output_text()，其他工具修改 tasks 表
+    会失败。主库和冷库的索引重建为空表，由数据回填写入已有任务。
+    """
+    for schema in ('main', 'archive'):
+        if schema == 'archive' and not _archive_ready(cursor):
+            continue
+        drop_search_index(cursor, schema)
+        create_search_index(cursor, schema)
+
+
+# ---------------------------------------------------------------------------
+# 执行器
+# ---------------------------------------------------------------------------
+
+class MigrationRunner:
+    """迁移执行器"""
+
+    # 执行结构变更时等待其他进程释放锁的最长时间（毫秒）
+    LOCK_TIMEOUT_MS = 60000
+
+    def __init__(self, pool, chunk_size=1000, pause=0.05):
+        """
+        Args:
+            pool: 数据库连接池
+            chunk_size: 数据回填每批处理的行数
+            pause: 回填批次之间的休眠秒数，给其他写入者让出锁
+        """
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.pause = pause
+
+    def run(self):
+        """执行所有未执行的结构变更，然后完成未完成的数据回填"""
+        self._ensure_version_table()
+        self._apply_pending()
+        self._run_backfills()
+
+    def _ensure_version_table(self):
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TEXT NOT NULL,
+                    backfill_state TEXT,
+                    backfill_done INTEGER NOT NULL DEFAULT 1
+                )
+            ''')
+
+    def current_version(self):
+        """当前已执行的最高版本号"""
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+            return row[0] or 0
+
+    def _apply_pending(self):
+        """在排他锁内执行未执行的结构变更"""
+        latest = MIGRATIONS[-1][0] if MIGRATIONS else 0
+        if self.current_version() >= latest:
+            return
+
+        with self.pool.connection() as conn:
+            conn.execute(f'PRAGMA busy_timeout = {self.LOCK_TIMEOUT_MS}')
+            try:
+                conn.execute('BEGIN EXCLUSIVE')
+                # 获得锁后重新读取版本，其他进程可能已经完成迁移
+                current = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+                cursor = conn.cursor()
+                for version, name, upgrade, backfill in MIGRATIONS:
+                    if version <= current:
+                        continue
+                    logger.info(f"执行数据库迁移 {version}: {name}")
+                    upgrade(cursor)
+                    cursor.execute('''
+                        INSERT INTO schema_version (version, name, applied_at, backfill_done)
+                        VALUES (?, ?, ?, ?)
+                    ''', (version, name, datetime.now().isoformat(), 0 if backfill else 1))
+            finally:
+                conn.execute(f"PRAGMA busy_timeout = {self.pool.PRAGMAS['busy_timeout']}")
+        logger.info(f"数据库结构已升级到版本 {latest}")
+
+    def _run_backfills(self):
+        """分批执行未完成的数据回填，每批一个短事务"""
+        backfills = {version: (name, backfill) for version, name, _, backfill in MIGRATIONS if backfill}
+        with self.pool.connection() as conn:
+            pending = [row['version'] for row in conn.execute(
+                'SELECT version FROM schema_version WHERE backfill_done = 0 ORDER BY version'
+            )]
+
+        for version in pending:
+            if version not in backfills:
+                continue
+            name, backfill = backfills[version]
+            logger.info(f"开始数据回填 {version}: {name}")
+            while True:
+                with self.pool.connection() as conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    row = conn.execute(
+                        'SELECT backfill_state, backfill_done FROM schema_version WHERE version = ?',
+                        (version,)
+                    ).fetchone()
+                    if row['backfill_done']:
+                        break
+                    state = backfill(conn.cursor(), row['backfill_state'], self.chunk_size)
+                    conn.execute(
+                        'UPDATE schema_version SET backfill_state = ?, backfill_done = ? WHERE version = ?',
+                        (state, 1 if state is None else 0, version)
+                    )
+                if state is None:
+                    break
+                time.sleep(self.pause)
+            logger.info(f"数据回填完成 {version}: {name}")
+
+
+def run_migrations(pool):
+    """执行数据库迁移（每个进程对同一个数据库只执行一次）"""
+    with _migrated_lock:
+        if pool.db_path in _migrated:
+            return
+        MigrationRunner(pool).run()
+        _migrated.add(pool.db_path)
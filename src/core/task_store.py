@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+任务存储接口 - 服务层只依赖该接口，可替换为 SQLite 或内存实现
+"""
+import json
+import base64
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+
+
+class TaskStore(ABC):
+    """任务存储接口"""
+
+    # 任务状态
+    TASK_STATUSES = ['待处理', '处理中', '已完成', '失败', '已归档']
+
+    # 优先级对应的整数排序值（越小越先执行）
+    PRIORITY_RANKS = {'high': 0, 'normal': 1, 'low': 2}
+    DEFAULT_PRIORITY_RANK = 1
+
+    ARCHIVED_STATUS = '已归档'
+
+    @abstractmethod
+    def create_task(self, user_id, message, priority='normal'):
+        """创建任务，返回任务 ID"""
+
+    @abstractmethod
+    def create_tasks_batch(self, tasks, user_id='batch_import'):
+        """批量创建任务，返回按输入顺序生成的任务 ID"""
+
+    @abstractmethod
+    def get_task(self, task_id, full_output=True):
+        """获取单个任务，不存在时返回 None"""
+
+    @abstractmethod
+    def list_tasks(self, status=None, limit=100, offset=0, after=None, include_archive=None):
+        """按 (created_at, id) 倒序列出任务"""
+
+    @abstractmethod
+    def update_status(self, task_id, status, result=None, error=None):
+        """更新任务状态"""
+
+    @abstractmethod
+    def update_task(self, task_id, message=None, priority=None):
+        """更新任务内容和优先级（仅允许在待处理状态下编辑）"""
+
+    @abstractmethod
+    def delete_task(self, task_id):
+        """删除任务（仅允许删除待处理状态的任务）"""
+
+    @abstractmethod
+    def claim_next_task(self, worker_id, priority_order=None):
+        """原子地领取下一个待处理任务并标记为处理中，没有任务时返回 None"""
+
+    @abstractmethod
+    def claim_task(self, task_id, worker_id):
+        """原子地领取指定任务（任务不在处理中时才能领取），失败时返回 None"""
+
+    @abstractmethod
+    def release_stale_claims(self, stale_before, is_worker_alive=None):
+        """
+        把执行者已不在运行的处理中任务重置为待处理
+
+        Args:
+            stale_before: 心跳（updated_at）早于该时间（ISO 字符串）的任务视为执行者已退出
+            is_worker_alive: 判断领取者是否仍在运行的函数，返回 False 的领取者的任务立即释放
+
+        Returns:
+            list: 被释放的任务 ID
+        """
+
+    @abstractmethod
+    def get_stats(self):
+        """获取各状态的任务数量"""
+
+    @abstractmethod
+    def events_since(self, event_id=0, limit=500):
+        """获取指定事件之后的任务状态变化事件（按 event_id 升序）"""
+
+    @abstractmethod
+    def latest_event_id(self):
+        """获取最新的任务事件 ID（没有事件时为 0）"""
+
+    def update_status_async(self, task_id, status, result=None, error=None):
+        """
+        提交任务状态更新，返回在写入落盘后完成的 Future
+
+        默认实现同步执行；支持批量提交的存储可覆盖为异步写入。
+        """
+        future = Future()
+        try:
+            future.set_result(self.update_status(task_id, status, result, error))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def heartbeat(self, task_id):
+        """
+        记录执行中任务的心跳（无需等待结果，默认不做任何事）
+
+        心跳超时的任务会被 release_stale_claims 重新置为待处理。
+        """
+
+    def record_prompt_tokens(self, task_id, tokens):
+        """记录任务提示词的估算 token 数（无需等待结果，默认不做任何事）"""
+
+    def _priority_rank(self, priority):
+        """优先级名称转换为整数排序值"""
+        return self.PRIORITY_RANKS.get(priority, self.DEFAULT_PRIORITY_RANK)
+
+    @staticmethod
+    def encode_cursor(task):
+        """根据任务的 (created_at, id) 生成不透明的分页游标"""
+        raw = json.dumps([task['created_at'], task['id']], ensure_ascii=False)
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """解析分页游标，返回 (created_at, id)"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            created_at, task_id = json.loads(base64.urlsafe_b64decode(padded).decode('utf-8'))
+            return str(created_at), str(task_id)
+        except Exception:
+            raise ValueError("无效的分页游标")
+
+    def list_tasks_page(self, status=None, limit=100, after=None):
+        """
+        键集分页列出任务
+
+        Returns:
+            dict: {"tasks": list, "next_cursor": str | None}
+        """
+        tasks = self.list_tasks(status, limit + 1, after=after)
+        next_cursor = None
+        if len(tasks) > limit:
+            tasks = tasks[:limit]
+            next_cursor = self.encode_cursor(tasks[-1])
+        return {"tasks": tasks, "next_cursor": next_cursor}
+
+    def can_edit_task(self, task_id):
+        """检查任务是否可编辑（只有待处理状态的任务可编辑）"""
+        task = self.get_task(task_id, full_output=False)
+        if not task:
+            return False
+        return task['status'] == '待处理'
+
+    def can_delete_task(self, task_id):
+        """检查任务是否可删除（只有待处理状态的任务可删除）"""
+        task = self.get_task(task_id, full_output=False)
+        if not task:
+            return False
+        return task['status'] == '待处理'
+
+    def can_archive_task(self, task_id):
+        """检查任务是否可归档（只有已完成或失败的任务可归档）"""
+        task = self.get_task(task_id, full_output=False)
+        if not task:
+            return False
+        return task['status'] in ['已完成', '失败']
+
+    def archive_task(self, task_id):
+        """归档任务（仅允许归档已完成或失败的任务）"""
+        if not self.can_archive_task(task_id):
+            raise ValueError("任务状态不允许归档")
+        self.update_status(task_id, self.ARCHIVED_STATUS)
+        return True
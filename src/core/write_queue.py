@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+写入队列 - 单个写线程批量提交（group commit）
+
+所有写操作进入同一个队列，由写线程每隔 flush_interval 秒或攒够 max_batch 个
+操作后在一个事务中提交，多个执行器同时完成任务时只产生一次提交和一次 fsync。
+需要确认落盘的调用方等待返回的 Future；进度快照、心跳等写入无需等待。
+"""
+import time
+import queue
+import atexit
+import threading
+from pathlib import Path
+from concurrent.futures import Future
+from src.core.db_pool import get_pool
+from src.core.logger import setup_logger
+
+logger = setup_logger('write_queue', 'data/logs/database.log')
+
+
+class WriteQueue:
+    """单写线程的批量提交队列"""
+
+    def __init__(self, pool, max_batch=200, flush_interval=0.02):
+        """
+        Args:
+            pool: 连接池
+            max_batch: 单个事务最多包含的写操作数
+            flush_interval: 收到第一个写操作后最多等待多久提交（秒）
+        """
+        self.pool = pool
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        提交写操作
+
+        Args:
+            func: 写操作，在写线程中调用；内部通过连接池获取的连接会复用写线程的批量事务
+
+        Returns:
+            Future: 事务提交后完成，结果为 func 的返回值
+        """
+        future = Future()
+        if self._stopped:
+            future.set_exception(RuntimeError("写入队列已关闭"))
+            return future
+        self._queue.put((func, args, kwargs, future))
+        return future
+
+    def flush(self, timeout=None):
+        """等待此前提交的写操作全部落盘"""
+        self.submit(lambda: None).result(timeout)
+
+    def close(self, timeout=5):
+        """提交剩余写操作并停止写线程"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _collect(self):
+        """阻塞等待第一个写操作，再在时间窗口内尽量多收集"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        """写线程主循环"""
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if stop:
+                # 关闭前把队列里剩余的写操作也提交掉
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        batch.append(item)
+            if batch:
+                self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        """在一个事务中执行一批写操作，每个操作用 SAVEPOINT 隔离失败"""
+        results = []
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                for func, args, kwargs, future in batch:
+                    conn.execute('SAVEPOINT write_op')
+                    try:
+                        results.append((future, func(*args, **kwargs), None))
+                        conn.execute('RELEASE write_op')
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO write_op')
+                        conn.execute('RELEASE write_op')
+                        results.append((future, None, e))
+        except Exception as e:
+            logger.error(f"批量提交失败（{len(batch)} 个写操作）: {e}")
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_queue(db_path="data/tasks.db"):
+    """获取指定数据库文件的共享写入队列（进程内单例）"""
+    key = str(Path(db_path).resolve())
+    with _queues_lock:
+        write_queue = _queues.get(key)
+        if write_queue is None:
+            write_queue = WriteQueue(get_pool(db_path))
+            _queues[key] = write_queue
+        return write_queue
+
+
+@atexit.register
+def _close_all():
+    """进程退出前提交所有未完成的写操作"""
+    with _queues_lock:
+        queues = list(_queues.values())
+    for write_queue in queues:
+        write_queue.close()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+历史记录检索索引 - 进程内 BM25 倒排索引
+
+中文等 CJK 文本按相邻两字切分（bigram），英文和数字按单词切分并转为小写，
+无需分词词典或网络服务。
+"""
+import re
+import math
+from collections import Counter
+
+# 连续的 CJK 字符（中日韩统一表意文字、假名、谚文）或连续的字母数字
+_TOKEN_PATTERN = re.compile(
+    r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+|[A-Za-z0-9_]+'
+)
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]')
+
+
+def tokenize(text):
+    """
+    将文本切分为检索词
+
+    Examples:
+        >>> tokenize("整理 arXiv 论文摘要")
+        ['整理', 'arxiv', '论文', '文摘', '摘要']
+    """
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text or ''):
+        if _CJK_PATTERN.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif len(run) > 1:
+            tokens.append(run.lower())
+    return tokens
+
+
+class BM25Index:
+    """支持增量添加和删除文档的 BM25 倒排索引"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = {}   # 文档 ID -> 词数
+        self.doc_terms = {}     # 文档 ID -> 去重后的词（删除时使用）
+        self.postings = {}      # 词 -> {文档 ID: 词频}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_lengths
+
+    def add(self, doc_id, text):
+        """添加（或替换）文档"""
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        length = sum(counts.values())
+        self.doc_lengths[doc_id] = length
+        self.doc_terms[doc_id] = tuple(counts)
+        self.total_length += length
+
+    def remove(self, doc_id):
+        """删除文档（不存在时忽略）"""
+        if doc_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(doc_id):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def clear(self):
+        """清空索引"""
+        self.doc_lengths.clear()
+        self.doc_terms.clear()
+        self.postings.clear()
+        self.total_length = 0
+
+    def search(self, query, limit=5):
+        """
+        按 BM25 得分检索
+
+        Returns:
+            list: [(文档 ID, 得分)]，按得分降序，只包含得分大于 0 的文档
+        """
+        n = len(self.doc_lengths)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1
+
+        scores = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            df = len(docs)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for doc_id, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked[:limit]
@@ -2,77 +2,127 @@
 """
 历史上下文管理模块
 """
-import sqlite3
-import json
+import time
+import threading
 from datetime import datetime
 from pathlib import Path
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from src.core.logger import setup_logger
+from src.core.db_pool import get_pool
+from src.core.write_queue import get_write_queue
+from src.core.migrations import run_migrations
+from src.managers.history_index import BM25Index
+from src.managers.history_summarizer import summarize, truncate_bytes
 
 logger = setup_logger('history_manager', 'data/logs/history_manager.log')
 
+_MISSING = object()
+
 class HistoryManager:
     """历史上下文管理器"""
 
+    # 检查其他进程是否修改了历史记录的最短间隔（秒）
+    GENERATION_CHECK_INTERVAL = 1.0
+
+    # 历史记录选取方式：最近 / 与当前任务相关 / 两者结合
+    MODES = ('recent', 'relevant', 'hybrid')
+
+    # 各选取方式的历史上下文引导语
+    CONTEXT_INTROS = {
+        'recent': "以下是最近完成的任务记录，可以帮助你了解之前的工作内容：\n\n",
+        'relevant': "以下是与当前任务相关的历史任务记录，可以帮助你了解之前的工作内容：\n\n",
+        'hybrid': "以下是最近完成以及与当前任务相关的历史任务记录，可以帮助你了解之前的工作内容：\n\n",
+    }
+
+    # 历史记录摘要中任务内容和执行结果的字节预算（UTF-8）
+    TASK_SUMMARY_BYTES = 300
+    RESULT_SUMMARY_BYTES = 900
+
+    # 历史配置和最近记录的缓存以及检索索引，同一进程内的实例按数据库文件共享
+    _caches = {}
+    _indexes = {}
+    _caches_lock = threading.Lock()
+
+    # 后台生成摘要的线程池（进程内共享，首次使用时创建）
+    _summarizer = None
+
     def __init__(self, db_path="data/tasks.db"):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.writer = get_write_queue(db_path)
         self.init_tables()
+        key = str(Path(db_path).resolve())
+        with HistoryManager._caches_lock:
+            self._cache = HistoryManager._caches.setdefault(key, {})
+            self._index_state = HistoryManager._indexes.setdefault(key, {
+                'index': BM25Index(),
+                'records': {},          # 记录 ID -> 记录（按 ID 升序插入）
+                'max_id': 0,
+                'generation': None,
+                'lock': threading.Lock(),
+            })
 
     @contextmanager
     def get_connection(self):
         """获取数据库连接"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
         try:
-            yield conn
-            conn.commit()
+            with self.pool.connection() as conn:
+                yield conn
         except Exception as e:
-            conn.rollback()
             logger.error(f"数据库操作失败: {e}")
             raise
-        finally:
-            conn.close()
 
     def init_tables(self):
-        """初始化历史上下文相关表"""
+        """初始化历史上下文相关表（由数据库迁移统一创建）"""
+        run_migrations(self.pool)
+        logger.info("历史上下文表初始化完成")
+
+    def _invalidate_cache(self):
+        """
+        使本进程的历史上下文缓存失效
+
+        必须在修改提交之后调用：提交前清空的话，其他线程可能读到旧数据并重新写入缓存。
+        通过写入队列执行的修改由外层事务提交，在 Future 完成的回调中调用。
+        """
+        self._cache.clear()
+
+    def _get_generation(self):
+        """读取历史上下文版本号（记录或配置变化时由触发器加一）"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-
-            # 历史上下文配置表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS history_config (
-                    id INTEGER PRIMARY KEY,
-                    enabled INTEGER DEFAULT 0,
-                    max_history_count INTEGER DEFAULT 5,
-                    updated_at TEXT
-                )
-            ''')
-
-            # 历史上下文记录表（存储压缩后的上下文）
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS history_context_records (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    task_id TEXT NOT NULL,
-                    summary TEXT NOT NULL,
-                    created_at TEXT NOT NULL
-                )
-            ''')
-
-            # 创建索引
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_history_created_at
-                ON history_context_records(created_at DESC)
-            ''')
-
-            # 如果配置表为空，插入默认配置
-            cursor.execute('SELECT COUNT(*) FROM history_config')
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('''
-                    INSERT INTO history_config (enabled, max_history_count, updated_at)
-                    VALUES (0, 5, ?)
-                ''', (datetime.now().isoformat(),))
+            row = conn.execute('SELECT generation FROM history_config WHERE id = 1').fetchone()
+            return row[0] if row else 0
+
+    def _current_generation(self):
+        """
+        当前的历史上下文版本号
+
+        本进程内的修改会立即清空缓存并重新读取；其他进程的修改通过版本号发现，
+        每隔 GENERATION_CHECK_INTERVAL 秒最多检查一次。
+        """
+        cache = self._cache
+        now = time.monotonic()
+        if now - cache.get('checked_at', 0) >= self.GENERATION_CHECK_INTERVAL:
+            generation = self._get_generation()
+            if cache.get('generation') != generation:
+                cache.clear()
+                cache['generation'] = generation
+            cache['checked_at'] = now
+        return cache.get('generation')
+
+    def _cached(self, key, build):
+        """读取缓存的值，缓存失效时调用 build 重新生成"""
+        cache = self._cache
+        self._current_generation()
 
-            logger.info("历史上下文表初始化完成")
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            generation = cache.get('generation')
+            value = build()
+            # 生成期间缓存被清空（有新的修改），本次结果不写入缓存
+            if cache.get('generation') == generation and 'checked_at' in cache:
+                cache[key] = value
+        return value
 
     def get_config(self):
         """获取历史上下文配置"""
@@ -84,15 +134,27 @@ class HistoryManager:
                 if row:
                     return {
                         'enabled': bool(row['enabled']),
-                        'max_history_count': row['max_history_count']
+                        'max_history_count': row['max_history_count'],
+                        'mode': row['mode'],
+                        'capacity': row['capacity']
                     }
-                return {'enabled': False, 'max_history_count': 5}
+                return {'enabled': False, 'max_history_count': 5, 'mode': 'recent', 'capacity': 200}
         except Exception as e:
             logger.error(f"获取历史配置失败: {e}")
-            return {'enabled': False, 'max_history_count': 5}
+            return {'enabled': False, 'max_history_count': 5, 'mode': 'recent', 'capacity': 200}
 
-    def update_config(self, enabled=None, max_history_count=None):
-        """更新历史上下文配置"""
+    def update_config(self, enabled=None, max_history_count=None, mode=None, capacity=None):
+        """
+        更新历史上下文配置
+
+        Args:
+            enabled: 是否启用历史上下文
+            max_history_count: 每个任务注入的历史记录条数
+            mode: 选取方式 recent（最近）/ relevant（与任务相关）/ hybrid（两者结合）
+            capacity: 最多保留的历史记录条数
+        """
+        if mode is not None and mode not in self.MODES:
+            raise ValueError(f"不支持的历史选取方式: {mode}")
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
@@ -105,11 +167,21 @@ class HistoryManager:
                 if max_history_count is not None:
                     updates.append('max_history_count = ?')
                     params.append(max_history_count)
+                if mode is not None:
+                    updates.append('mode = ?')
+                    params.append(mode)
+                if capacity is not None:
+                    updates.append('capacity = ?')
+                    params.append(capacity)
 
                 sql = f"UPDATE history_config SET {', '.join(updates)} WHERE id = 1"
                 cursor.execute(sql, params)
-                logger.info(f"历史配置更新成功: enabled={enabled}, max_count={max_history_count}")
-                return True
+            self._invalidate_cache()
+            logger.info(
+                f"历史配置更新成功: enabled={enabled}, max_count={max_history_count}, "
+                f"mode={mode}, capacity={capacity}"
+            )
+            return True
         except Exception as e:
             logger.error(f"更新历史配置失败: {e}")
             raise
@@ -122,7 +194,7 @@ class HistoryManager:
                 cursor.execute('''
                     SELECT id, task_id, summary, created_at
                     FROM history_context_records
-                    ORDER BY created_at DESC
+                    ORDER BY id DESC
                     LIMIT ?
                 ''', (limit,))
                 rows = cursor.fetchall()
@@ -132,56 +204,213 @@ class HistoryManager:
             return []
 
     def add_context_record(self, task_id, task_message, task_result):
-        """添加历史上下文记录（压缩任务信息）"""
+        """
+        添加历史上下文记录（压缩任务信息）
+
+        先按字节预算截断写入，超出预算的内容在后台线程生成抽取式摘要后原地替换，
+        摘要计算不占用执行任务的线程。
+        """
         try:
-            # 压缩任务信息：只保留关键内容
-            summary = f"任务: {task_message[:200]}"
-            if task_result:
-                summary += f"\n结果: {task_result[:300]}"
+            task_message = task_message or ''
+            summary = self._format_summary(
+                truncate_bytes(task_message, self.TASK_SUMMARY_BYTES),
+                truncate_bytes(task_result, self.RESULT_SUMMARY_BYTES) if task_result else None
+            )
 
+            # 超出保留容量的旧记录由插入触发器删除（固定容量的环形缓冲）
             with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
+                cursor = conn.execute('''
                     INSERT INTO history_context_records (task_id, summary, created_at)
                     VALUES (?, ?, ?)
                 ''', (task_id, summary, datetime.now().isoformat()))
+                record_id = cursor.lastrowid
+            self._invalidate_cache()
+            logger.info(f"添加历史上下文记录: {task_id}")
 
-                # 检查是否超过最大记录数，如果超过则删除最旧的
-                config = self.get_config()
-                max_count = config['max_history_count']
-
-                cursor.execute('SELECT COUNT(*) FROM history_context_records')
-                total = cursor.fetchone()[0]
-
-                if total > max_count:
-                    # 删除最旧的记录
-                    cursor.execute('''
-                        DELETE FROM history_context_records
-                        WHERE id IN (
-                            SELECT id FROM history_context_records
-                            ORDER BY created_at ASC
-                            LIMIT ?
-                        )
-                    ''', (total - max_count,))
-
-                logger.info(f"添加历史上下文记录: {task_id}")
-                return True
+            if len(task_message.encode('utf-8')) > self.TASK_SUMMARY_BYTES or \
+                    (task_result and len(task_result.encode('utf-8')) > self.RESULT_SUMMARY_BYTES):
+                self._get_summarizer().submit(self._summarize_record, record_id, task_message, task_result)
+            return True
         except Exception as e:
             logger.error(f"添加历史上下文记录失败: {e}")
             return False
 
-    def build_history_context(self):
-        """构建历史上下文字符串"""
-        config = self.get_config()
+    def add_context_record_async(self, task_id, task_message, task_result):
+        """通过写入队列添加历史上下文记录（与任务状态更新合并提交），返回 Future"""
+        future = self.writer.submit(self.add_context_record, task_id, task_message, task_result)
+        # 写入队列中的修改在外层事务提交后才可见，提交后再清空缓存
+        future.add_done_callback(lambda _: self._invalidate_cache())
+        return future
+
+    @staticmethod
+    def _format_summary(task_message, task_result):
+        """拼接历史记录的摘要文本"""
+        summary = f"任务: {task_message}"
+        if task_result:
+            summary += f"\n结果: {task_result}"
+        return summary
+
+    @classmethod
+    def _get_summarizer(cls):
+        """获取后台摘要线程池（首次使用时创建）"""
+        with cls._caches_lock:
+            if cls._summarizer is None:
+                cls._summarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-summarizer')
+            return cls._summarizer
+
+    def _summarize_record(self, record_id, task_message, task_result):
+        """生成抽取式摘要，并通过写入队列替换记录的摘要（在后台线程执行）"""
+        try:
+            summary = self._format_summary(
+                summarize(task_message, self.TASK_SUMMARY_BYTES),
+                summarize(task_result, self.RESULT_SUMMARY_BYTES) if task_result else None
+            )
+            future = self.writer.submit(self._update_summary, record_id, summary)
+            future.add_done_callback(lambda _: self._invalidate_cache())
+        except Exception as e:
+            logger.error(f"生成历史记录摘要失败: {record_id}, {e}")
+
+    def _update_summary(self, record_id, summary):
+        """
+        替换记录的摘要
+
+        修订号设为更新后的历史版本号（更新触发器随后把版本号加一），
+        其他实例同步检索索引时据此找到需要重新索引的记录。
+        """
+        with self.get_connection() as conn:
+            conn.execute('''
+                UPDATE history_context_records
+                SET summary = ?,
+                    revision = (SELECT generation FROM history_config WHERE id = 1) + 1
+                WHERE id = ?
+            ''', (summary, record_id))
+
+    def get_context_records(self, message=None):
+        """
+        按配置选出要注入的历史记录
+
+        Args:
+            message: 当前任务消息；mode 为 relevant / hybrid 时按与它的相关性选取历史记录
+
+        Returns:
+            tuple: (历史记录列表, 引导语)；未启用时返回 ([], "")
+        """
+        config = self._cached('config', self.get_config)
         if not config['enabled']:
-            return ""
+            return [], ""
+        if config['mode'] == 'recent' or not message:
+            history = self._cached('records', lambda: self.get_recent_history(config['max_history_count']))
+            return history, self.CONTEXT_INTROS['recent']
+        return self.select_history(message, config), self.CONTEXT_INTROS[config['mode']]
+
+    def build_history_context(self, message=None):
+        """
+        构建历史上下文字符串
+
+        Args:
+            message: 当前任务消息；mode 为 relevant / hybrid 时按与它的相关性选取历史记录
+
+        选出的记录由 get_context_records 缓存；渲染结果不缓存，执行器会按 token 预算删减记录后重新渲染。
+        """
+        return self.format_context(*self.get_context_records(message))
 
-        history = self.get_recent_history(config['max_history_count'])
+    def _sync_index(self):
+        """
+        把检索索引同步到最新的版本号
+
+        只读取新增的记录（id 大于已索引的最大 id）和摘要被替换的记录（修订号大于已索引的版本号），
+        并删除已被环形缓冲或清理策略删除的旧记录。
+        """
+        state = self._index_state
+        generation = self._current_generation()
+        if state['generation'] == generation:
+            return
+
+        with state['lock']:
+            if state['generation'] == generation:
+                return
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT MIN(id) FROM history_context_records')
+                min_id = cursor.fetchone()[0]
+                cursor.execute('''
+                    SELECT id, task_id, summary, created_at
+                    FROM history_context_records
+                    WHERE id > ?
+                    ORDER BY id
+                ''', (state['max_id'],))
+                new_rows = [dict(row) for row in cursor.fetchall()]
+                cursor.execute('''
+                    SELECT id, task_id, summary, created_at
+                    FROM history_context_records
+                    WHERE revision > ? AND id <= ?
+                ''', (state['generation'] or 0, state['max_id']))
+                updated_rows = [dict(row) for row in cursor.fetchall()]
+
+            index, records = state['index'], state['records']
+            if min_id is None:
+                index.clear()
+                records.clear()
+                state['max_id'] = 0
+            else:
+                for record_id in [record_id for record_id in records if record_id < min_id]:
+                    index.remove(record_id)
+                    del records[record_id]
+
+            for record in updated_rows:
+                if record['id'] in records:
+                    index.add(record['id'], record['summary'])
+                    records[record['id']] = record
+
+            for record in new_rows:
+                index.add(record['id'], record['summary'])
+                records[record['id']] = record
+                state['max_id'] = record['id']
+            state['generation'] = generation
+
+    def select_history(self, message, config=None):
+        """
+        按配置的选取方式选出要注入的历史记录
+
+        Args:
+            message: 当前任务消息
+            config: 历史上下文配置（默认读取当前配置）
+
+        Returns:
+            list: 历史记录
+        """
+        config = config or self.get_config()
+        limit = config['max_history_count']
+        self._sync_index()
+
+        state = self._index_state
+        with state['lock']:
+            records = state['records']
+            relevant = [records[record_id] for record_id, _ in state['index'].search(message, limit)]
+            if config['mode'] == 'relevant':
+                return relevant
+
+            # hybrid：一半名额给最近的记录，其余给最相关的，不足时用更早的最近记录补齐
+            recent_ids = list(records)[::-1]
+            selected = {record_id: records[record_id] for record_id in recent_ids[:(limit + 1) // 2]}
+            for record in relevant:
+                if len(selected) >= limit:
+                    break
+                selected.setdefault(record['id'], record)
+            for record_id in recent_ids:
+                if len(selected) >= limit:
+                    break
+                selected.setdefault(record_id, records[record_id])
+        return sorted(selected.values(), key=lambda record: record['id'], reverse=True)
+
+    @staticmethod
+    def format_context(history, intro):
+        """渲染历史上下文字符串"""
         if not history:
             return ""
 
         context = "\n## 历史任务上下文\n\n"
-        context += "以下是最近完成的任务记录，可以帮助你了解之前的工作内容：\n\n"
+        context += intro
 
         for i, record in enumerate(history, 1):
             context += f"### 历史任务 {i}\n"
@@ -199,8 +428,9 @@ class HistoryManager:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM history_context_records')
                 affected = cursor.rowcount
-                logger.info(f"清除历史上下文记录成功，共删除 {affected} 条记录")
-                return affected
+            self._invalidate_cache()
+            logger.info(f"清除历史上下文记录成功，共删除 {affected} 条记录")
+            return affected
         except Exception as e:
             logger.error(f"清除历史记录失败: {e}")
             raise
@@ -213,10 +443,13 @@ class HistoryManager:
                 cursor.execute('SELECT COUNT(*) as total FROM history_context_records')
                 total = cursor.fetchone()['total']
 
+                config = self.get_config()
                 return {
                     'total': total,
-                    'max_count': self.get_config()['max_history_count']
+                    'max_count': config['max_history_count'],
+                    'capacity': config['capacity'],
+                    'mode': config['mode']
                 }
         except Exception as e:
             logger.error(f"获取历史统计失败: {e}")
-            return {'total': 0, 'max_count': 5}
+            return {'total': 0, 'max_count': 5, 'capacity': 200, 'mode': 'recent'}
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+历史记录摘要 - 本地抽取式摘要（TextRank）
+
+按中英文标点切分句子，以句子间共有检索词的数量构建相似度图并计算 TextRank 得分，
+在固定字节预算内选取得分最高的句子，按原文顺序拼接。无需下载模型。
+"""
+import re
+import math
+from src.managers.history_index import tokenize
+
+# 中文句末标点（及英文 ! ?）之后、英文句号后的空白处、换行处切分
+_SENTENCE_SPLIT = re.compile(r'(?<=[。！？；…!?])\s*|(?<=\.)\s+|\n+')
+
+# 参与排序的最大句子数（超出时保留末尾的句子，结论通常在最后）
+MAX_SENTENCES = 300
+
+# 与已选句子的检索词重合度（Jaccard）超过该值时视为重复，不再选取
+REDUNDANCY_THRESHOLD = 0.6
+
+
+def split_sentences(text):
+    """
+    把文本切分为句子，忽略不含检索词的片段（如代码块标记、分隔线）
+
+    Examples:
+        >>> split_sentences("已完成。结果如下：共 3 篇论文！\\n---\\nDone. See output.")
+        ['已完成。', '结果如下：共 3 篇论文！', 'Done.', 'See output.']
+    """
+    sentences = []
+    for part in _SENTENCE_SPLIT.split(text or ''):
+        part = part.strip()
+        if part and tokenize(part):
+            sentences.append(part)
+    return sentences
+
+
+def truncate_bytes(text, max_bytes, suffix='…'):
+    """按 UTF-8 字节数截断文本（不截断多字节字符）"""
+    data = text.encode('utf-8')
+    if len(data) <= max_bytes:
+        return text
+    limit = max(max_bytes - len(suffix.encode('utf-8')), 0)
+    return data[:limit].decode('utf-8', errors='ignore') + suffix
+
+
+def rank_sentences(sentences, damping=0.85, iterations=30, tolerance=1e-6):
+    """
+    计算每个句子的 TextRank 得分
+
+    两个句子的相似度为共有检索词数 / (log(词数 a) + log(词数 b))。
+    随机跳转的概率略偏向靠后的句子，使结论性的句子更容易被选中。
+
+    Returns:
+        list: 与 sentences 对应的得分
+    """
+    n = len(sentences)
+    if n <= 1:
+        return [1.0] * n
+
+    terms = [set(tokenize(sentence)) for sentence in sentences]
+    postings = {}
+    for i, sentence_terms in enumerate(terms):
+        for term in sentence_terms:
+            postings.setdefault(term, []).append(i)
+
+    # 只为共有检索词的句子对计算相似度（稀疏图）；出现在半数以上句子中的词区分度低，
+    # 按停用词忽略，避免长文本时句子对数量平方增长
+    max_df = n // 2 if n >= 10 else n
+    overlaps = [dict() for _ in range(n)]
+    for docs in postings.values():
+        if len(docs) > max_df:
+            continue
+        for a in range(len(docs)):
+            for b in range(a + 1, len(docs)):
+                i, j = docs[a], docs[b]
+                overlaps[i][j] = overlaps[i].get(j, 0) + 1
+
+    weights = [dict() for _ in range(n)]
+    for i in range(n):
+        for j, common in overlaps[i].items():
+            weight = common / (math.log(len(terms[i]) + 1) + math.log(len(terms[j]) + 1))
+            weights[i][j] = weight
+            weights[j][i] = weight
+    out_sums = [sum(edges.values()) for edges in weights]
+
+    prior = [1 + i / n for i in range(n)]
+    prior_sum = sum(prior)
+    prior = [p / prior_sum for p in prior]
+
+    scores = list(prior)
+    for _ in range(iterations):
+        new_scores = [(1 - damping) * prior[i] for i in range(n)]
+        dangling = sum(scores[i] for i in range(n) if not out_sums[i])
+        for i in range(n):
+            if out_sums[i]:
+                share = damping * scores[i] / out_sums[i]
+                for j, weight in weights[i].items():
+                    new_scores[j] += share * weight
+        for i in range(n):
+            new_scores[i] += damping * dangling * prior[i]
+        delta = sum(abs(new - old) for new, old in zip(new_scores, scores))
+        scores = new_scores
+        if delta < tolerance:
+            break
+    return scores
+
+
+def summarize(text, max_bytes):
+    """
+    生成不超过 max_bytes 字节（UTF-8）的抽取式摘要
+
+    Args:
+        text: 原文
+        max_bytes: 摘要的字节预算
+
+    Returns:
+        str: 摘要（原文不超过预算时原样返回）
+    """
+    text = (text or '').strip()
+    if len(text.encode('utf-8')) <= max_bytes:
+        return text
+
+    # 重复的句子（如反复输出的进度提示）只保留最后一次出现
+    sentences = list(reversed(dict.fromkeys(reversed(split_sentences(text)))))[-MAX_SENTENCES:]
+    if not sentences:
+        return truncate_bytes(text, max_bytes)
+
+    scores = rank_sentences(sentences)
+    ranked = sorted(range(len(sentences)), key=lambda i: (-scores[i], -i))
+    terms = [set(tokenize(sentence)) for sentence in sentences]
+
+    selected = []
+    remaining = max_bytes
+    for i in ranked:
+        size = len(sentences[i].encode('utf-8')) + (1 if selected else 0)
+        if size > remaining:
+            continue
+        if any(len(terms[i] & terms[j]) > REDUNDANCY_THRESHOLD * len(terms[i] | terms[j]) for j in selected):
+            continue
+        selected.append(i)
+        remaining -= size
+    if not selected:
+        return truncate_bytes(sentences[ranked[0]], max_bytes)
+    return ' '.join(sentences[i] for i in sorted(selected))
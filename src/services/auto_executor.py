@@ -3,13 +3,18 @@
 自动任务执行器 - 自动巡航功能
 基于队列的异步执行，支持并发控制
 """
+import os
+import sys
 import time
 import json
 import threading
 import queue
 from pathlib import Path
+from datetime import datetime, timedelta
 from src.core.database import Database
+from src.core.task_store import TaskStore
 from src.claude.executor import ClaudeExecutor
+from src.services.db_maintenance import DatabaseMaintenance
 from src.core.config import Config
 from src.core.logger import setup_logger
 
@@ -44,7 +49,7 @@ class TaskWorker(threading.Thread):
 
                 # 执行任务（同步执行，确保完成）
                 try:
-                    result = self.executor.execute_task(task_id)
+                    result = self.executor.execute_task(task_id, claimed=True)
                     if result['success']:
                         logger.info(f"工作线程 {self.worker_id} 任务执行成功: {task_id}")
                     else:
@@ -70,16 +75,36 @@ class AutoExecutor:
 
     CONFIG_FILE = "data/auto_executor_config.json"
 
-    def __init__(self):
-        self.db = Database()
+    # 领取任务时的执行者标识前缀（后接进程 ID）
+    WORKER_PREFIX = "auto_executor:"
+
+    # 处理中任务的心跳超过该秒数未刷新时，视为执行者已退出（执行中的任务每 10 秒刷新一次心跳）
+    STALE_CLAIM_SECONDS = 300
+
+    def __init__(self, store: TaskStore = None):
+        """
+        初始化自动任务执行器
+
+        Args:
+            store: 任务存储，默认使用 SQLite 数据库
+        """
+        self.db = store or Database()
         self.executor = ClaudeExecutor(
             db=self.db,
             claude_cli_path=Config.CLAUDE_CLI_PATH,
             workspace_dir=Config.CLAUDE_WORKSPACE_DIR,
-            timeout=Config.CLAUDE_TIMEOUT
+            timeout=Config.CLAUDE_TIMEOUT,
+            prompt_token_budget=Config.PROMPT_TOKEN_BUDGET,
+            warm_pool_size=Config.CLAUDE_WARM_POOL_SIZE,
+            warm_pool_max_age=Config.CLAUDE_WARM_POOL_MAX_AGE,
+            warm_pool_max_tasks=Config.CLAUDE_WARM_POOL_MAX_TASKS,
+            warm_pool_health_interval=Config.CLAUDE_WARM_POOL_HEALTH_INTERVAL
         )
         self.config = self.load_config()
         self.next_check_time = None  # 下次检查时间
+        self.worker_id = f"{self.WORKER_PREFIX}{os.getpid()}"  # 领取任务时的执行者标识
+        # 数据库维护只适用于 SQLite 存储
+        self.maintenance = DatabaseMaintenance(self.db) if isinstance(self.db, Database) else None
 
         # 任务队列
         self.task_queue = queue.Queue()
@@ -145,32 +170,13 @@ class AutoExecutor:
         """检查是否启用"""
         return self.config.get("enabled", False)
 
-    def get_pending_tasks(self):
-        """获取待处理的任务（按优先级排序）"""
-        try:
-            # 获取所有待处理任务
-            pending_tasks = self.db.list_tasks(status='待处理', limit=100)
-
-            # 按优先级排序
-            priority_map = {p: i for i, p in enumerate(self.config["priority_order"])}
-            pending_tasks.sort(key=lambda t: (
-                priority_map.get(t.get('priority', 'normal'), 999),
-                t.get('created_at', '')
-            ))
-
-            return pending_tasks
-        except Exception as e:
-            logger.error(f"获取待处理任务失败: {e}")
-            return []
+    def get_pending_count(self):
+        """获取待处理的任务数量"""
+        return self.db.get_stats().get('待处理', 0)
 
     def get_processing_count(self):
         """获取正在处理的任务数量"""
-        try:
-            processing_tasks = self.db.list_tasks(status='处理中', limit=100)
-            return len(processing_tasks)
-        except Exception as e:
-            logger.error(f"获取处理中任务数量失败: {e}")
-            return 0
+        return self.db.get_stats().get('处理中', 0)
 
     def get_queue_size(self):
         """获取队列中等待的任务数量"""
@@ -217,31 +223,68 @@ class AutoExecutor:
             logger.error(f"添加任务到队列失败: {e}")
             return False
 
+    def recover_stale_claims(self):
+        """
+        把执行者已退出的处理中任务重置为待处理
+
+        任务在加入队列时就已领取，执行器进程崩溃或重启后这些任务会一直停留在处理中，
+        占用并发名额。领取者是本机已退出的自动执行器进程、或心跳超过 STALE_CLAIM_SECONDS
+        秒未刷新的任务会被释放。
+
+        Returns:
+            int: 释放的任务数
+        """
+        try:
+            stale_before = (datetime.now() - timedelta(seconds=self.STALE_CLAIM_SECONDS)).isoformat()
+            released = self.db.release_stale_claims(stale_before, self._is_worker_alive)
+            if released:
+                logger.warning(f"已释放 {len(released)} 个执行者已退出的任务: {released}")
+            return len(released)
+        except Exception as e:
+            logger.error(f"释放过期任务领取失败: {e}")
+            return 0
+
+    @classmethod
+    def _is_worker_alive(cls, worker_id):
+        """领取者是否仍在运行（只能判断本机的自动执行器进程，其余情况视为存活，由心跳超时判断）"""
+        if not worker_id or not worker_id.startswith(cls.WORKER_PREFIX) or sys.platform == 'win32':
+            return True
+        try:
+            pid = int(worker_id[len(cls.WORKER_PREFIX):])
+        except ValueError:
+            return True
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
     def check_and_queue_tasks(self):
         """检查并将待处理任务加入队列"""
         try:
-            # 获取待处理任务
-            pending_tasks = self.get_pending_tasks()
-            if not pending_tasks:
-                logger.debug("没有待处理的任务")
-                return 0
-
-            # 获取当前队列大小和处理中的任务数
-            queue_size = self.get_queue_size()
+            # 获取处理中的任务数（队列中的任务在领取时已标记为处理中）
             processing_count = self.get_processing_count()
             max_concurrent = self.config.get("max_concurrent", 1)
 
             # 计算可以加入队列的任务数
-            # 队列中的任务 + 正在处理的任务 不应超过最大并发数
-            available_slots = max_concurrent - (queue_size + processing_count)
+            available_slots = max_concurrent - processing_count
 
             if available_slots <= 0:
-                logger.debug(f"队列已满或达到并发限制 (队列: {queue_size}, 处理中: {processing_count}, 最大: {max_concurrent})")
+                logger.debug(f"队列已满或达到并发限制 (队列: {self.get_queue_size()}, 处理中: {processing_count}, 最大: {max_concurrent})")
                 return 0
 
-            # 将任务加入队列
+            # 逐个原子领取任务并加入队列
             added_count = 0
-            for task in pending_tasks[:available_slots]:
+            for _ in range(available_slots):
+                task = self.db.claim_next_task(self.worker_id, self.config.get("priority_order"))
+                if not task:
+                    logger.debug("没有待处理的任务")
+                    break
+
                 task_id = task['id']
                 if self.add_task_to_queue(task_id):
                     added_count += 1
@@ -264,6 +307,9 @@ class AutoExecutor:
                     # 重新加载配置（支持动态更新）
                     self.config = self.load_config()
 
+                    # 释放崩溃或已退出的执行器遗留的任务（启动时和每轮检查时执行）
+                    self.recover_stale_claims()
+
                     if self.is_enabled():
                         logger.info("检查待处理任务...")
                         added = self.check_and_queue_tasks()
@@ -274,6 +320,10 @@ class AutoExecutor:
                     else:
                         logger.info("自动巡航已禁用，等待中...")
 
+                    # 数据库维护（归档迁移、optimize、增量 VACUUM）
+                    if self.maintenance:
+                        self.maintenance.run_if_due()
+
                     # 等待指定间隔
                     interval = self.config.get("interval", 60)
 
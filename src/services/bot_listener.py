@@ -9,9 +9,9 @@ from src.core.logger import setup_logger
 
 logger = setup_logger('bot_listener', 'data/logs/bot_listener.log')
 
-def main():
-    """主循环"""
-    db = Database()
+def main(store=None):
+    """主循环（store 为任务存储，默认使用 SQLite 数据库）"""
+    db = store or Database()
     telegram = TelegramClient()
     offset = None
 
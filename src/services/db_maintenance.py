@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+数据库维护调度器
+定期将已归档任务移入冷库、按保留策略清理过期数据，并在线执行 PRAGMA optimize 和增量 VACUUM
+"""
+import time
+from src.core.database import Database
+from src.services.retention import RetentionPolicy
+from src.core.logger import setup_logger
+
+logger = setup_logger('db_maintenance', 'data/logs/db_maintenance.log')
+
+
+class DatabaseMaintenance:
+    """数据库维护调度器"""
+
+    # 各维护任务的执行间隔（秒）
+    INTERVALS = {
+        'archive': 600,
+        'retention': 3600,
+        'optimize': 3600,
+        'vacuum': 3600,
+    }
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.retention = RetentionPolicy(db)
+        self.last_run = {}
+
+    def run_if_due(self):
+        """执行已到期的维护任务（适合在服务主循环中调用）"""
+        now = time.time()
+        for job, interval in self.INTERVALS.items():
+            if now - self.last_run.get(job, 0) >= interval:
+                self._run_job(job)
+                self.last_run[job] = time.time()
+
+    def run_all(self):
+        """
+        立即执行全部维护任务
+
+        Returns:
+            dict: 各维护任务的执行结果
+        """
+        results = {}
+        for job in self.INTERVALS:
+            results[job] = self._run_job(job)
+            self.last_run[job] = time.time()
+        return results
+
+    def _run_job(self, job):
+        """执行单个维护任务，异常不影响调用方"""
+        try:
+            if job == 'archive':
+                # 每轮最多移动 20 批，剩余的留到下一轮
+                return self.db.move_archived_tasks(max_chunks=20)
+            elif job == 'retention':
+                return self.retention.run()
+            elif job == 'optimize':
+                return self.db.optimize()
+            elif job == 'vacuum':
+                return self.db.vacuum()
+        except Exception as e:
+            logger.error(f"数据库维护任务 {job} 执行失败: {e}")
+        return None
@@ -9,9 +9,9 @@ from src.core.logger import setup_logger
 
 logger = setup_logger('result_notifier', 'data/logs/result_notifier.log')
 
-def notify_completed_tasks():
-    """通知已完成的任务"""
-    db = Database()
+def notify_completed_tasks(store=None):
+    """通知已完成的任务（store 为任务存储，默认使用 SQLite 数据库）"""
+    db = store or Database()
     telegram = TelegramClient()
     tasks = db.list_tasks(status='已完成', limit=50)
 
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+数据保留策略
+按状态删除过期任务，清理过期的历史上下文记录、任务事件和日志文件，并回收数据库空间
+"""
+import json
+import time
+import shutil
+from pathlib import Path
+from datetime import datetime, timedelta
+from src.core.database import Database
+from src.core.logger import setup_logger
+
+logger = setup_logger('retention', 'data/logs/db_maintenance.log')
+
+
+class RetentionPolicy:
+    """数据保留策略"""
+
+    CONFIG_FILE = "data/retention_config.json"
+    LOG_DIR = "data/logs"
+
+    # 默认配置（天数为 None 或缺省表示永久保留）
+    # 默认不删除任何任务、历史记录和事件，需要在配置文件中显式设置保留天数，如
+    # {"task_days": {"已归档": 90, "失败": 30}, "history_days": 90, "event_days": 30}
+    DEFAULT_CONFIG = {
+        "enabled": True,
+        "task_days": {},        # 各状态任务的保留天数
+        "history_days": None,   # 历史上下文记录保留天数
+        "event_days": None,     # 任务事件保留天数
+        "log_days": 14,         # 轮转后的日志文件保留天数
+        "log_max_bytes": 10 * 1024 * 1024,  # 日志文件超过该大小时轮转
+        "chunk_size": 500,      # 每个事务删除的行数
+        "pause": 0.05,          # 批次之间的休眠秒数
+    }
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.config = self.load_config()
+
+    def load_config(self):
+        """加载配置（缺省项使用默认值）"""
+        config = dict(self.DEFAULT_CONFIG)
+        try:
+            if Path(self.CONFIG_FILE).exists():
+                with open(self.CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    config.update(json.load(f))
+        except Exception as e:
+            logger.error(f"加载保留策略配置失败: {e}")
+        return config
+
+    @staticmethod
+    def _cutoff(days):
+        """保留天数对应的截止时间（ISO 字符串）"""
+        return (datetime.now() - timedelta(days=days)).isoformat()
+
+    def run(self):
+        """
+        执行保留策略
+
+        Returns:
+            dict: {"rows": {类别: 删除行数}, "db_bytes": 数据库回收字节数, "log_bytes": 日志回收字节数}
+        """
+        self.config = self.load_config()
+        report = {"rows": {}, "db_bytes": 0, "log_bytes": 0}
+        if not self.config.get("enabled"):
+            return report
+
+        chunk_size = self.config["chunk_size"]
+        pause = self.config["pause"]
+        size_before = self.db.database_size()
+
+        for status, days in (self.config.get("task_days") or {}).items():
+            if days is None:
+                continue
+            purged = self.db.purge_tasks(status, self._cutoff(days), chunk_size=chunk_size, pause=pause)
+            if purged:
+                report["rows"][f"tasks:{status}"] = purged
+
+        tables = [
+            ("history_context_records", "id", self.config.get("history_days")),
+            ("task_events", "event_id", self.config.get("event_days")),
+        ]
+        for table, key, days in tables:
+            if days is None:
+                continue
+            purged = self._purge_table(table, key, self._cutoff(days), chunk_size, pause)
+            if purged:
+                report["rows"][table] = purged
+
+        if report["rows"]:
+            for schema in ('main', 'archive'):
+                # 删除产生的空闲页全部回收（增量模式下每次只持有写锁很短时间）
+                while self.db.vacuum(schema=schema):
+                    time.sleep(pause)
+            report["db_bytes"] = max(size_before - self.db.database_size(), 0)
+
+        report["log_bytes"] = self._rotate_logs()
+
+        logger.info(
+            f"保留策略执行完成: 删除 {report['rows']}，"
+            f"数据库回收 {report['db_bytes']} 字节，日志回收 {report['log_bytes']} 字节"
+        )
+        return report
+
+    def _purge_table(self, table, key, before, chunk_size, pause):
+        """按 created_at 分批删除过期行，每批一个短事务"""
+        purged = 0
+        while True:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    DELETE FROM {table} WHERE {key} IN (
+                        SELECT {key} FROM {table} WHERE created_at < ? ORDER BY {key} LIMIT ?
+                    )
+                ''', (before, chunk_size))
+                deleted = cursor.rowcount
+            purged += deleted
+            if deleted < chunk_size:
+                break
+            time.sleep(pause)
+        return purged
+
+    def _rotate_logs(self):
+        """
+        轮转超过大小上限的日志并删除过期的轮转文件
+
+        日志处理器以追加模式打开文件，复制后原地截断不影响正在写日志的进程。
+
+        Returns:
+            int: 回收的字节数
+        """
+        log_dir = Path(self.LOG_DIR)
+        if not log_dir.exists():
+            return 0
+
+        reclaimed = 0
+        max_bytes = self.config.get("log_max_bytes")
+        if max_bytes:
+            for path in log_dir.glob('*.log'):
+                try:
+                    if path.stat().st_size > max_bytes:
+                        rotated = path.with_name(f"{path.name}.{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+                        shutil.copyfile(path, rotated)
+                        with open(path, 'r+b') as f:
+                            f.truncate(0)
+                        logger.info(f"日志已轮转: {path} -> {rotated}")
+                except OSError as e:
+                    logger.error(f"轮转日志失败: {path}, {e}")
+
+        days = self.config.get("log_days")
+        if days is not None:
+            cutoff = time.time() - days * 86400
+            for path in log_dir.glob('*.log.*'):
+                try:
+                    stat = path.stat()
+                    if stat.st_mtime < cutoff:
+                        path.unlink()
+                        reclaimed += stat.st_size
+                except OSError as e:
+                    logger.error(f"删除过期日志失败: {path}, {e}")
+        return reclaimed
@@ -2,11 +2,12 @@
 """
 Telegram 配置管理模块
 """
-import sqlite3
 import os
 from datetime import datetime
 from contextlib import contextmanager
 from src.core.logger import setup_logger
+from src.core.db_pool import get_pool
+from src.core.migrations import run_migrations
 
 logger = setup_logger('telegram_config_manager', 'data/logs/telegram_config_manager.log')
 
@@ -15,47 +16,24 @@ class TelegramConfigManager:
 
     def __init__(self, db_path="data/tasks.db", env_path=".env"):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
         self.env_path = env_path
         self.init_tables()
 
     @contextmanager
     def get_connection(self):
         """获取数据库连接"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
         try:
-            yield conn
-            conn.commit()
+            with self.pool.connection() as conn:
+                yield conn
         except Exception as e:
-            conn.rollback()
             logger.error(f"数据库操作失败: {e}")
             raise
-        finally:
-            conn.close()
 
     def init_tables(self):
-        """初始化 Telegram 配置表"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS telegram_config (
-                    id INTEGER PRIMARY KEY,
-                    enabled INTEGER DEFAULT 0,
-                    bot_token TEXT,
-                    chat_id TEXT,
-                    updated_at TEXT
-                )
-            ''')
-
-            # 插入默认配置
-            cursor.execute('SELECT COUNT(*) FROM telegram_config')
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('''
-                    INSERT INTO telegram_config (enabled, updated_at)
-                    VALUES (0, ?)
-                ''', (datetime.now().isoformat(),))
-
-            logger.info("Telegram 配置表初始化完成")
+        """初始化 Telegram 配置表（由数据库迁移统一创建）"""
+        run_migrations(self.pool)
+        logger.info("Telegram 配置表初始化完成")
 
     def get_config(self):
         """获取 Telegram 配置"""
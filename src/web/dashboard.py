@@ -2,7 +2,7 @@
 """
 OpenClaw-Lite Web 管理界面 - 使用数据库版本
 """
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
 from src.core.database import Database
 from src.core.config import Config
 from src.core.logger import setup_logger
@@ -10,9 +10,9 @@ from src.claude.executor import ClaudeExecutor
 from src.services.auto_executor import AutoExecutor
 from src.managers.mcp_manager import MCPManager
 from src.claude.cc_switch import CCSwitchManager
-from src.managers.history_manager import HistoryManager
 from src.telegram.config_manager import TelegramConfigManager
 import threading
+import json
 import sys
 
 logger = setup_logger('web_dashboard', 'data/logs/web_dashboard.log')
@@ -24,19 +24,48 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 app = Flask(__name__,
             template_folder=os.path.join(current_dir, 'templates'),
             static_folder=os.path.join(current_dir, 'static'))
-db = Database()
-claude_executor = ClaudeExecutor(
-    db=db,
-    claude_cli_path=Config.CLAUDE_CLI_PATH,
-    workspace_dir=Config.CLAUDE_WORKSPACE_DIR,
-    timeout=Config.CLAUDE_TIMEOUT
-)
-auto_executor = AutoExecutor()
+# 使用任务存储的服务由 create_app 创建，共享同一个存储
+db = None
+claude_executor = None
+auto_executor = None
+history_manager = None
 mcp_manager = MCPManager()
 cc_switch_manager = CCSwitchManager()
-history_manager = HistoryManager()
 telegram_config_manager = TelegramConfigManager()
 
+
+def create_app(store=None):
+    """
+    创建 Web 管理界面，执行器、自动巡航和历史上下文都使用传入的任务存储
+
+    路由注册在模块级的 app 上，一个进程只有一个管理界面；再次调用时停止原自动巡航的工作线程并替换各服务。
+
+    Args:
+        store: 任务存储（默认使用 SQLite 数据库），如测试时传入 MemoryTaskStore
+
+    Returns:
+        Flask: 应用实例
+    """
+    global db, claude_executor, auto_executor, history_manager
+    if auto_executor is not None:
+        auto_executor._stop_workers()
+
+    db = store or Database()
+    claude_executor = ClaudeExecutor(
+        db=db,
+        claude_cli_path=Config.CLAUDE_CLI_PATH,
+        workspace_dir=Config.CLAUDE_WORKSPACE_DIR,
+        timeout=Config.CLAUDE_TIMEOUT,
+        prompt_token_budget=Config.PROMPT_TOKEN_BUDGET,
+        warm_pool_size=Config.CLAUDE_WARM_POOL_SIZE,
+        warm_pool_max_age=Config.CLAUDE_WARM_POOL_MAX_AGE,
+        warm_pool_max_tasks=Config.CLAUDE_WARM_POOL_MAX_TASKS,
+        warm_pool_health_interval=Config.CLAUDE_WARM_POOL_HEALTH_INTERVAL
+    )
+    auto_executor = AutoExecutor(store=db)
+    history_manager = claude_executor.history_manager
+    return app
+
 @app.route('/')
 def index():
     """主页"""
@@ -44,13 +73,85 @@ def index():
 
 @app.route('/api/tasks')
 def get_tasks():
-    """获取任务列表"""
+    """
+    获取任务列表
+
+    带 after 参数时使用游标分页（首页传空值），返回 {"tasks": [...], "next_cursor": ...}；
+    否则沿用 limit/offset 分页，直接返回任务数组。
+    """
     status = request.args.get('status')
     limit = int(request.args.get('limit', 100))
+    if 'after' in request.args:
+        try:
+            page = db.list_tasks_page(status, limit, request.args.get('after') or None)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(page)
+
     offset = int(request.args.get('offset', 0))
     tasks = db.list_tasks(status, limit, offset)
     return jsonify(tasks)
 
+@app.route('/api/tasks/search')
+def search_tasks():
+    """
+    全文检索任务（包含已归档任务）
+
+    检索完整的消息和结果，每个关键词至少 2 个字符；两个字符的关键词中文按双字词、
+    英文等按单词匹配。
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "缺少必需参数: q"}), 400
+
+    if not getattr(db, 'search_enabled', False):
+        return jsonify({"error": "当前任务存储不支持全文检索"}), 501
+
+    status = request.args.get('status')
+    limit = int(request.args.get('limit', 20))
+    try:
+        result = db.search_tasks(query, status, limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+@app.route('/api/tasks/changes')
+def get_task_changes():
+    """
+    获取任务变化（增量）
+
+    Query Parameters:
+        since: 上次返回的 last_event_id；不传时只返回当前最新的事件 ID
+        limit: 最多返回的事件数（默认 500）
+
+    Returns:
+        {"events": [...], "tasks": [...], "last_event_id": int, "has_more": bool}
+        tasks 为发生变化且仍存在的任务的当前状态
+    """
+    since = request.args.get('since')
+    if since is None or since == '':
+        return jsonify({"events": [], "tasks": [], "last_event_id": db.latest_event_id(), "has_more": False})
+
+    try:
+        since = int(since)
+        limit = min(int(request.args.get('limit', 500)), 1000)
+    except ValueError:
+        return jsonify({"error": "参数 since 和 limit 必须是整数"}), 400
+
+    events = db.events_since(since, limit)
+    tasks = []
+    for task_id in dict.fromkeys(event['task_id'] for event in events):
+        task = db.get_task(task_id, full_output=False)
+        if task:
+            tasks.append(task)
+
+    return jsonify({
+        "events": events,
+        "tasks": tasks,
+        "last_event_id": events[-1]['event_id'] if events else since,
+        "has_more": len(events) == limit
+    })
+
 @app.route('/api/tasks/<task_id>')
 def get_task(task_id):
     """获取任务详情"""
@@ -84,12 +185,47 @@ def create_task():
         logger.error(f"创建任务失败: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/tasks/batch', methods=['POST'])
+def create_tasks_batch():
+    """
+    批量创建任务
+
+    请求体为 JSON 数组（或 {"tasks": [...]}），或 Content-Type 为 application/x-ndjson 的
+    每行一个 JSON 对象。
+    """
+    try:
+        if 'ndjson' in (request.content_type or ''):
+            tasks = []
+            for line_no, line in enumerate(request.stream, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    tasks.append(json.loads(line))
+                except json.JSONDecodeError:
+                    return jsonify({"error": f"第 {line_no} 行不是有效的 JSON"}), 400
+        else:
+            data = request.get_json(silent=True)
+            tasks = data.get('tasks') if isinstance(data, dict) else data
+
+        if not isinstance(tasks, list) or not tasks:
+            return jsonify({"error": "缺少任务列表"}), 400
+
+        task_ids = db.create_tasks_batch(tasks, user_id='web_user')
+        logger.info(f"批量创建任务成功: {len(task_ids)} 个")
+        return jsonify({"success": True, "count": len(task_ids), "task_ids": task_ids}), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"批量创建任务失败: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/tasks/<task_id>', methods=['PUT'])
 def update_task(task_id):
     """更新任务"""
     try:
         # 检查任务是否存在
-        task = db.get_task(task_id)
+        task = db.get_task(task_id, full_output=False)
         if not task:
             return jsonify({"error": "任务不存在"}), 404
 
@@ -114,7 +250,7 @@ def delete_task(task_id):
     """删除任务"""
     try:
         # 检查任务是否存在
-        task = db.get_task(task_id)
+        task = db.get_task(task_id, full_output=False)
         if not task:
             return jsonify({"error": "任务不存在"}), 404
 
@@ -135,12 +271,12 @@ def execute_task(task_id):
     """执行任务（异步）"""
     try:
         # 检查任务是否存在
-        task = db.get_task(task_id)
+        task = db.get_task(task_id, full_output=False)
         if not task:
             return jsonify({"error": "任务不存在"}), 404
 
-        # 检查任务状态
-        if task['status'] == '处理中':
+        # 原子地领取任务，避免与自动执行器或重复请求同时执行
+        if not db.claim_task(task_id, 'web'):
             return jsonify({"error": "任务正在执行中"}), 400
 
         # 获取工作目录（可选）
@@ -150,7 +286,7 @@ def execute_task(task_id):
         # 在后台线程中异步执行任务
         def execute_in_background():
             try:
-                result = claude_executor.execute_task(task_id, workspace_dir)
+                result = claude_executor.execute_task(task_id, workspace_dir, claimed=True)
                 logger.info(f"任务执行完成: {task_id}, 成功: {result['success']}")
             except Exception as e:
                 logger.error(f"后台执行任务失败: {task_id}, 错误: {e}")
@@ -172,7 +308,7 @@ def archive_task(task_id):
     """归档任务"""
     try:
         # 检查任务是否存在
-        task = db.get_task(task_id)
+        task = db.get_task(task_id, full_output=False)
         if not task:
             return jsonify({"error": "任务不存在"}), 404
 
@@ -190,9 +326,15 @@ def archive_task(task_id):
 
 @app.route('/api/tasks/<task_id>/progress')
 def get_task_progress(task_id):
-    """获取任务执行进度（用于轮询）"""
+    """
+    获取任务执行进度（用于轮询）
+
+    Query Parameters:
+        since: 只返回行号大于 since 的输出行（增量获取，下次请求使用返回的 next_line）
+    """
     try:
-        progress = ClaudeExecutor.get_task_progress(task_id)
+        since = request.args.get('since', type=int)
+        progress = ClaudeExecutor.get_task_progress(task_id, since=since)
         if progress is None:
             return jsonify({"error": "任务进度不存在"}), 404
         return jsonify(progress)
@@ -200,6 +342,64 @@ def get_task_progress(task_id):
         logger.error(f"获取任务进度失败: {e}")
         return jsonify({"error": str(e)}), 500
 
+# SSE 保活间隔（秒）和等待任务进度出现的最长时间（秒）
+PROGRESS_STREAM_KEEPALIVE = 15
+PROGRESS_STREAM_MISSING_TIMEOUT = 60
+
+@app.route('/api/tasks/<task_id>/stream')
+def stream_task_progress(task_id):
+    """
+    以 Server-Sent Events 推送任务的新输出行
+
+    每行输出是一个事件，事件 ID 为行号；断线重连时浏览器通过 Last-Event-ID 请求头
+    （或 since 参数）从上次收到的行之后继续推送。任务结束时发送 done 事件，
+    部分行已被丢弃时发送 truncated 事件，任务被重新执行时发送 reset 事件，
+    任务进度不存在时发送 missing 事件。
+    """
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+
+    def generate():
+        cursor = since
+        waited = 0
+        yield 'retry: 3000\n\n'
+        while True:
+            progress = ClaudeExecutor.wait_task_progress(task_id, cursor, PROGRESS_STREAM_KEEPALIVE)
+            if progress is None:
+                # 任务可能尚未开始执行，等待一段时间后放弃
+                waited += PROGRESS_STREAM_KEEPALIVE
+                if waited >= PROGRESS_STREAM_MISSING_TIMEOUT:
+                    yield 'event: missing\ndata: {}\n\n'
+                    return
+                yield ': keepalive\n\n'
+                continue
+            waited = 0
+
+            if progress['reset']:
+                yield 'event: reset\ndata: {}\n\n'
+            elif progress['truncated']:
+                yield f"event: truncated\ndata: {json.dumps({'dropped_lines': progress['dropped_lines']})}\n\n"
+
+            line_no = progress['next_line'] - len(progress['lines'])
+            for line in progress['lines']:
+                line_no += 1
+                yield f"id: {line_no}\ndata: {json.dumps(line, ensure_ascii=False)}\n\n"
+            cursor = progress['next_line']
+
+            if progress['completed']:
+                done = {'status': progress['status'], 'total_lines': progress['total_lines']}
+                yield f"event: done\ndata: {json.dumps(done, ensure_ascii=False)}\n\n"
+                return
+            if not progress['lines']:
+                yield ': keepalive\n\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/tasks/<task_id>/progress', methods=['DELETE'])
 def clear_task_progress(task_id):
     """清除任务进度缓存"""
@@ -210,6 +410,24 @@ def clear_task_progress(task_id):
         logger.error(f"清除任务进度失败: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/progress/stats')
+def get_progress_stats():
+    """获取任务进度缓存的内存占用统计"""
+    try:
+        return jsonify(ClaudeExecutor.get_progress_stats())
+    except Exception as e:
+        logger.error(f"获取进度缓存统计失败: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/claude/warm-pool')
+def get_warm_pool_stats():
+    """获取 Claude CLI 预热进程池统计"""
+    try:
+        return jsonify(claude_executor.get_warm_pool_stats())
+    except Exception as e:
+        logger.error(f"获取预热进程池统计失败: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/auto-executor/config')
 def get_auto_executor_config():
     """获取自动巡航配置"""
@@ -272,7 +490,7 @@ def get_auto_executor_status():
     """获取自动巡航状态"""
     try:
         config = auto_executor.get_config()
-        pending_tasks = auto_executor.get_pending_tasks()
+        pending_count = auto_executor.get_pending_count()
         processing_count = auto_executor.get_processing_count()
         queue_size = auto_executor.get_queue_size()
         next_check_time = auto_executor.get_next_check_time()
@@ -288,7 +506,7 @@ def get_auto_executor_status():
             "enabled": config.get('enabled', False),
             "interval": config.get('interval', 60),
             "max_concurrent": config.get('max_concurrent', 1),
-            "pending_count": len(pending_tasks),
+            "pending_count": pending_count,
             "processing_count": processing_count,
             "queue_size": queue_size,
             "worker_count": len(auto_executor.workers),
@@ -481,6 +699,9 @@ def switch_cc_switch(name):
     try:
         result = cc_switch_manager.switch_profile(name)
         if result['success']:
+            # 预热的 CLI 进程仍使用旧配置，立即用新配置重新预热
+            if claude_executor.warm_pool:
+                claude_executor.warm_pool.recycle()
             return jsonify(result)
         else:
             return jsonify(result), 400
@@ -508,12 +729,16 @@ def update_history_config():
 
         enabled = data.get('enabled')
         max_history_count = data.get('max_history_count')
+        mode = data.get('mode')
+        capacity = data.get('capacity')
 
-        history_manager.update_config(enabled, max_history_count)
+        history_manager.update_config(enabled, max_history_count, mode, capacity)
         config = history_manager.get_config()
         logger.info(f"历史配置已更新: {config}")
 
         return jsonify({"success": True, "config": config})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"更新历史配置失败: {e}")
         return jsonify({"error": str(e)}), 500
@@ -638,4 +863,4 @@ def check_cc_health():
 if __name__ == '__main__':
     logger.info("Web 管理界面启动中...")
     logger.info(f"访问地址: http://{Config.WEB_HOST}:{Config.WEB_PORT}")
-    app.run(debug=Config.WEB_DEBUG, host=Config.WEB_HOST, port=Config.WEB_PORT)
+    create_app().run(debug=Config.WEB_DEBUG, host=Config.WEB_HOST, port=Config.WEB_PORT)
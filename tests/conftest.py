@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共夹具
+
+在项目根目录执行: python -m pytest -q tests
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.core.database import Database
+from src.core.memory_store import MemoryTaskStore
+
+
+# test_claude_stdin.py 是调用真实 Claude CLI 的手动脚本，不作为单元测试收集
+collect_ignore = ['test_claude_stdin.py']
+
+
+@pytest.fixture
+def db(tmp_path):
+    """临时目录下的 SQLite 任务存储（主库和冷库都是新文件）"""
+    return Database(str(tmp_path / 'tasks.db'))
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def store(request, tmp_path):
+    """任务存储接口的各个实现，同一组契约测试分别在两者上运行"""
+    if request.param == 'sqlite':
+        return Database(str(tmp_path / 'tasks.db'))
+    return MemoryTaskStore()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+并发领取测试 - 多个执行器同时领取时每个任务只会被领取一次
+"""
+import threading
+import multiprocessing
+
+from src.core.database import Database
+
+
+def _drain(store, worker_id, barrier, claimed):
+    """反复领取直到没有待处理任务"""
+    barrier.wait()
+    while True:
+        task = store.claim_next_task(worker_id)
+        if task is None:
+            return
+        claimed.append((task['id'], worker_id))
+
+
+def _drain_in_process(db_path, worker_id, start, results):
+    """在独立进程中领取（各进程有自己的连接池，竞争同一个数据库文件）"""
+    store = Database(db_path)
+    start.wait()
+    claimed = []
+    while True:
+        task = store.claim_next_task(worker_id)
+        if task is None:
+            break
+        claimed.append(task['id'])
+    results.put(claimed)
+
+
+def test_concurrent_claim_next_task_threads(db):
+    task_ids = db.create_tasks_batch([f'任务 {i}' for i in range(200)])
+    workers = 8
+    barrier = threading.Barrier(workers)
+    claimed = []
+
+    threads = [
+        threading.Thread(target=_drain, args=(db, f'w{i}', barrier, claimed))
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = [task_id for task_id, _ in claimed]
+    assert len(ids) == len(set(ids)) == len(task_ids)
+    assert set(ids) == set(task_ids)
+    # 数据库中记录的领取者与实际拿到任务的执行器一致
+    for task_id, worker_id in claimed:
+        assert db.get_task(task_id, full_output=False)['claimed_by'] == worker_id
+    assert db.get_stats()['处理中'] == len(task_ids)
+
+
+def test_concurrent_claim_task_single_winner(db):
+    task_id = db.create_task('u1', '只能被领取一次')
+    workers = 8
+    barrier = threading.Barrier(workers)
+    results = []
+
+    def claim(worker_id):
+        barrier.wait()
+        results.append(db.claim_task(task_id, worker_id))
+
+    threads = [threading.Thread(target=claim, args=(f'w{i}',)) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [task for task in results if task is not None]
+    assert len(winners) == 1
+    assert db.get_task(task_id)['claimed_by'] == winners[0]['claimed_by']
+
+
+def test_concurrent_claim_next_task_processes(tmp_path):
+    db_path = str(tmp_path / 'tasks.db')
+    task_ids = Database(db_path).create_tasks_batch([f'任务 {i}' for i in range(100)])
+
+    ctx = multiprocessing.get_context('spawn')
+    start = ctx.Event()
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=_drain_in_process, args=(db_path, f'p{i}', start, results))
+        for i in range(4)
+    ]
+    for process in processes:
+        process.start()
+    start.set()
+    claimed = [task_id for _ in processes for task_id in results.get(timeout=60)]
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    assert len(claimed) == len(set(claimed)) == len(task_ids)
+    assert set(claimed) == set(task_ids)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+CLI 执行引擎测试 - 用 Python 子进程模拟 Claude CLI：输出读取、超时及结束进程组
+"""
+import os
+import sys
+import time
+import textwrap
+
+import pytest
+
+from src.claude.cli_engine import CliEngine
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='进程组结束方式依赖 POSIX 信号')
+
+
+@pytest.fixture
+def engine():
+    engine = CliEngine()
+    yield engine
+    engine.close()
+    if engine._loop is not None:
+        engine._loop.call_soon_threadsafe(engine._loop.stop)
+
+
+def _python(script):
+    return [sys.executable, '-c', textwrap.dedent(script)]
+
+
+def _alive(pid):
+    """进程是否仍在运行（已退出但未被回收的僵尸进程视为已结束）"""
+    try:
+        with open(f'/proc/{pid}/stat') as fp:
+            return fp.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+def _wait_dead(pid, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not _alive(pid):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_reads_stdin_and_streams_lines(engine, tmp_path):
+    lines = []
+    result = engine.run(
+        _python('''
+            import sys, os
+            data = sys.stdin.read()
+            print('cwd=' + os.getcwd())
+            print(data.upper())
+        '''),
+        '你好 claude', str(tmp_path), timeout=30, on_line=lines.append
+    )
+
+    assert result['success'] is True
+    assert result['error'] is None
+    assert result['output'] == f'cwd={tmp_path}\n你好 CLAUDE\n'
+    assert lines == [f'cwd={tmp_path}\n', '你好 CLAUDE\n']
+    assert result['first_output_ms'] is not None
+
+
+def test_nonzero_exit_returns_output_as_error(engine, tmp_path):
+    result = engine.run(
+        _python('''
+            import sys
+            print('出错了', file=sys.stderr)
+            sys.exit(3)
+        '''),
+        '', str(tmp_path), timeout=30
+    )
+
+    assert result['success'] is False
+    assert result['output'] is None
+    assert '出错了' in result['error']
+
+
+def test_long_line_without_newline(engine, tmp_path):
+    # 超过 StreamReader 默认 64KB 单行上限、且不以换行结尾的输出
+    result = engine.run(
+        _python('''
+            import sys
+            sys.stdout.write('x' * 300000)
+        '''),
+        '', str(tmp_path), timeout=30
+    )
+
+    assert result['success'] is True
+    assert result['output'] == 'x' * 300000
+
+
+def test_large_stdin_while_reading_output(engine, tmp_path):
+    # 子进程边读边写，标准输入和输出都超过管道缓冲区时不能互相等待
+    text = '行\n' * 200000
+    result = engine.run(
+        _python('''
+            import sys
+            for line in sys.stdin:
+                sys.stdout.write(line)
+        '''),
+        text, str(tmp_path), timeout=30
+    )
+
+    assert result['success'] is True
+    assert result['output'] == text
+
+
+def test_callback_error_does_not_stop_reading(engine, tmp_path):
+    def on_line(line):
+        raise RuntimeError('回调失败')
+
+    result = engine.run(_python('print(1); print(2)'), '', str(tmp_path), timeout=30, on_line=on_line)
+
+    assert result['success'] is True
+    assert result['output'] == '1\n2\n'
+
+
+def test_timeout_kills_process_group(engine, tmp_path):
+    pid_file = tmp_path / 'child.pid'
+    started = time.monotonic()
+    result = engine.run(
+        _python(f'''
+            import subprocess, sys, time
+            # CLI 启动的子进程（如 MCP 服务器）也必须在超时后结束
+            child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+            with open({str(pid_file)!r}, 'w') as fp:
+                fp.write(str(child.pid))
+            print('started', flush=True)
+            time.sleep(60)
+        '''),
+        '', str(tmp_path), timeout=2
+    )
+    elapsed = time.monotonic() - started
+
+    assert result['success'] is False
+    assert '超时' in result['error']
+    assert elapsed < 2 + CliEngine.KILL_WAIT
+    assert _wait_dead(int(pid_file.read_text()))
+    assert not engine._processes
+
+
+def test_timeout_while_output_keeps_streaming(engine, tmp_path):
+    # 持续有输出也不能延长截止时间
+    lines = []
+    started = time.monotonic()
+    result = engine.run(
+        _python('''
+            import time
+            while True:
+                print('tick', flush=True)
+                time.sleep(0.05)
+        '''),
+        '', str(tmp_path), timeout=1, on_line=lines.append
+    )
+
+    assert result['success'] is False
+    assert '超时' in result['error']
+    assert time.monotonic() - started < 1 + CliEngine.KILL_WAIT
+    assert lines
+
+
+def test_close_kills_running_processes(engine, tmp_path):
+    pid_file = tmp_path / 'cli.pid'
+    future = engine.submit(
+        _python(f'''
+            import os, time
+            with open({str(pid_file)!r}, 'w') as fp:
+                fp.write(str(os.getpid()))
+            time.sleep(60)
+        '''),
+        '', str(tmp_path), timeout=60
+    )
+    deadline = time.monotonic() + 10
+    while not pid_file.exists() or not pid_file.read_text():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+    engine.close()
+
+    result = future.result(timeout=10)
+    assert result['success'] is False
+    assert _wait_dead(int(pid_file.read_text()))
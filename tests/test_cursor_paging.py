@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+键集分页测试 - 游标翻页不重复、不遗漏，且不受翻页期间新增任务的影响
+"""
+import pytest
+
+from src.core.task_store import TaskStore
+
+
+def _all_pages(store, status=None, limit=3):
+    """按游标翻完所有页，返回任务 ID 列表和页数"""
+    seen, pages, after = [], 0, None
+    while True:
+        page = store.list_tasks_page(status, limit=limit, after=after)
+        seen.extend(task['id'] for task in page['tasks'])
+        pages += 1
+        after = page['next_cursor']
+        if after is None:
+            return seen, pages
+
+
+def test_cursor_roundtrip():
+    task = {'created_at': '2024-01-01T00:00:00.000001', 'id': '任务-1'}
+    cursor = TaskStore.encode_cursor(task)
+
+    assert '=' not in cursor
+    assert TaskStore.decode_cursor(cursor) == (task['created_at'], task['id'])
+
+
+@pytest.mark.parametrize('cursor', ['', '不是游标', 'bm90IGpzb24', TaskStore.encode_cursor({'created_at': 1, 'id': 2})[:-2]])
+def test_invalid_cursor(store, cursor):
+    with pytest.raises(ValueError):
+        TaskStore.decode_cursor(cursor)
+    with pytest.raises(ValueError):
+        store.list_tasks(after=cursor or '!')
+
+
+def test_pages_cover_all_tasks_with_same_timestamp(store):
+    # 批量创建的任务 created_at 相同，按 id 区分先后
+    task_ids = store.create_tasks_batch([f'任务 {i}' for i in range(10)])
+
+    seen, pages = _all_pages(store, limit=3)
+
+    assert pages == 4
+    assert len(seen) == len(set(seen)) == 10
+    assert seen == sorted(task_ids, reverse=True)
+
+
+def test_exact_multiple_has_no_empty_last_page(store):
+    store.create_tasks_batch([f'任务 {i}' for i in range(6)])
+
+    first = store.list_tasks_page(limit=3)
+    second = store.list_tasks_page(limit=3, after=first['next_cursor'])
+
+    assert len(second['tasks']) == 3
+    assert second['next_cursor'] is None
+
+
+def test_cursor_matches_offset_paging(store):
+    store.create_tasks_batch([f'批次一 {i}' for i in range(4)])
+    store.create_tasks_batch([f'批次二 {i}' for i in range(5)])
+
+    seen, _ = _all_pages(store, limit=4)
+    by_offset = [task['id'] for offset in range(0, 9, 4) for task in store.list_tasks(limit=4, offset=offset)]
+
+    assert seen == by_offset
+
+
+def test_new_tasks_do_not_shift_pages(store):
+    store.create_tasks_batch([f'任务 {i}' for i in range(6)])
+    first = store.list_tasks_page(limit=3)
+
+    # 翻页期间新增的任务排在最前面，不会让后续页面重复或跳过任务
+    store.create_task('u1', '新任务')
+    second = store.list_tasks_page(limit=3, after=first['next_cursor'])
+
+    ids = [task['id'] for task in first['tasks'] + second['tasks']]
+    assert len(set(ids)) == 6
+    assert second['next_cursor'] is None
+
+
+def test_cursor_with_status_filter(store):
+    task_ids = store.create_tasks_batch([f'任务 {i}' for i in range(8)])
+    for task_id in task_ids[::2]:
+        store.update_status(task_id, '已完成', result='ok')
+
+    seen, _ = _all_pages(store, '已完成', limit=3)
+
+    assert seen == sorted(task_ids[::2], reverse=True)
+
+
+def test_cursor_across_main_and_archive(db):
+    task_ids = db.create_tasks_batch([f'任务 {i}' for i in range(9)])
+    archived = task_ids[1::3]
+    for task_id in archived:
+        db.update_status(task_id, '已完成', result='ok')
+        db.archive_task(task_id)
+    assert db.move_archived_tasks(pause=0) == len(archived)
+
+    # 全部任务：主库与冷库合并后统一排序分页
+    seen, _ = _all_pages(db, limit=2)
+    assert seen == sorted(task_ids, reverse=True)
+
+    seen, _ = _all_pages(db, db.ARCHIVED_STATUS, limit=2)
+    assert seen == sorted(archived, reverse=True)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Web 管理界面测试 - create_app 传入的任务存储被所有服务共享
+"""
+import os
+import importlib
+
+import pytest
+
+pytest.importorskip('flask')
+
+# 配置模块导入时校验 Telegram 配置，测试不会发送消息
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'test-token')
+os.environ.setdefault('TELEGRAM_CHAT_ID', '0')
+
+from src.claude.executor import ClaudeExecutor
+from src.claude.progress_store import SharedProgressStore
+from src.core.memory_store import MemoryTaskStore
+
+
+@pytest.fixture
+def dashboard(tmp_path, monkeypatch):
+    # 模块导入时创建的配置管理器使用相对路径的数据库，放到临时目录中
+    monkeypatch.chdir(tmp_path)
+    dashboard = importlib.import_module('src.web.dashboard')
+    yield dashboard
+    if dashboard.auto_executor is not None:
+        dashboard.auto_executor._stop_workers()
+
+
+def test_create_app_shares_store(dashboard):
+    store = MemoryTaskStore()
+    dashboard.create_app(store)
+
+    assert dashboard.db is store
+    assert dashboard.claude_executor.db is store
+    assert dashboard.auto_executor.db is store
+    assert dashboard.auto_executor.executor.db is store
+    assert dashboard.history_manager is dashboard.claude_executor.history_manager
+    # 内存存储时进度只保存在内存中，不写入其他数据库
+    assert not isinstance(ClaudeExecutor._progress, SharedProgressStore)
+
+
+def test_create_app_replaces_previous_store(dashboard, tmp_path):
+    from src.core.database import Database
+
+    dashboard.create_app(Database(str(tmp_path / 'tasks.db')))
+    assert isinstance(ClaudeExecutor._progress, SharedProgressStore)
+    old_workers = list(dashboard.auto_executor.workers)
+
+    store = MemoryTaskStore()
+    dashboard.create_app(store)
+
+    assert dashboard.db is store
+    assert not isinstance(ClaudeExecutor._progress, SharedProgressStore)
+    assert not any(worker.is_alive() for worker in old_workers)
+
+
+def test_task_api_uses_store(dashboard):
+    store = MemoryTaskStore()
+    client = dashboard.create_app(store).test_client()
+
+    response = client.post('/api/tasks', json={'message': '网页创建的任务', 'priority': 'high'})
+    assert response.status_code == 201
+    task_id = response.get_json()['task_id']
+
+    assert store.get_task(task_id)['message'] == '网页创建的任务'
+    assert client.get('/api/stats').get_json()['待处理'] == 1
+    assert [task['id'] for task in client.get('/api/tasks').get_json()] == [task_id]
+    assert client.get(f'/api/tasks/{task_id}').get_json()['priority'] == 'high'
+
+
+def test_task_api_cursor_paging(dashboard):
+    store = MemoryTaskStore()
+    task_ids = store.create_tasks_batch([f'任务 {i}' for i in range(5)])
+    client = dashboard.create_app(store).test_client()
+
+    seen, after = [], ''
+    while after is not None:
+        page = client.get('/api/tasks', query_string={'limit': 2, 'after': after}).get_json()
+        seen.extend(task['id'] for task in page['tasks'])
+        after = page['next_cursor']
+
+    assert seen == sorted(task_ids, reverse=True)
+    assert client.get('/api/tasks', query_string={'after': '无效'}).status_code == 400
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+迁移执行器测试 - 按版本顺序执行、失败回滚、分批回填及中断后续跑
+"""
+import pytest
+
+from src.core import migrations
+from src.core.db_pool import ConnectionPool
+from src.core.migrations import MigrationRunner
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'migrate.db'))
+    yield pool
+    pool.close_all()
+
+
+def _create_items(cursor):
+    cursor.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+    cursor.executemany('INSERT INTO items (value) VALUES (?)', [(i,) for i in range(10)])
+
+
+def _add_doubled(cursor):
+    cursor.execute('ALTER TABLE items ADD COLUMN doubled INTEGER')
+
+
+def _backfill_doubled(cursor, state, chunk_size):
+    """按 id 区间分批回填，返回最后处理的 id，处理完返回 None"""
+    last_id = int(state or 0)
+    rows = cursor.execute(
+        'SELECT id FROM items WHERE id > ? ORDER BY id LIMIT ?', (last_id, chunk_size)
+    ).fetchall()
+    if not rows:
+        return None
+    cursor.execute(
+        'UPDATE items SET doubled = value * 2 WHERE id > ? AND id <= ?', (last_id, rows[-1]['id'])
+    )
+    return str(rows[-1]['id'])
+
+
+def _versions(pool):
+    with pool.connection() as conn:
+        return [tuple(row) for row in conn.execute(
+            'SELECT version, name, backfill_state, backfill_done FROM schema_version ORDER BY version'
+        )]
+
+
+def _doubled(pool):
+    with pool.connection() as conn:
+        return [row[0] for row in conn.execute('SELECT doubled FROM items ORDER BY id')]
+
+
+def test_apply_in_order_and_record_versions(pool, monkeypatch):
+    applied = []
+
+    def upgrade(version):
+        def run(cursor):
+            applied.append(version)
+            cursor.execute(f'CREATE TABLE t{version} (id INTEGER)')
+        return run
+
+    # 注册顺序与版本号无关，按版本号执行
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [])
+    for version in (2, 1, 3):
+        migrations.migration(version, f'm{version}')(upgrade(version))
+
+    runner = MigrationRunner(pool, pause=0)
+    runner.run()
+
+    assert applied == [1, 2, 3]
+    assert runner.current_version() == 3
+    assert [(v, name, done) for v, name, _, done in _versions(pool)] == [(1, 'm1', 1), (2, 'm2', 1), (3, 'm3', 1)]
+
+    # 再次执行不会重复迁移
+    MigrationRunner(pool, pause=0).run()
+    assert applied == [1, 2, 3]
+
+
+def test_only_new_migrations_run_after_upgrade(pool, monkeypatch):
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [(1, 'items', _create_items, None)])
+    MigrationRunner(pool, pause=0).run()
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [
+        (1, 'items', lambda cursor: pytest.fail('已执行的迁移不应再次执行'), None),
+        (2, 'doubled', _add_doubled, None),
+    ])
+    runner = MigrationRunner(pool, pause=0)
+    runner.run()
+    assert runner.current_version() == 2
+
+
+def test_failed_upgrade_rolls_back(pool, monkeypatch):
+    def broken(cursor):
+        cursor.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('迁移失败')
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [
+        (1, 'items', _create_items, None),
+        (2, 'broken', broken, None),
+    ])
+    with pytest.raises(RuntimeError):
+        MigrationRunner(pool, pause=0).run()
+
+    # 同一个排他事务中的所有结构变更一起回滚
+    assert MigrationRunner(pool).current_version() == 0
+    with pool.connection() as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'items' not in tables
+    assert 'half_done' not in tables
+
+
+def test_backfill_runs_in_chunks(pool, monkeypatch):
+    chunks = []
+
+    def backfill(cursor, state, chunk_size):
+        chunks.append(state)
+        return _backfill_doubled(cursor, state, chunk_size)
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [
+        (1, 'items', _create_items, None),
+        (2, 'doubled', _add_doubled, backfill),
+    ])
+    MigrationRunner(pool, chunk_size=3, pause=0).run()
+
+    assert _doubled(pool) == [i * 2 for i in range(10)]
+    # 每批从上一批保存的断点继续：3 + 3 + 3 + 1，最后一次确认没有剩余
+    assert chunks == [None, '3', '6', '9', '10']
+    assert _versions(pool)[-1] == (2, 'doubled', None, 1)
+
+
+def test_backfill_resumes_after_interruption(pool, monkeypatch):
+    calls = []
+
+    def interrupted(cursor, state, chunk_size):
+        calls.append(state)
+        if len(calls) == 3:
+            raise RuntimeError('回填中断')
+        return _backfill_doubled(cursor, state, chunk_size)
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [
+        (1, 'items', _create_items, None),
+        (2, 'doubled', _add_doubled, interrupted),
+    ])
+    with pytest.raises(RuntimeError):
+        MigrationRunner(pool, chunk_size=4, pause=0).run()
+
+    # 结构变更已完成，已提交的两批回填保留，断点记录在 schema_version 中
+    assert _versions(pool)[-1] == (2, 'doubled', '8', 0)
+    assert _doubled(pool) == [i * 2 for i in range(8)] + [None, None]
+
+    resumed = []
+
+    def resume(cursor, state, chunk_size):
+        resumed.append(state)
+        return _backfill_doubled(cursor, state, chunk_size)
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [
+        (1, 'items', _create_items, None),
+        (2, 'doubled', _add_doubled, resume),
+    ])
+    MigrationRunner(pool, chunk_size=4, pause=0).run()
+
+    assert resumed[0] == '8'
+    assert _doubled(pool) == [i * 2 for i in range(10)]
+    assert _versions(pool)[-1] == (2, 'doubled', None, 1)
+
+
+def test_repo_migrations_on_empty_database(pool):
+    runner = MigrationRunner(pool, pause=0)
+    runner.run()
+
+    assert runner.current_version() == migrations.MIGRATIONS[-1][0]
+    with pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM schema_version WHERE backfill_done = 0').fetchone()[0] == 0
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'tasks', 'task_outputs', 'task_events', 'task_counters', 'history_config'} <= tables
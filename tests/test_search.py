@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+全文检索测试 - 完整输出入索引、两个字符的关键词走双字词索引、其他工具修改 tasks 表不受影响
+"""
+import sqlite3
+
+import pytest
+
+from src.core.migrations import search_bigrams
+
+
+def _ids(result):
+    return [task['id'] for task in result['tasks']]
+
+
+@pytest.fixture
+def search_db(db):
+    if not db.search_enabled:
+        pytest.skip('当前 SQLite 不支持 FTS5 trigram')
+    return db
+
+
+def test_search_bigrams():
+    assert search_bigrams('使用中文检索 db 的 sqlite.db, go!', '结果') == ' 使用 用中 中文 文检 检索 db go 结果 '
+    assert search_bigrams('', None) == ''
+
+
+def test_long_term_matches_full_output(search_db):
+    task_id = search_db.create_task('u1', '生成报告')
+    output = '开头' + 'x' * (search_db.INLINE_OUTPUT_LIMIT * 2) + '尾部关键字'
+    search_db.update_status(task_id, '已完成', result=output)
+
+    # 外部存储的大输出按完整内容索引，而不只是 tasks 表中的预览
+    result = search_db.search_tasks('尾部关键字')
+    assert _ids(result) == [task_id]
+    assert '<mark>尾部关键字</mark>' in result['tasks'][0]['result_snippet']
+
+
+def test_two_character_terms_use_bigrams(search_db):
+    cjk = search_db.create_task('u1', '使用中文检索功能')
+    word = search_db.create_task('u1', 'deploy the go service')
+    search_db.create_task('u1', 'golang 服务')
+
+    assert _ids(search_db.search_tasks('中文')) == [cjk]
+    assert _ids(search_db.search_tasks('文检')) == [cjk]
+    # 不相邻的两个字不匹配
+    assert _ids(search_db.search_tasks('中检')) == []
+    # 英文等按单词匹配，不匹配 golang
+    assert _ids(search_db.search_tasks('GO')) == [word]
+    # 与长关键词组合时全部匹配
+    assert _ids(search_db.search_tasks('中文 检索功')) == [cjk]
+    assert search_db.search_tasks('中文')['tasks'][0]['message_snippet'] == '使用<mark>中文</mark>检索功能'
+
+    with pytest.raises(ValueError):
+        search_db.search_tasks('中')
+
+
+def test_edited_message_is_reindexed(search_db):
+    task_id = search_db.create_task('u1', '旧的任务描述')
+    search_db.update_task(task_id, message='新的任务描述')
+
+    assert _ids(search_db.search_tasks('旧的')) == []
+    assert _ids(search_db.search_tasks('新的')) == [task_id]
+
+
+def test_archived_tasks_are_searchable(search_db):
+    task_id = search_db.create_task('u1', '归档后的任务')
+    search_db.update_status(task_id, '已完成', result='y' * (search_db.INLINE_OUTPUT_LIMIT * 2) + '冷库输出')
+    search_db.archive_task(task_id)
+    assert search_db.move_archived_tasks(pause=0) == 1
+
+    assert _ids(search_db.search_tasks('冷库输出')) == [task_id]
+    assert _ids(search_db.search_tasks('归档')) == [task_id]
+
+    # 冷库 VACUUM 后 rowid 可能变化，索引由应用重新写入
+    search_db.full_vacuum('archive')
+    assert _ids(search_db.search_tasks('冷库输出')) == [task_id]
+
+
+def test_other_connections_can_modify_tasks(search_db):
+    task_id = search_db.create_task('u1', '保留的任务')
+    search_db.update_status(task_id, '已完成', result='z' * (search_db.INLINE_OUTPUT_LIMIT * 2))
+    search_db.writer.flush()
+
+    # 没有注册任何应用函数的连接（sqlite3 命令行、数据库浏览器等）
+    conn = sqlite3.connect(search_db.db_path)
+    try:
+        conn.execute('''
+            INSERT INTO tasks (id, user_id, message, status, priority, created_at, updated_at)
+            VALUES ('external', 'u2', '外部工具插入的任务', '待处理', 'normal', '2024-01-01', '2024-01-01')
+        ''')
+        conn.execute("UPDATE tasks SET message = '外部工具修改的任务' WHERE id = 'external'")
+        conn.execute("UPDATE tasks SET result = 'done' WHERE id = ?", (task_id,))
+        conn.commit()
+        assert _ids(search_db.search_tasks('外部工具修改')) == ['external']
+
+        conn.execute('DELETE FROM tasks')
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert _ids(search_db.search_tasks('任务')) == []
+    with search_db.get_connection() as db_conn:
+        assert db_conn.execute('SELECT COUNT(*) FROM tasks_fts').fetchone()[0] == 0
+
+
+def test_paging(search_db):
+    task_ids = search_db.create_tasks_batch([f'分页任务 {i}' for i in range(5)])
+
+    seen, cursor = [], None
+    while True:
+        page = search_db.search_tasks('分页任务', limit=2, cursor=cursor)
+        seen.extend(_ids(page))
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert sorted(seen) == sorted(task_ids)
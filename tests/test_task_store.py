@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+任务存储契约测试 - 同一组用例分别在 SQLite（Database）和内存（MemoryTaskStore）实现上运行
+"""
+import time
+from datetime import datetime
+
+import pytest
+
+
+def _ordered(tasks):
+    """按列表接口约定的 (created_at, id) 倒序排列"""
+    return sorted(tasks, key=lambda t: (t['created_at'], t['id']), reverse=True)
+
+
+def _flush(store):
+    """等待经写入队列提交的写操作落盘（内存实现没有写入队列）"""
+    writer = getattr(store, 'writer', None)
+    if writer:
+        writer.flush()
+
+
+def test_create_and_get(store):
+    task_id = store.create_task('u1', '第一个任务', 'high')
+    task = store.get_task(task_id)
+
+    assert task['id'] == task_id
+    assert task['user_id'] == 'u1'
+    assert task['message'] == '第一个任务'
+    assert task['status'] == '待处理'
+    assert task['priority'] == 'high'
+    assert task['priority_rank'] == 0
+    assert task['claimed_by'] is None
+    assert store.get_task('不存在') is None
+
+
+def test_create_tasks_batch(store):
+    task_ids = store.create_tasks_batch(['a', {'message': 'b', 'priority': 'low', 'user_id': 'u2'}], user_id='u1')
+
+    assert len(task_ids) == 2
+    first, second = (store.get_task(task_id) for task_id in task_ids)
+    assert (first['message'], first['user_id'], first['priority']) == ('a', 'u1', 'normal')
+    assert (second['message'], second['user_id'], second['priority']) == ('b', 'u2', 'low')
+
+    with pytest.raises(ValueError):
+        store.create_tasks_batch(['c', {'priority': 'high'}])
+    # 校验失败时不写入任何任务
+    assert len(store.list_tasks()) == 2
+
+
+def test_list_tasks_order_and_filter(store):
+    task_ids = store.create_tasks_batch([f'任务 {i}' for i in range(5)])
+    store.update_status(task_ids[0], '已完成', result='ok')
+
+    tasks = store.list_tasks()
+    assert [t['id'] for t in tasks] == [t['id'] for t in _ordered(tasks)]
+    assert {t['id'] for t in tasks} == set(task_ids)
+
+    assert [t['id'] for t in store.list_tasks('已完成')] == [task_ids[0]]
+    assert len(store.list_tasks('待处理')) == 4
+    assert len(store.list_tasks(limit=2)) == 2
+
+
+def test_list_tasks_page_cursor(store):
+    task_ids = store.create_tasks_batch([f'任务 {i}' for i in range(7)])
+
+    seen = []
+    after = None
+    while True:
+        page = store.list_tasks_page(limit=3, after=after)
+        seen.extend(t['id'] for t in page['tasks'])
+        after = page['next_cursor']
+        if after is None:
+            break
+
+    assert len(seen) == len(set(seen)) == 7
+    assert seen == [t['id'] for t in _ordered(store.list_tasks())]
+    assert set(seen) == set(task_ids)
+
+
+def test_update_status(store):
+    task_id = store.create_task('u1', '任务')
+
+    store.update_status(task_id, '处理中')
+    assert store.get_task(task_id)['started_at'] is not None
+
+    store.update_status(task_id, '失败', error='出错了')
+    task = store.get_task(task_id)
+    assert task['status'] == '失败'
+    assert task['error'] == '出错了'
+    assert task['completed_at'] is not None
+
+    store.update_status_async(task_id, '已完成', result='结果').result()
+    task = store.get_task(task_id)
+    assert (task['status'], task['result']) == ('已完成', '结果')
+
+
+def test_update_and_delete_only_pending(store):
+    task_id = store.create_task('u1', '原内容', 'low')
+
+    assert store.update_task(task_id, message='新内容', priority='high')
+    task = store.get_task(task_id)
+    assert (task['message'], task['priority'], task['priority_rank']) == ('新内容', 'high', 0)
+
+    store.update_status(task_id, '处理中')
+    with pytest.raises(ValueError):
+        store.update_task(task_id, message='不允许')
+    with pytest.raises(ValueError):
+        store.delete_task(task_id)
+
+    other_id = store.create_task('u1', '待删除')
+    assert store.delete_task(other_id)
+    assert store.get_task(other_id) is None
+
+
+def test_archive_task(store):
+    task_id = store.create_task('u1', '任务')
+    with pytest.raises(ValueError):
+        store.archive_task(task_id)
+
+    store.update_status(task_id, '已完成', result='ok')
+    assert store.archive_task(task_id)
+    assert store.get_task(task_id)['status'] == '已归档'
+
+
+def test_claim_next_task_priority(store):
+    low = store.create_task('u1', 'low', 'low')
+    normal = store.create_task('u1', 'normal', 'normal')
+    high = store.create_task('u1', 'high', 'high')
+
+    claimed = [store.claim_next_task('w1')['id'] for _ in range(3)]
+    assert claimed == [high, normal, low]
+    assert store.claim_next_task('w1') is None
+
+    task = store.get_task(high)
+    assert (task['status'], task['claimed_by']) == ('处理中', 'w1')
+    assert task['started_at'] is not None
+
+
+def test_claim_next_task_custom_priority_order(store):
+    high = store.create_task('u1', 'high', 'high')
+    low = store.create_task('u1', 'low', 'low')
+
+    assert store.claim_next_task('w1', ['low', 'normal', 'high'])['id'] == low
+    assert store.claim_next_task('w1', ['low', 'normal', 'high'])['id'] == high
+
+
+def test_claim_task(store):
+    task_id = store.create_task('u1', '任务')
+
+    task = store.claim_task(task_id, 'w1')
+    assert (task['id'], task['status'], task['claimed_by']) == (task_id, '处理中', 'w1')
+    # 正在执行的任务不能再被领取
+    assert store.claim_task(task_id, 'w2') is None
+    assert store.get_task(task_id)['claimed_by'] == 'w1'
+    assert store.claim_task('不存在', 'w1') is None
+
+    # 失败的任务可以重新领取（重试）
+    store.update_status(task_id, '失败', error='x')
+    assert store.claim_task(task_id, 'w2')['claimed_by'] == 'w2'
+
+
+def test_get_stats(store):
+    task_ids = store.create_tasks_batch(['a', 'b', 'c', 'd'])
+    store.claim_task(task_ids[0], 'w1')
+    store.update_status(task_ids[1], '已完成', result='ok')
+    store.update_status(task_ids[2], '失败', error='x')
+
+    stats = store.get_stats()
+    assert set(stats) == set(store.TASK_STATUSES)
+    assert stats['待处理'] == 1
+    assert stats['处理中'] == 1
+    assert stats['已完成'] == 1
+    assert stats['失败'] == 1
+    assert stats['已归档'] == 0
+
+    store.delete_task(task_ids[3])
+    assert store.get_stats()['待处理'] == 0
+
+
+def test_events(store):
+    start = store.latest_event_id()
+    task_id = store.create_task('u1', '任务')
+    store.claim_task(task_id, 'w1')
+    store.update_status(task_id, '已完成', result='ok')
+
+    events = store.events_since(start)
+    assert [(e['event_type'], e['old_status'], e['new_status']) for e in events] == [
+        ('created', None, '待处理'),
+        ('status', '待处理', '处理中'),
+        ('status', '处理中', '已完成'),
+    ]
+    assert events[1]['worker_id'] == 'w1'
+    assert store.latest_event_id() == events[-1]['event_id']
+    assert store.events_since(store.latest_event_id()) == []
+
+
+def test_release_stale_claims_by_heartbeat(store):
+    stale_id = store.create_task('u1', '执行者已退出')
+    live_id = store.create_task('u1', '仍在执行')
+    store.claim_task(stale_id, 'w1')
+    store.claim_task(live_id, 'w2')
+
+    time.sleep(0.01)
+    cutoff = datetime.now().isoformat()
+    time.sleep(0.01)
+    store.heartbeat(live_id)
+    _flush(store)
+
+    assert store.release_stale_claims(cutoff) == [stale_id]
+    stale = store.get_task(stale_id)
+    assert (stale['status'], stale['claimed_by'], stale['started_at']) == ('待处理', None, None)
+    assert store.get_task(live_id)['status'] == '处理中'
+    # 释放后可以重新领取
+    assert store.claim_next_task('w3')['id'] == stale_id
+
+
+def test_release_stale_claims_by_worker(store):
+    dead_id = store.create_task('u1', '领取者已退出')
+    alive_id = store.create_task('u1', '领取者仍在运行')
+    done_id = store.create_task('u1', '已完成')
+    store.claim_task(dead_id, 'dead')
+    store.claim_task(alive_id, 'alive')
+    store.claim_task(done_id, 'dead')
+    store.update_status(done_id, '已完成', result='ok')
+
+    released = store.release_stale_claims('', is_worker_alive=lambda worker_id: worker_id != 'dead')
+
+    assert released == [dead_id]
+    assert store.get_task(alive_id)['status'] == '处理中'
+    assert store.get_task(done_id)['status'] == '已完成'
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+写入队列测试 - 批量提交、失败隔离、提交后完成 Future、关闭时落盘
+"""
+import threading
+
+import pytest
+
+from src.core.db_pool import ConnectionPool
+from src.core.write_queue import WriteQueue
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'queue.db'))
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT NOT NULL)')
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def queue(pool):
+    queue = WriteQueue(pool, max_batch=50, flush_interval=0.05)
+    yield queue
+    queue.close()
+
+
+def _insert(pool, value):
+    """写操作：插入一行"""
+    with pool.connection() as conn:
+        conn.execute('INSERT INTO items (value) VALUES (?)', (value,))
+        return value
+
+
+def _count(pool, value=None):
+    """在调用线程自己的连接上读取已提交的行数"""
+    with pool.connection() as conn:
+        if value is None:
+            return conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+        return conn.execute('SELECT COUNT(*) FROM items WHERE value = ?', (value,)).fetchone()[0]
+
+
+def test_future_completes_after_commit(pool, queue):
+    future = queue.submit(_insert, pool, 'a')
+
+    assert future.result(timeout=5) == 'a'
+    # Future 完成时事务已提交，其他线程的连接立即可见
+    assert _count(pool, 'a') == 1
+
+
+def test_concurrent_writes_are_batched(pool, queue):
+    batches = []
+    original = queue._commit_batch
+
+    def record_batch(batch):
+        batches.append(len(batch))
+        original(batch)
+
+    queue._commit_batch = record_batch
+    threads = []
+    futures = []
+    futures_lock = threading.Lock()
+
+    def submit(i):
+        future = queue.submit(_insert, pool, f'v{i}')
+        with futures_lock:
+            futures.append(future)
+
+    for i in range(40):
+        threads.append(threading.Thread(target=submit, args=(i,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for future in futures:
+        future.result(timeout=5)
+
+    assert _count(pool) == 40
+    assert sum(batches) == 40
+    # 同时提交的写操作合并到少数几个事务中
+    assert len(batches) < 40
+
+
+def test_failed_operation_is_isolated(pool, queue):
+    def fail():
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO items (value) VALUES ('rolled back')")
+            raise RuntimeError('写操作失败')
+
+    # 连续提交，三个操作落在同一个收集窗口内
+    ok_before = queue.submit(_insert, pool, 'before')
+    failed = queue.submit(fail)
+    ok_after = queue.submit(_insert, pool, 'after')
+
+    assert ok_before.result(timeout=5) == 'before'
+    assert ok_after.result(timeout=5) == 'after'
+    with pytest.raises(RuntimeError):
+        failed.result(timeout=5)
+    # 失败的操作回滚到自己的保存点，不影响同一批的其他写操作
+    assert _count(pool, 'rolled back') == 0
+    assert _count(pool, 'before') == 1
+    assert _count(pool, 'after') == 1
+
+
+def test_flush_waits_for_earlier_writes(pool, queue):
+    for i in range(10):
+        queue.submit(_insert, pool, f'v{i}')
+    queue.flush(timeout=5)
+    assert _count(pool) == 10
+
+
+def test_close_commits_pending_writes(pool):
+    queue = WriteQueue(pool, flush_interval=1)
+    futures = [queue.submit(_insert, pool, f'v{i}') for i in range(5)]
+    queue.close()
+
+    assert [future.result(timeout=0) for future in futures] == [f'v{i}' for i in range(5)]
+    assert _count(pool) == 5
+
+    rejected = queue.submit(_insert, pool, 'late')
+    with pytest.raises(RuntimeError):
+        rejected.result(timeout=0)
+    assert _count(pool, 'late') == 0